@@ -1,24 +1,53 @@
+import argparse
 from rich.console import Console
 from rich.panel import Panel
 from rich.table import Table
 import socket
-import struct
 import psutil
 import time
-import json
-import subprocess
 import threading
-import re
+from alertflow import AlertChannel
+from alertrules import load_rules
+import pdu
+from probe import ProbeEngine
+from reliability import MAX_RTO, RetransmitQueue, TimerWheel, backoff_delay
+import rxpool
+from rxpool import DatagramReceiver
+from scheduler import TaskScheduler, periodic
+import telemetry
+from telemetry import AgentTelemetry
+import throughput
 
 UDP_PORT = 5005
-BUFFER_SIZE = 1024
+# Seconds the listener waits for datagrams before reporting that it is idle.
+LISTEN_TIMEOUT = 1.0
+RECEIVE_WINDOW = 8
+MAX_BATCH_SAMPLES = pdu.MAX_BATCH_SAMPLES
+BATCH_FLUSH_INTERVAL = 1.0
+REGISTRATION_BACKOFF_BASE = 0.5
+REGISTRATION_BACKOFF_CAP = 30.0
+# Well under the server's AGENT_TIMEOUT, so a couple of lost heartbeats are tolerated.
+HEARTBEAT_INTERVAL = 5.0
 running = True
 task_completed = False
 task_completed_event = threading.Event()
-alert_conditions = {} 
+alert_engine = None
 task_logs = []
 alerts = []
-alert_timestamps = {}
+received_tasks = {}
+# task_id -> Event that stops the running (or still queued) instance of the task.
+task_stops = {}
+metric_batcher = None
+task_scheduler = None
+probe_engine = None
+alert_channel = None
+registration = None
+# Largest datagram accepted from the server (--max-datagram).
+max_datagram_size = rxpool.MAX_DATAGRAM_SIZE
+agent_telemetry = AgentTelemetry()
+timer_wheel = TimerWheel()
+# Result and batch PDUs awaiting an ACK, keyed by ("result", task_id) and ("batch", batch_sequence).
+transmissions = None
 console = Console()
 SERVER_IP = "10.0.4.10"
 
@@ -30,196 +59,237 @@ def get_agent_id():
         console.print(f"[bold yellow]Não foi possível detectar o nome do agente: {e}[/bold yellow]")
         return input("Insira o ID do Agente manualmente: ")
 
-def register_with_server(sock, server_ip, agent_id):
-    sequence_number = 1
-    register_message = struct.pack("!B H 3s", 1, sequence_number, agent_id.encode())
-    sock.sendto(register_message, (server_ip, UDP_PORT))
-
-    data, addr = sock.recvfrom(BUFFER_SIZE)
-    message_type, sequence_number, ack_agent_id = struct.unpack("!B H 3s", data)
-
-    if message_type == 2:
-        confirmation_ack = struct.pack("!B H 3s", 2, sequence_number, agent_id.encode())
-        sock.sendto(confirmation_ack, addr)
-
-        data, addr = sock.recvfrom(BUFFER_SIZE)
-        if len(data) >= 6:
-            ack_type, _, ack_agent_id = struct.unpack("!B H 3s", data)
-            if ack_type == 2 and ack_agent_id.decode().strip() == agent_id:
-                console.print(f"[bold green]Agente {agent_id} registado com sucesso![/bold green]")
-            else:
-                console.print(f"[bold red]Erro: Mensagem de confirmação inválida do servidor.[/bold red]")
-        else:
-            console.print(f"[bold red]Erro: Mensagem de confirmação inválida do servidor.[/bold red]")
-    else:
-        console.print(f"[bold red]Erro: Mensagem de confirmação inválida do servidor.[/bold red]")
-
-def encode_task_result(task_id, result):
-    result_data = result.encode()
-    return struct.pack(f"!B H {len(result_data)}s", 3, task_id, result_data)
-
-def decode_task(data):
-    sequence_number, task_id, task_type = struct.unpack("!H H B", data[1:6])
-    interface_length = data[6]
-    interface_check = data[7:7 + interface_length].decode()
-    task_data = data[7 + interface_length:-2]
-    frequency, duration = struct.unpack("!B B", data[-2:])
-    task = {
-        "Sequence_Number": sequence_number,
-        "Task_ID": task_id,
-        "Task_Type": task_type,
-        "Interface_Check": interface_check,
-        "Data": task_data.decode() if task_type not in [3, 4, 5] else socket.inet_ntoa(task_data),
-        "Frequency": frequency,
-        "Duration": duration
-    }
-    return task
-
-def measure_cpu_periodic(frequency, duration, task_id, sock, server_ip, agent_id):
-    start_time = time.time()
+class Registration:
+    """Agent side of the three-way handshake with the server.
+
+    A worker thread sends REGISTER with a fresh sequence number per attempt
+    and waits with jittered exponential backoff; the listener thread feeds it
+    the server's ACKs. The ACK of the current attempt is answered with the
+    confirmation, and the ACK that follows the confirmation completes the
+    registration. restart() runs the handshake again when the server asks
+    for it (a REGISTER from the server means it no longer knows this agent).
+    """
+
+    def __init__(self, sock, server_ip, agent_id):
+        self.sock = sock
+        self.server_ip = server_ip
+        self.agent_id = agent_id
+        self.sequence_number = 0
+        self.confirming = False
+        self.registered = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def restart(self):
+        if self.registered.is_set():
+            console.print("[bold yellow]O servidor pediu um novo registo.[/bold yellow]")
+            self.registered.clear()
+        self.start()
+
+    def run(self):
+        attempt = 0
+        while running and not self.registered.is_set():
+            with self.lock:
+                self.sequence_number = self.sequence_number % 65535 + 1
+                self.confirming = False
+                register_message = pdu.encode_identified(pdu.REGISTER, self.sequence_number, self.agent_id)
+            try:
+                self.sock.sendto(register_message, (self.server_ip, UDP_PORT))
+            except OSError as e:
+                console.print(f"[bold red]Erro ao enviar o registo: {e}[/bold red]")
+            if self.registered.wait(backoff_delay(attempt, REGISTRATION_BACKOFF_BASE, REGISTRATION_BACKOFF_CAP)):
+                break
+            attempt += 1
+        if self.registered.is_set():
+            console.print(f"[bold green]Agente {self.agent_id} registado com sucesso![/bold green]")
+
+    def acknowledged(self, data, addr):
+        """Handles a registration ACK (type 2 carrying the agent id) from the listener."""
+        _, sequence_number, ack_agent_id = pdu.decode_identified(data)
+        with self.lock:
+            if sequence_number != self.sequence_number or ack_agent_id != self.agent_id.strip():
+                return
+            if self.confirming:
+                self.registered.set()
+                return
+            self.confirming = True
+            # The server numbers tasks from 1 again once it has this confirmation.
+            reset_task_sequence()
+        self.sock.sendto(pdu.encode_identified(pdu.ACK, sequence_number, self.agent_id), addr)
+
+def send_heartbeats(sock, server_ip, agent_id):
+    """Tells the server the agent is alive every HEARTBEAT_INTERVAL while registered."""
+    sequence_number = 0
+    while not task_scheduler.stop_event.wait(HEARTBEAT_INTERVAL):
+        if not registration.registered.is_set():
+            continue
+        sequence_number = (sequence_number + 1) % 65536
+        try:
+            sock.sendto(pdu.encode_identified(pdu.HEARTBEAT, sequence_number, agent_id), (server_ip, UDP_PORT))
+        except OSError as e:
+            console.print(f"[bold red]Erro ao enviar heartbeat: {e}[/bold red]")
+
+class MetricBatcher:
+    """Accumulates typed samples and ships them as one binary batch PDU.
+
+    A batch is flushed when it reaches MAX_BATCH_SAMPLES or every
+    BATCH_FLUSH_INTERVAL seconds, from a sender thread so measurement loops
+    never wait on the network. The server answers each batch with a single
+    batch ACK (type 6); batches stay in the agent's retransmission queue
+    until then, so several can be in flight at once.
+    """
+
+    def __init__(self, sock, server_ip, agent_id):
+        self.sock = sock
+        self.server_ip = server_ip
+        self.agent_id = agent_id
+        self.samples = []
+        self.batch_sequence = 0
+        self.lock = threading.Lock()
+        self.flush_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def add(self, task_id, kind, value):
+        with self.lock:
+            self.samples.append((time.time(), task_id, kind, value))
+            full = len(self.samples) >= MAX_BATCH_SAMPLES
+        if full:
+            self.flush_event.set()
+
+    def run(self):
+        while running:
+            self.flush_event.wait(BATCH_FLUSH_INTERVAL)
+            self.flush_event.clear()
+            self.flush()
+
+    def flush(self):
+        while True:
+            with self.lock:
+                samples, self.samples = self.samples[:MAX_BATCH_SAMPLES], self.samples[MAX_BATCH_SAMPLES:]
+            if not samples:
+                return
+            self.batch_sequence = (self.batch_sequence + 1) % 65536
+            batch = pdu.encode_batch(self.batch_sequence, self.agent_id, samples)
+            transmissions.send("batch", self.batch_sequence, batch, (self.server_ip, UDP_PORT), self.delivered)
+
+    def delivered(self, peer, batch_sequence, acked):
+        if not acked:
+            agent_telemetry.ack_failed()
+            console.print(f"[bold red]Failed to receive ACK for metric batch {batch_sequence} after {transmissions.max_attempts} attempts.[/bold red]")
+
+def measure_cpu_periodic(frequency, duration, task_id, stop_event):
     readings = []
     
-    while time.time() - start_time <= duration:
+    for lateness in periodic(1, duration, stop_event):
+        agent_telemetry.sample_lateness(lateness)
         cpu_usage = psutil.cpu_percent(interval=0)
         readings.append(cpu_usage)
+        evaluate_alerts("cpu_usage", cpu_usage)
 
         if len(readings) == frequency:
             avg_cpu = sum(readings) / len(readings)
             task_logs.append((task_id, f"Percentagem de uso da CPU: {avg_cpu:.2f}%"))
             readings.clear()
-            result = f"Percentagem de uso da CPU: {avg_cpu:.2f}%"
-            send_task_result(task_id, result, sock, server_ip, agent_id)
-
-            if avg_cpu > alert_conditions["cpu_usage"]:
-                send_alert(f"Alerta de uso elevado do CPU: {result}", server_ip)
-                
-        time.sleep(1)
+            metric_batcher.add(task_id, 1, avg_cpu)
 
-def measure_ram_periodic(frequency, duration, task_id, sock, server_ip, agent_id):
-    start_time = time.time()
+def measure_ram_periodic(frequency, duration, task_id, stop_event):
     readings = []
     
-    while time.time() - start_time <= duration:
+    for lateness in periodic(1, duration, stop_event):
+        agent_telemetry.sample_lateness(lateness)
         ram_usage = psutil.virtual_memory().percent
         readings.append(ram_usage)
-        time.sleep(1)
+        evaluate_alerts("ram_usage", ram_usage)
 
         if len(readings) == frequency:
             avg_ram = sum(readings) / len(readings)
             task_logs.append((task_id, f"Percentagem de uso da RAM: {avg_ram:.2f}%"))
             readings.clear()
-            
-            result = f"Percentagem de uso da RAM: {avg_ram:.2f}%"
-            send_task_result(task_id, result, sock, server_ip, agent_id)
+            metric_batcher.add(task_id, 2, avg_ram)
 
-            if avg_ram > alert_conditions["ram_usage"]:
-                send_alert(f"Alerta de uso elevado de RAM: {result}", server_ip)
+def run_probe(destination, packet_count):
+    """Probes through the shared engine, charging its thread's CPU to the calling task."""
+    result = probe_engine.probe(destination, packet_count)
+    agent_telemetry.charge(result.claim_cpu())
+    return result
 
 def measure_latency(destination, packet_count):
     try:
-        result = subprocess.run(
-            ["ping", "-c", str(packet_count), destination],
-            capture_output=True,
-            text=True
-        )
-        if result.returncode == 0:
-            # Extract the average latency (RTT) from the output
-            for line in result.stdout.splitlines():
-                if "rtt min/avg/max/mdev" in line:
-                    avg_latency = line.split("/")[4]  # Extract the average RTT
-                    return avg_latency + " ms"
-        else:
-            return f"Ping failed: {result.stderr}"
+        result = run_probe(destination, packet_count)
+        if not result.received:
+            return f"Ping failed: sem respostas de {destination}"
+        evaluate_alerts("latency", result.avg_rtt)
+        return f"{result.avg_rtt:.3f} ms"
     except Exception as e:
         return f"Error measuring latency: {e}"
 
 def measure_jitter(destination, packet_count=10):
     try:
-        # Run the ping command
-        result = subprocess.run(
-            ["ping", "-c", str(packet_count), destination],
-            capture_output=True,
-            text=True
-        )
-        if result.returncode == 0:
-            # Parse RTT times from ping output
-            rtts = []
-            for line in result.stdout.splitlines():
-                if "time=" in line:
-                    rtt_match = re.search(r"time=(\d+\.\d+)", line)
-                    if rtt_match:
-                        rtts.append(float(rtt_match.group(1)))
-
-            # Calculate jitter (variation in RTTs)
-            if len(rtts) > 1:
-                jitter = max(rtts[i+1] - rtts[i] for i in range(len(rtts) - 1))
-                return f"{jitter:.2f} ms"
-            else:
-                return "Not enough RTT data to calculate jitter."
-        else:
-            return f"Ping failed: {result.stderr}"
+        result = run_probe(destination, packet_count)
+        if result.jitter is None:
+            return "Not enough RTT data to calculate jitter."
+        evaluate_alerts("jitter", result.jitter)
+        return f"{result.jitter:.2f} ms"
     except Exception as e:
         return f"Error measuring jitter: {e}"
 
 def measure_packet_loss(destination, packet_count=10):
     try:
-        result = subprocess.run(
-            ["ping", "-c", str(packet_count), destination],
-            capture_output=True,
-            text=True
-        )
-        if result.returncode == 0:
-            # Adapt to CORE's ping output format
-            match = re.search(r"(\d+)% packet loss", result.stdout)
-            if match:
-                return f"{match.group(1)}% packet loss"
-            else:
-                return "Packet loss information not found in output."
-        else:
-            return f"Ping failed: {result.stderr}"
+        result = run_probe(destination, packet_count)
+        evaluate_alerts("packet_loss", result.loss)
+        return f"{result.loss:.0f}% packet loss"
     except Exception as e:
         return f"Error measuring packet loss: {e}"
 
-def measure_bandwidth():
+def measure_bandwidth(target, duration, task_id, agent_id, server_ip, stop_event):
     try:
-        # Run iperf client and capture output
-        result = subprocess.run(
-            ["iperf", "-c", "10.0.4.10", "-u", "-b", "100M", "-t", "10"],
-            capture_output=True,
-            text=True
-        )
-        if result.returncode == 0:
-            # Find the bandwidth in the output
-            for line in result.stdout.splitlines():
-                if "Mbits/sec" in line:
-                    return line.split()[-2] + " Mbits/sec"
-        else:
-            return f"iperf failed: {result.stderr}"
+        destination, port, protocol, rate = throughput.parse_target(target, server_ip)
+        # Waits for the server's bandwidth-test scheduler to grant a slot before sending.
+        result = throughput.run_test(destination, protocol, duration, rate, port, agent_id, task_id, stop_event)
+        if protocol == throughput.UDP:
+            task_logs.append((task_id, f"{result.datagrams} datagramas recebidos, {result.loss:.1f}% perdidos, "
+                                       f"{result.waited:.1f}s em espera"))
+        return f"{result.mbits_per_second:.2f} Mbits/sec"
     except Exception as e:
-        return f"Error measuring bandwidth with iperf: {e}"
+        return f"Error measuring bandwidth: {e}"
 
 def send_alert(alert_message, server_ip):
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_sock:
-            tcp_sock.connect((server_ip, 5006))
-            tcp_sock.sendall(alert_message.encode())
-            alerts.append(alert_message)
-            console.print(f"[bold yellow][ALERTFLOW][/bold yellow] Alerta enviado: {alert_message}")
+        alert_channel.send(alert_message)
+        alerts.append(alert_message)
+        console.print(f"[bold yellow][ALERTFLOW][/bold yellow] Alerta enviado: {alert_message}")
     except Exception as e:
         console.print(f"[bold red][ALERTFLOW][/bold red] Falha ao enviar alerta: {e}")
 
-def check_and_send_alert(metric_name, value, threshold, alert_message, server_ip):
-    try:
-        if value > threshold:
-            now = time.time()
-            if alert_timestamps.get(metric_name, 0) + 5 <= now:
-                alert_timestamps[metric_name] = now
-                send_alert(alert_message, server_ip)
-                console.print(f"[bold yellow][ALERTFLOW][/bold yellow] {alert_message}")
-    except Exception as e:
-        console.print(f"[bold red]Erro no processamento do alerta: {e}[/bold red]")
+def evaluate_alerts(metric, value):
+    """Feeds a sample to the rule engine and sends whatever alerts it raises."""
+    for message in alert_engine.observe(metric, value):
+        send_alert(message, SERVER_IP)
         
-def process_task(task, sock, server_ip, agent_id):
+def start_task(task, sock, server_ip, agent_id):
+    """Schedules a task, replacing the instance of the same task id that is still running."""
+    stop_event = threading.Event()
+    previous = task_stops.get(task["Task_ID"])
+    if previous is not None:
+        previous.set()
+    task_stops[task["Task_ID"]] = stop_event
+    task_scheduler.submit(task["Task_Type"], process_task, task, stop_event, sock, server_ip, agent_id)
+
+def cancel_task(task_id):
+    stop_event = task_stops.pop(task_id, None)
+    if stop_event is not None:
+        stop_event.set()
+        console.print(Panel(f"[bold yellow]Tarefa {task_id} cancelada pelo servidor.[/bold yellow]"))
+
+def process_task(task, stop_event, sock, server_ip, agent_id):
     global task_completed_event
     global waiting_for_task
     task_id = task["Task_ID"]
@@ -227,13 +297,17 @@ def process_task(task, sock, server_ip, agent_id):
     frequency = task.get("Frequency", 1)
     duration = task.get("Duration", 10)
 
+    if stop_event.is_set():
+        # Cancelled or replaced while waiting for a free worker.
+        return
     console.print(Panel(f"[bold cyan]Tarefa {task_id} recebida: Tipo {task_type}, Frequência {frequency}s, Duração {duration}s[/bold cyan]"))
+    cpu_started = agent_telemetry.task_started()
     
     try:
         if task_type == 1:
-            result = measure_cpu_periodic(frequency, duration, task_id, sock, server_ip, agent_id)
+            result = measure_cpu_periodic(frequency, duration, task_id, stop_event)
         elif task_type == 2:
-            result = measure_ram_periodic(frequency, duration, task_id, sock, server_ip, agent_id)
+            result = measure_ram_periodic(frequency, duration, task_id, stop_event)
         elif task_type == 3:
             result = measure_latency(task["Data"], frequency)
         elif task_type == 4:
@@ -241,7 +315,7 @@ def process_task(task, sock, server_ip, agent_id):
         elif task_type == 5:
             result = measure_packet_loss(task["Data"])
         elif task_type == 6:
-            result = measure_bandwidth()
+            result = measure_bandwidth(task["Data"], duration, task_id, agent_id, server_ip, stop_event)
         else:
             result = "Tipo de tarefa não suportada"
             return None
@@ -253,64 +327,89 @@ def process_task(task, sock, server_ip, agent_id):
     except Exception as e:
         console.print(f"[bold red]Erro no processamento da tarefa {task_id}: {e}[/bold red]")
     finally:
+        agent_telemetry.task_finished(task_type, cpu_started)
         waiting_for_task = True
         task_completed_event.set()
 
 def send_task_result(task_id, result, sock, server_ip, agent_id):
     try:
-        result_data = result.encode()
-        task_result_pdu = struct.pack(f"!B H 3s {len(result_data)}s", 3, task_id, agent_id.encode(), result_data)
-
-        for attempt in range(3):
-            sock.sendto(task_result_pdu, (server_ip, UDP_PORT))
-
-            try:
-                sock.settimeout(1)
-                ack, _ = sock.recvfrom(BUFFER_SIZE)
-                ack_type, ack_task_id = struct.unpack("!B H", ack[:3])
-                if ack_type == 2 and ack_task_id == task_id:
-                    return
-                else:
-                    console.print(f"[bold red]Invalid ACK received: {ack_type}, {ack_task_id} (expected {task_id}).[/bold red]")
-            except socket.timeout:
-                console.print(f"[bold yellow]Timeout: No ACK for Task {task_id} result (attempt {attempt + 1}).[/bold yellow]")
-            attempt += 1
-            print(f"Retrying... Attempt {attempt}")
-        console.print(f"[bold red]Failed to receive ACK for Task {task_id} result after 3 attempts.[/bold red]")
+        task_result_pdu = pdu.encode_result(task_id, agent_id, result)
+
+        # The listener owns the socket and acknowledges the transmission when the ACK arrives.
+        done = threading.Event()
+        outcome = []
+        transmissions.send("result", task_id, task_result_pdu, (server_ip, UDP_PORT),
+                           lambda peer, sequence, acked: (outcome.append(acked), done.set()))
+        # Bounded by the longest retransmission schedule, in case the callback is never reached.
+        if not done.wait(transmissions.max_attempts * MAX_RTO + 1) or not outcome[0]:
+            agent_telemetry.ack_failed()
+            console.print(f"[bold red]Failed to receive ACK for Task {task_id} result after {transmissions.max_attempts} attempts.[/bold red]")
 
     except Exception as e:
         console.print(f"[bold red]Error sending task result for Task {task_id}: {e}[/bold red]")
 
-def listen_for_tasks(sock, server_ip, agent_id):
+def reset_task_sequence():
     global expected_sequence_number
-    global waiting_for_task 
-    waiting_for_task = True
-    while running:
-        try:
-            data, addr = sock.recvfrom(BUFFER_SIZE)
-            task = decode_task(data)
-            sequence_number = task["Sequence_Number"]
-            task_id = task["Task_ID"]
-
-            message_type, sequence_number, task_id, task_type = struct.unpack("!B H H B", data[:6])
+    expected_sequence_number = 1
+    received_tasks.clear()
 
-            if message_type == 3 and sequence_number == expected_sequence_number:
-                ack_pdu = struct.pack("!B H", 2, sequence_number)
-                sock.sendto(ack_pdu, addr)
-                task = decode_task(data)
+def handle_datagram(data, addr, sock, server_ip, agent_id):
+    """Handles one datagram, a memoryview over a reused receive slot."""
+    global expected_sequence_number
+    try:
+        message_type, sequence_number = pdu.decode_header(data)
+
+        if message_type == pdu.BATCH_ACK:
+            transmissions.acknowledge("batch", sequence_number)
+            return
+        if message_type == pdu.ACK:
+            if len(data) >= pdu.IDENTIFIED.size:
+                registration.acknowledged(data, addr)
+            else:
+                transmissions.acknowledge("result", sequence_number)
+            return
+        if message_type == pdu.REGISTER:
+            registration.restart()
+            return
+
+        # Selective repeat: every task (or cancel) inside the window is ACKed and
+        # buffered, duplicates of already delivered ones are ACKed again, and they
+        # are processed strictly in sequence order.
+        if message_type not in (pdu.TASK, pdu.CANCEL) or sequence_number >= expected_sequence_number + RECEIVE_WINDOW:
+            console.print(f"[bold red]Tarefa inválida recebida: {message_type}, {sequence_number} (esperado {expected_sequence_number}).[/bold red]")
+            return
+
+        sock.sendto(pdu.encode_header(pdu.ACK, sequence_number), addr)
+        if sequence_number >= expected_sequence_number:
+            if message_type == pdu.CANCEL:
+                received_tasks[sequence_number] = (message_type, pdu.decode_cancel(data)[1])
+            else:
+                received_tasks[sequence_number] = (message_type, pdu.decode_task(data))
 
-                if task:
-                    process_task(task, sock, server_ip, agent_id)
-                    expected_sequence_number += 1
+        while expected_sequence_number in received_tasks:
+            message_type, task = received_tasks.pop(expected_sequence_number)
+            expected_sequence_number += 1
+            if message_type == pdu.CANCEL:
+                cancel_task(task)
             else:
-                console.print(f"[bold red]Tarefa inválida recebida: {message_type}, {sequence_number} (esperado {expected_sequence_number}).[/bold red]")
-                
-        except socket.timeout:
-            if waiting_for_task:
-                console.print("\n[bold yellow]Aguardando tarefas do servidor...[/bold yellow]")
-                waiting_for_task = False
-        except Exception as e:
-            continue
+                start_task(task, sock, server_ip, agent_id)
+    except Exception:
+        return
+
+def datagram_truncated(addr, nbytes):
+    console.print(f"[bold red]Datagrama de {addr} maior que {max_datagram_size} bytes descartado.[/bold red]")
+
+def listen_for_tasks(sock, server_ip, agent_id):
+    global waiting_for_task
+    waiting_for_task = True
+    receiver = DatagramReceiver(sock, lambda data, addr: handle_datagram(data, addr, sock, server_ip, agent_id),
+                                max_datagram_size, on_truncated=datagram_truncated)
+    while running:
+        if receiver.wait(LISTEN_TIMEOUT):
+            receiver.drain()
+        elif waiting_for_task:
+            console.print("\n[bold yellow]Aguardando tarefas do servidor...[/bold yellow]")
+            waiting_for_task = False
 
 def display_logs():
     console.print("\n[bold blue]=== Logs das Tarefas ===[/bold blue]")
@@ -341,12 +440,38 @@ def display_alerts():
 
     console.print(table)
 
+def display_telemetry():
+    console.print("\n[bold magenta]=== Telemetria do Agente ===[/bold magenta]")
+    snapshot = agent_telemetry.snapshot(transmissions.retransmissions if transmissions else 0)
+    cpu_ok, lag_ok = agent_telemetry.within_budget(snapshot)
+
+    table = Table(title="Custo da Monitorização")
+    table.add_column("Métrica", justify="left", style="cyan")
+    table.add_column("Valor", justify="right", style="magenta")
+    table.add_column("Orçamento", justify="center")
+    ok = "[green]dentro[/green]"
+    exceeded = "[bold red]excedido[/bold red]"
+    table.add_row("CPU do agente (média)", f"{snapshot['cpu_percent']:.2f}%",
+                  f"{ok if cpu_ok else exceeded} (≤ {telemetry.CPU_BUDGET:.1f}%)")
+    table.add_row("Memória residente", f"{snapshot['rss_mb']:.1f} MB", "")
+    if snapshot["lag_samples"]:
+        table.add_row("Atraso das amostras p50 / p99", f"{snapshot['lag_p50_ms']:.2f} / {snapshot['lag_p99_ms']:.2f} ms",
+                      f"{ok if lag_ok else exceeded} (p99 ≤ {telemetry.LAG_BUDGET * 1e3:.0f} ms)")
+        table.add_row("Atraso máximo", f"{snapshot['lag_max_ms']:.2f} ms", "")
+    table.add_row("Retransmissões", str(snapshot["retransmissions"]), "")
+    table.add_row("Falhas de ACK", str(snapshot["ack_failures"]), "")
+    for task_type, (cpu, runs) in sorted(snapshot["task_cpu"].items()):
+        table.add_row(f"CPU das tarefas tipo {task_type}", f"{cpu * 1e3:.1f} ms em {runs} execuções", "")
+
+    console.print(table)
+
 def display_agent_menu(agent_id, server_ip, sock):
     while True:
         console.print(f"\n[bold blue]=== Menu do Agente {agent_id} ===[/bold blue]")
         console.print("1. Ver Logs das Tarefas")
         console.print("2. Ver Alertas")
-        console.print("3. Sair")
+        console.print("3. Ver Telemetria do Agente")
+        console.print("4. Sair")
 
         choice = input("Selecione uma opção: ")
 
@@ -355,6 +480,8 @@ def display_agent_menu(agent_id, server_ip, sock):
         elif choice == "2":
             display_alerts()
         elif choice == "3":
+            display_telemetry()
+        elif choice == "4":
             console.print(f"[bold red]Encerrando o agente {agent_id}...[/bold red]")
             send_exit_signal(sock, server_ip)
             break
@@ -363,45 +490,73 @@ def display_agent_menu(agent_id, server_ip, sock):
 
         task_completed_event.wait()
 
-def load_alert_conditions():
-        with open("alertflow_conditions.json", "r") as file:
-            alert_conditions = json.load(file)
-            return alert_conditions
-
 def send_exit_signal(sock, server_ip):
     try:
-        exit_pdu = struct.pack("!B H", 4, 0)
-        sock.sendto(exit_pdu, (server_ip, UDP_PORT))
+        sock.sendto(pdu.encode_header(pdu.EXIT, 0), (server_ip, UDP_PORT))
         console.print("[bold red]Sinal de saída enviado para o servidor. Agente encerrando...[/bold red]")
     except Exception as e:
         console.print(f"[bold red]Erro ao enviar sinal de saída: {e}[/bold red]")
 
-def main():
-    global alert_conditions
+def main(telemetry_interval=0, datagram_size=rxpool.MAX_DATAGRAM_SIZE):
+    global alert_engine
+    global metric_batcher
+    global task_scheduler
+    global probe_engine
+    global alert_channel
+    global transmissions
+    global registration
     global expected_sequence_number
-    alert_conditions = load_alert_conditions()
+    global max_datagram_size
+    max_datagram_size = datagram_size
+    alert_engine = load_rules("alertflow_conditions.json")
     expected_sequence_number = 1
     agent_id = get_agent_id()
     server_ip = SERVER_IP  # Use predefined server IP
 
     with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-        sock.settimeout(1)
-        register_with_server(sock, server_ip, agent_id)
+        registration = Registration(sock, server_ip, agent_id)
+        task_scheduler = TaskScheduler()
+        transmissions = RetransmitQueue(sock.sendto, timer_wheel, max_attempts=3)
+        threading.Thread(target=timer_wheel.run, args=(task_scheduler.stop_event,), daemon=True).start()
+        threading.Thread(target=send_heartbeats, args=(sock, server_ip, agent_id), daemon=True).start()
+        metric_batcher = MetricBatcher(sock, server_ip, agent_id)
+        if telemetry_interval > 0:
+            threading.Thread(target=agent_telemetry.report, daemon=True,
+                             args=(metric_batcher.add, lambda: transmissions.retransmissions,
+                                   task_scheduler.stop_event, telemetry_interval)).start()
+        probe_engine = ProbeEngine()
+        alert_channel = AlertChannel(server_ip, agent_id)
 
         listener_thread = threading.Thread(target=listen_for_tasks, args=(sock, server_ip, agent_id))
         listener_thread.daemon = False
         listener_thread.start()
 
         try:
+            registration.start()
+            if not registration.registered.wait(REGISTRATION_BACKOFF_BASE * 2):
+                console.print("[bold yellow]A aguardar o registo no servidor...[/bold yellow]")
+                registration.registered.wait()
             display_agent_menu(agent_id, server_ip, sock)
         finally:
             global running
             running = False
+            task_scheduler.shutdown()
+            for stop_event in list(task_stops.values()):
+                stop_event.set()
+            alert_channel.close()
             listener_thread.join()
             console.print("[bold red]Agente encerrado.[/bold red]")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NMS Agent")
+    parser.add_argument("--telemetry", type=float, nargs="?", default=0, const=telemetry.REPORT_INTERVAL,
+                        metavar="SEGUNDOS",
+                        help=f"envia a telemetria do agente ao servidor a cada SEGUNDOS "
+                             f"({telemetry.REPORT_INTERVAL:g} se omitido); desligada por omissão")
+    parser.add_argument("--max-datagram", type=int, default=rxpool.MAX_DATAGRAM_SIZE,
+                        help=f"tamanho máximo de um datagrama recebido em bytes (por omissão {rxpool.MAX_DATAGRAM_SIZE})")
+    args = parser.parse_args()
     try:
-        main()
+        main(args.telemetry, args.max_datagram)
     except KeyboardInterrupt:
         print("Encerrando o agent...")
\ No newline at end of file
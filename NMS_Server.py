@@ -1,261 +1,633 @@
+import argparse
+import asyncio
+import functools
+import os
+import queue
+from collections import deque
 import socket
 import struct
-import json
-import subprocess
 import threading
 import time
 from prettytable import PrettyTable
+import alertflow
+import dashboard
+import instrumentation
 import metrics
+import pdu
+import probe
+import reliability
+import rxpool
+from sharding import ShardCoordinator
+import taskplan
+import throughput
 from rich.console import Console
 
 UDP_IP = "10.0.4.10"
 UDP_PORT = 5005
-TCP_PORT = 5006
-BUFFER_SIZE = 1024
+TCP_PORT = alertflow.ALERT_PORT
+ALERT_BACKLOG = 4096
+# Largest accepted datagram (--max-datagram); received into rxpool's preallocated slots.
+MAX_DATAGRAM_SIZE = rxpool.MAX_DATAGRAM_SIZE
+METRICS_DIR = "metrics_data"
+# Built-in bandwidth-test responder (0 disables it), the tests it runs at once, and the
+# link capacity in bits/s shared equally between them (0: every test keeps its own rate).
+THROUGHPUT_PORT = throughput.THROUGHPUT_PORT
+BANDWIDTH_SLOTS = 1
+BANDWIDTH_CAPACITY = 0.0
+# Set in shard workers so that every worker can bind the same ports.
+REUSE_PORT = False
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+SEND_WINDOW = 8
+DELIVERY_POLL = 0.05
+# How often start_server_threads checks that the UDP server thread is still starting.
+STARTUP_POLL = 0.1
+# Fan-out: agents whose send windows are filled per event-loop iteration, and the
+# cap on task PDUs in flight across all agents before the next batch starts.
+FANOUT_BATCH = 256
+FANOUT_WINDOW = 4096
+# Groups and labels that tasks can target instead of a single Agent_ID.
+GROUPS_FILE = taskplan.GROUPS_FILE
+# How long a handshake may wait for the agent's confirmation.
+REGISTRATION_TIMEOUT = 10.0
+# Metrics from an unregistered address are kept this long, up to HOLDBACK_LIMIT per address,
+# waiting for the agent to register again (e.g. after a server restart).
+HOLDBACK_TIMEOUT = 30.0
+HOLDBACK_LIMIT = 256
+# Agents silent for this long (about three missed heartbeats) are dropped.
+AGENT_TIMEOUT = 15.0
+# agent_id -> deque of (task_id, PDU template); sequence numbers are stamped when a PDU leaves.
 pending_tasks = {}
-task_queues = {}
+# agent_id -> ids of the tasks the agent acknowledged, or was sent without an ACK before they
+# were requeued, and was not told to cancel since.
+reached_tasks = {}
+agent_groups = taskplan.AgentGroups()
+timer_wheel = reliability.TimerWheel()
+# Task PDUs in flight, indexed by (agent_id, sequence_number); created with the UDP endpoint.
+task_transmissions = None
+# agent_id -> (addr, last seen on the monotonic clock); any inbound PDU refreshes last seen.
 agents = {}
+agent_ids_by_addr = {}
+# agent_id -> the single timer-wheel timer that checks the agent's liveness.
+liveness_timers = {}
 sequence_number = 0
 sequence_counters = {}
+# addr -> (agent_id, timer) of handshakes waiting for the agent's confirmation.
+pending_registrations = {}
+# addr -> (agent_id, deque of (store, args), timer) of metrics waiting for their agent to register.
+held_metrics = {}
+server_loop = None
+# Set once the UDP endpoint, the retransmit queue and server_loop are ready.
+server_ready = threading.Event()
+server_transport = None
+log_queue = queue.SimpleQueue()
 console = Console()
-
-
-def start_iperf_server():
-    try:
-        process = subprocess.Popen(
-            ["iperf", "-s", "-u"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        print("[IPERF] Servidor iperf iniciado no modo UDP.")
-        return process
-    except FileNotFoundError:
-        print("[ERRO] O iperf não está instalado ou não foi encontrado.")
-        return None
-    except Exception as e:
-        print(f"[ERRO] Falha ao iniciar o servidor iperf: {e}")
-        return None
-
-def stop_iperf_server(process):
-    if process:
-        process.terminate()
-        print("[IPERF] Servidor iperf encerrado.")
-
-
-
-def encode_task(task):
-    global sequence_counters
-    agent_id = task["Agent_ID"]
-    task_id = task["Task_ID"]
-    task_type = task["Task_Type"]
-    interface_check = task.get("Interface_Check", "").encode()
-    interface_check_length = len(interface_check)
-    frequency = task.get("Frequency", 5)
-    duration = task.get("Duration", 30)
-
-    if agent_id not in sequence_counters:
-        sequence_counters[agent_id] = 1
-
-    sequence_number = sequence_counters[agent_id]
-    sequence_counters[agent_id] += 1
-
-    if task_type in [3, 4, 5]:
-        destination = socket.inet_aton(task["Data"])
-        task_data = struct.pack("!4s", destination)
-    else:
-        task_data = task["Data"].encode()
-
-    pdu = struct.pack(f"!B H H B B {interface_check_length}s {len(task_data)}s B B",
-        3,
-        sequence_number,
-        task_id,
-        task_type,
-        interface_check_length,
-        interface_check,
-        task_data,
-        frequency,
-        duration
-    )
-
-    return sequence_number, pdu
+# 0 disables the Prometheus endpoint; shard N serves on STATS_PORT + 1 + N.
+STATS_PORT = instrumentation.STATS_PORT
+
+stats = instrumentation.registry
+UDP_PACKETS = stats.counter("nms_udp_packets_total", "Datagramas UDP recebidos por tipo de mensagem", ("type",))
+UDP_BYTES = stats.counter("nms_udp_bytes_total", "Bytes UDP recebidos por tipo de mensagem", ("type",))
+UDP_HANDLER_SECONDS = stats.histogram("nms_udp_handler_seconds",
+                                      "Tempo de tratamento de um datagrama por tipo (amostrado 1/16)", ("type",))
+UDP_ERRORS = stats.counter("nms_udp_errors_total", "Datagramas descartados por erro ou tipo desconhecido")
+UDP_TRUNCATED = stats.counter("nms_udp_truncated_total", "Datagramas maiores que --max-datagram, descartados")
+METRICS_STORED = stats.counter("nms_metrics_stored_total", "Amostras de métricas guardadas", ("format",))
+METRIC_STORE_SECONDS = stats.histogram("nms_metric_store_seconds",
+                                       "Tempo para guardar uma métrica (amostrado 1/16) ou um lote", ("format",))
+TASKS_SENT = stats.counter("nms_tasks_sent_total", "PDUs de tarefa enviados pela primeira vez")
+TASKS_FAILED = stats.counter("nms_tasks_failed_total", "Tarefas não confirmadas após todas as tentativas")
+TASK_DELIVERY_SECONDS = stats.histogram("nms_task_delivery_seconds", "Duração de cada entrega de tarefas (send_tasks)")
+ACK_RTT_SECONDS = stats.histogram("nms_ack_rtt_seconds", "RTT entre o envio de uma tarefa e o seu ACK")
+# Children used on the ingest path, resolved once.
+TEXT_METRICS_STORED = METRICS_STORED.labels("text")
+TEXT_METRIC_STORE_SECONDS = METRIC_STORE_SECONDS.labels("text")
+ALERT_CONNECTIONS = stats.gauge("nms_alert_connections", "Ligações AlertFlow abertas")
+ALERT_FRAMES = stats.counter("nms_alert_frames_total", "Frames AlertFlow recebidos por tipo", ("kind",))
+ALERT_HANDLER_SECONDS = stats.histogram("nms_alert_handler_seconds", "Tempo de tratamento de um frame AlertFlow")
+stats.callback("nms_task_retransmissions_total", "Retransmissões de PDUs de tarefa",
+               lambda: task_transmissions.retransmissions, kind="counter")
+stats.callback("nms_tasks_pending", "Tarefas em fila à espera de janela", lambda: sum(map(len, list(pending_tasks.values()))))
+stats.callback("nms_tasks_in_flight", "Tarefas enviadas ainda sem ACK", lambda: task_transmissions.in_flight())
+stats.callback("nms_agents_registered", "Agentes registados", lambda: len(agents))
+stats.callback("nms_registrations_pending", "Registos à espera de confirmação", lambda: len(pending_registrations))
+stats.callback("nms_metrics_held", "Endereços com métricas retidas à espera de registo", lambda: len(held_metrics))
+stats.callback("nms_metric_series", "Séries de métricas em memória", lambda: len(metrics.metrics_data))
+stats.callback("nms_metric_samples", "Amostras em memória em todas as séries",
+               lambda: sum(map(len, list(metrics.metrics_data.values()))))
+stats.callback("nms_log_queue_depth", "Mensagens à espera do escritor da consola", lambda: log_queue.qsize())
+
+
+def log(message):
+    # Rich rendering is slow; handlers only enqueue and a writer thread prints.
+    log_queue.put(message)
+
+def log_writer():
+    while True:
+        console.print(log_queue.get())
+
+
+def next_sequence_number(agent_id):
+    sequence_number = sequence_counters.get(agent_id, 1)
+    sequence_counters[agent_id] = sequence_number + 1
+    return sequence_number
 
 def handle_registration(data, addr, server_sock):
+    """Three-way handshake, one state per address, driven only by incoming PDUs.
+
+    REGISTER (re)opens the handshake and is answered with an ACK; the
+    agent's confirmation completes it and gets the final ACK. Both steps are
+    idempotent, so agents may retransmit either of them, and handshakes that
+    are never confirmed expire from the timer wheel.
+    """
     if len(data) < 6:
-        console.print(f"[bold red]Erro: Mensagem de registro incompleta de {addr}[/bold red]")
+        log(f"[bold red]Erro: Mensagem de registro incompleta de {addr}[/bold red]")
         return
 
     try:
-        message_type, sequence_number, agent_id = struct.unpack("!B H 3s", data)
-        agent_id = agent_id.decode().strip()
-
-        if message_type == 1:
-            console.print(f"[bold green]O agente {agent_id} está tentando se registar em {addr}[/bold green]")
-
-            ack_message = struct.pack("!B H 3s", 2, sequence_number, agent_id.encode())
-            server_sock.sendto(ack_message, addr)
-            console.print(f"[bold yellow]ACK enviado para o agente {agent_id}[/bold yellow]")
-
-            confirmation_data, _ = server_sock.recvfrom(BUFFER_SIZE)
-            if len(confirmation_data) >= 6:
-                try:
-                    ack_type, sequence_number, ack_agent_id = struct.unpack("!B H 3s", confirmation_data)
-                    if ack_type == 2 and ack_agent_id.decode().strip() == agent_id:
-                        agents[agent_id] = addr
-                        final_ack = struct.pack("!B H 3s", 2, sequence_number, agent_id.encode())
-                        server_sock.sendto(final_ack, addr)
-                    else:
-                        console.print(f"[bold red]Erro: Mensagem de confirmação inválida de {addr}[/bold red]")
-                except struct.error as e:
-                    console.print(f"[bold red]Erro ao desempacotar a mensagem de confirmação: {e}[/bold red]")
-            else:
-                console.print(f"[bold red]Erro: Mensagem de confirmação incompleta de {addr}[/bold red]")
-        elif message_type == 2:
-            console.print(f"[bold yellow]Confirmação recebida do Agente {agent_id}[/bold yellow]")
-            agents[agent_id] = addr
+        message_type, sequence_number, agent_id = pdu.decode_identified(data)
+
+        if message_type == pdu.REGISTER:
+            log(f"[bold green]O agente {agent_id} está tentando se registar em {addr}[/bold green]")
+            pending = pending_registrations.get(addr)
+            if pending is not None:
+                pending[1].cancel()
+            timer = timer_wheel.schedule(REGISTRATION_TIMEOUT, expire_registration, addr, agent_id)
+            pending_registrations[addr] = (agent_id, timer)
+            server_sock.sendto(pdu.encode_identified(pdu.ACK, sequence_number, agent_id), addr)
+            log(f"[bold yellow]ACK enviado para o agente {agent_id}[/bold yellow]")
+        elif message_type == pdu.ACK:
+            pending = pending_registrations.get(addr)
+            if pending is not None and pending[0] == agent_id:
+                del pending_registrations[addr]
+                pending[1].cancel()
+                register_agent(agent_id, addr)
+                log(f"[bold yellow]Confirmação recebida do Agente {agent_id}[/bold yellow]")
+            elif agent_ids_by_addr.get(addr) != agent_id:
+                log(f"[bold red]Erro: Mensagem de confirmação inválida de {addr}[/bold red]")
+                return
+            # Repeated confirmations mean the final ACK was lost: send it again.
+            server_sock.sendto(pdu.encode_identified(pdu.ACK, sequence_number, agent_id), addr)
         else:
-            console.print(f"[bold red]Erro: Mensagem de registro inválida de {addr}[/bold red]")
+            log(f"[bold red]Erro: Mensagem de registro inválida de {addr}[/bold red]")
     except struct.error as e:
-        console.print(f"[bold red]Erro ao desempacotar a mensagem de registro: {e}[/bold red]")
-
-def send_tasks(sock):
+        log(f"[bold red]Erro ao desempacotar a mensagem de registro: {e}[/bold red]")
+
+def register_agent(agent_id, addr):
+    previous = agents.get(agent_id)
+    if previous is not None and previous[0] != addr:
+        agent_ids_by_addr.pop(previous[0], None)
+    agents[agent_id] = (addr, time.monotonic())
+    agent_ids_by_addr[addr] = agent_id
+    if agent_id not in liveness_timers:
+        liveness_timers[agent_id] = timer_wheel.schedule(AGENT_TIMEOUT, check_liveness, agent_id)
+    # A completed handshake starts a new sequence space on both sides (the agent resets when it
+    # confirms): unacknowledged tasks are renumbered from 1, and an agent that was sent tasks
+    # before gets its queue right away instead of waiting for the next delivery.
+    resumed = agent_id in sequence_counters
+    requeue_in_flight(agent_id)
+    sequence_counters.pop(agent_id, None)
+    if resumed:
+        fill_send_window(agent_id)
+    held = held_metrics.pop(addr, None)
+    if held is not None and held[0] == agent_id:
+        held[2].cancel()
+        for store, args in held[1]:
+            store(*args)
+        log(f"[bold yellow]{len(held[1])} métricas retidas do Agente {agent_id} guardadas.[/bold yellow]")
+
+def touch_agent(addr):
+    """Marks the agent behind addr as alive: one dict lookup and one store per PDU."""
+    agent_id = agent_ids_by_addr.get(addr)
+    if agent_id is not None:
+        agents[agent_id] = (addr, time.monotonic())
+
+def check_liveness(agent_id):
+    """Liveness timer of one agent.
+
+    Traffic never touches the wheel: it only refreshes last seen, and the
+    timer, when it fires, re-arms itself for the rest of the timeout or
+    drops the agent. Each agent therefore costs one timer, rescheduled at
+    most once per AGENT_TIMEOUT, however many PDUs it sends.
+    """
+    entry = agents.get(agent_id)
+    if entry is None:
+        liveness_timers.pop(agent_id, None)
+        return
+    idle = time.monotonic() - entry[1]
+    if idle < AGENT_TIMEOUT:
+        liveness_timers[agent_id] = timer_wheel.schedule(AGENT_TIMEOUT - idle, check_liveness, agent_id)
+        return
+    remove_agent(agent_id)
+    log(f"[bold red]Agente {agent_id} sem sinal há {idle:.0f}s: removido.[/bold red]")
+
+def remove_agent(agent_id):
+    addr, _ = agents.pop(agent_id)
+    agent_ids_by_addr.pop(addr, None)
+    timer = liveness_timers.pop(agent_id, None)
+    if timer is not None:
+        timer.cancel()
+    requeue_in_flight(agent_id)
+
+def requeue_in_flight(agent_id):
+    """Puts an agent's unacknowledged tasks back at the head of its queue, in order.
+
+    The agent runs tasks strictly in sequence order, so their numbers must
+    not be skipped: the counter is rewound to the first of them and they go
+    out again under the same numbers.
+    """
+    abandoned = task_transmissions.cancel_peer(agent_id)
+    if not abandoned:
+        return
+    backlog = pending_tasks.setdefault(agent_id, deque())
+    for _, (template, _, task_id) in reversed(abandoned):
+        backlog.appendleft((task_id, template))
+        if template[0] == pdu.TASK:
+            # The agent may have received it and lost only the ACK.
+            reached_tasks.setdefault(agent_id, set()).add(task_id)
+    sequence_counters[agent_id] = abandoned[0][0]
+
+def handle_heartbeat(data, addr, server_sock):
+    # Last seen was already refreshed by datagram_received; an unknown sender is asked to register.
+    _, _, agent_id = pdu.decode_identified(data)
+    if agent_ids_by_addr.get(addr) != agent_id and addr not in pending_registrations:
+        server_sock.sendto(pdu.encode_identified(pdu.REGISTER, 0, agent_id), addr)
+
+def expire_registration(addr, agent_id):
+    pending = pending_registrations.get(addr)
+    if pending is not None and pending[0] == agent_id:
+        del pending_registrations[addr]
+        log(f"[bold red]Registo do agente {agent_id} em {addr} expirou sem confirmação.[/bold red]")
+
+def hold_metrics(addr, agent_id, server_sock, store, *args):
+    """Keeps metrics of an unregistered address until it registers, asking it to register once."""
+    held = held_metrics.get(addr)
+    if held is None or held[0] != agent_id:
+        if held is not None:
+            held[2].cancel()
+        timer = timer_wheel.schedule(HOLDBACK_TIMEOUT, expire_held_metrics, addr, agent_id)
+        held = held_metrics[addr] = (agent_id, deque(maxlen=HOLDBACK_LIMIT), timer)
+        if addr not in pending_registrations:
+            # The server restarted or forgot the agent: a REGISTER prompts it to register again.
+            server_sock.sendto(pdu.encode_identified(pdu.REGISTER, 0, agent_id), addr)
+    held[1].append((store, args))
+
+def expire_held_metrics(addr, agent_id):
+    held = held_metrics.get(addr)
+    if held is not None and held[0] == agent_id:
+        del held_metrics[addr]
+        log(f"[bold red]{len(held[1])} métricas de {agent_id} em {addr} descartadas: o agente não se registou.[/bold red]")
+
+def fill_send_window(agent_id):
+    """Sends queued tasks to an agent until SEND_WINDOW of them are in flight."""
+    entry = agents.get(agent_id)
+    backlog = pending_tasks.get(agent_id)
+    if entry is None or not backlog:
+        return
+    addr = entry[0]
+    while backlog and task_transmissions.in_flight(agent_id) < SEND_WINDOW:
+        task_id, template = backlog.popleft()
+        sequence_number = next_sequence_number(agent_id)
+        task_transmissions.send(agent_id, sequence_number, (template, sequence_number, task_id), addr,
+                                functools.partial(task_delivered, template, task_id))
+        TASKS_SENT.labels().inc()
+
+def task_delivered(template, task_id, agent_id, sequence_number, acked):
+    if acked:
+        if template[0] == pdu.CANCEL:
+            reached_tasks.get(agent_id, set()).discard(task_id)
+        else:
+            reached_tasks.setdefault(agent_id, set()).add(task_id)
+    else:
+        TASKS_FAILED.labels().inc()
+        log(f"[bold red]Tarefa {sequence_number} não confirmada pelo Agente {agent_id} após {task_transmissions.max_attempts} tentativas.[/bold red]")
+        entry = agents.get(agent_id)
+        if entry is not None:
+            # Skipping the number would stall the agent, which runs tasks in sequence order: keep
+            # offering it, at the backed-off RTO, until it is ACKed or liveness drops the agent.
+            task_transmissions.send(agent_id, sequence_number, (template, sequence_number, task_id), entry[0],
+                                    functools.partial(task_delivered, template, task_id))
+            return
+    fill_send_window(agent_id)
+
+def drive_timer_wheel():
+    timer_wheel.advance()
+    server_loop.call_later(timer_wheel.tick, drive_timer_wheel)
+
+def transmit_task(stamped, addr):
+    """RetransmitQueue transmit: stamps the agent's sequence number into the shared template and sends it.
+
+    The transport sends right away or copies what it has to buffer, so the
+    template can be stamped again for the next agent.
+    """
+    template, sequence_number, _ = stamped
+    server_transport.sendto(pdu.stamp(template, sequence_number), addr)
+
+async def deliver_tasks():
+    """Fans pending tasks out to every agent in batches, then waits for the windows to drain.
+
+    Each loop iteration fills the windows of FANOUT_BATCH agents with
+    non-blocking sends and then yields, so ACKs are collected and windows
+    refilled between batches; a new batch waits while FANOUT_WINDOW PDUs
+    are in flight.
+    """
+    agent_ids = list(agents)
+    for start in range(0, len(agent_ids), FANOUT_BATCH):
+        while task_transmissions.in_flight() >= FANOUT_WINDOW:
+            await asyncio.sleep(DELIVERY_POLL)
+        for agent_id in agent_ids[start:start + FANOUT_BATCH]:
+            fill_send_window(agent_id)
+        await asyncio.sleep(0)
+    while task_transmissions.in_flight():
+        await asyncio.sleep(DELIVERY_POLL)
+
+def send_tasks():
     if not agents:
         console.print("[bold red]Nenhum agente registrado para enviar tarefas.[/bold red]")
         return
 
-    for agent_id, addr in agents.items():
-        if agent_id in pending_tasks and pending_tasks[agent_id]:
-            sequence_number, task_pdu = pending_tasks[agent_id].pop(0)
-
-            for attempt in range(3):
-                try:
-                    sock.sendto(task_pdu, addr)
-                    sock.settimeout(2)
-                    ack, ack_addr = sock.recvfrom(BUFFER_SIZE)
-                    if ack_addr == addr:
-                        handle_acknowledgment(ack, addr)
-                        ack_type, ack_sequence_number = struct.unpack("!B H", ack[:3])
-                        if ack_type == 2 and ack_sequence_number == sequence_number:
-                            final_ack = struct.pack("!B H", 2, sequence_number)
-                            sock.sendto(final_ack, addr)
-                            break
-                        else:
-                            console.print(f"[bold red]Erro: ACK inválido recebido de {addr}[/bold red]")
-                    else:
-                        console.print(f"[bold red]Erro: ACK de {ack_addr} recebido de {addr}[/bold red]")
-                except socket.timeout:
-                    console.print(f"[bold yellow]Timeout ao enviar tarefa {sequence_number} para o Agente {agent_id}. Tentando novamente...[/bold yellow]")
-                except Exception as e:
-                    console.print(f"[bold red]Nenhuma tarefa pendente para o Agente {agent_id}: {e}[/bold red]")
-                    resend_pending_tasks(agent_id, sock, addr)
-                attempt += 1
-        else:
-            console.print(f"[bold red]Nenhuma tarefa pendente para o Agente {agent_id}.[/bold red]")                
+    # Wildcards and selectors also cover the agents registered since the plans were loaded.
+    plan_watcher.reload()
+    for agent_id in agents:
+        if not pending_tasks.get(agent_id):
+            console.print(f"[bold red]Nenhuma tarefa pendente para o Agente {agent_id}.[/bold red]")
+
+    started = time.monotonic()
+    with TASK_DELIVERY_SECONDS.labels().time():
+        asyncio.run_coroutine_threadsafe(deliver_tasks(), server_loop).result()
+    console.print(f"[bold green]Entrega de tarefas concluída em {time.monotonic() - started:.2f}s.[/bold green]")
+
 def handle_acknowledgment(data, addr):
     try:
         if len(data) < 3:
-            console.print(f"[bold red]Erro: Mensagem de ACK incompleta de {addr}[/bold red]")
+            log(f"[bold red]Erro: Mensagem de ACK incompleta de {addr}[/bold red]")
             return
 
-        ack_type, ack_sequence_number = struct.unpack("!B H", data[:3])
+        ack_type, ack_sequence_number = pdu.decode_header(data)
 
-        if ack_type != 2:
-            console.print(f"[bold red]Erro: ACK inválido recebido de {addr}[/bold red]")
+        if ack_type != pdu.ACK:
+            log(f"[bold red]Erro: ACK inválido recebido de {addr}[/bold red]")
             return
-        
-        for agent_id, task_queue in task_queues.items():
-            for seq, task_pdu, _ in task_queue:
-                if seq == ack_sequence_number:
-                    task_queues[agent_id] = [t for t in task_queue if t[0] != seq]
-                    return
+
+        agent_id = agent_ids_by_addr.get(addr)
+        if agent_id is not None:
+            task_transmissions.acknowledge(agent_id, ack_sequence_number)
 
     except struct.error as e:
-        console.print(f"[bold red]Erro ao desempacotar a mensagem de ACK: {e}[/bold red]")
+        log(f"[bold red]Erro ao desempacotar a mensagem de ACK: {e}[/bold red]")
     except Exception as e:
-        console.print(f"[bold red]Erro ao processar a mensagem de ACK: {e}[/bold red]")
+        log(f"[bold red]Erro ao processar a mensagem de ACK: {e}[/bold red]")
 
 def handle_metric_data(agent_id, task_id, metric):
     try:
-        if agent_id in agents:
+        TEXT_METRICS_STORED.value += 1
+        if TEXT_METRICS_STORED.value & instrumentation.TIMING_SAMPLE_MASK:
+            metrics.store_metric(agent_id, task_id, metric)
+        else:
+            started = time.perf_counter_ns()
             metrics.store_metric(agent_id, task_id, metric)
-            console.print(f"[bold yellow]Metrica recebida para a Tarefa {task_id} do Agente {agent_id}: {metric}[/bold yellow]")
-            ack_message = struct.pack("!B H", 2, task_id)
-            addr = agents[agent_id]
-            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-                sock.sendto(ack_message, addr)
+            TEXT_METRIC_STORE_SECONDS.record(time.perf_counter_ns() - started)
+        log(f"[bold yellow]Metrica recebida para a Tarefa {task_id} do Agente {agent_id}: {metric}[/bold yellow]")
     except Exception as e:
-        console.print(f"[bold red]Erro ao processar a métrica: {e}[/bold red]")
+        log(f"[bold red]Erro ao processar a métrica: {e}[/bold red]")
+
+def handle_task_result(data, addr, server_sock):
+    if len(data) < 6:
+        log(f"[bold red]Erro: Mensagem de tarefa incompleta de {addr}[/bold red]")
+        return
+    try:
+        task_id, agent_id, result = pdu.decode_result(data)
+        server_sock.sendto(pdu.encode_header(pdu.ACK, task_id), addr)
+        if agent_ids_by_addr.get(addr) == agent_id:
+            handle_metric_data(agent_id, task_id, result)
+        else:
+            hold_metrics(addr, agent_id, server_sock, handle_metric_data, agent_id, task_id, result)
+    except struct.error as e:
+        log(f"[bold red]Erro ao desempacotar a mensagem de tarefa: {e}[/bold red]")
+
+def handle_metric_batch(data, addr, server_sock):
+    try:
+        batch_sequence, agent_id, samples = pdu.decode_batch(data)
+    except struct.error as e:
+        log(f"[bold red]Erro: Lote de métricas inválido de {addr}: {e}[/bold red]")
+        return
+    server_sock.sendto(pdu.encode_header(pdu.BATCH_ACK, batch_sequence), addr)
+    if agent_ids_by_addr.get(addr) == agent_id:
+        store_metric_batch(agent_id, samples)
+    else:
+        hold_metrics(addr, agent_id, server_sock, store_metric_batch, agent_id, list(samples))
+
+def store_metric_batch(agent_id, samples):
+    count = 0
+    with METRIC_STORE_SECONDS.labels("batch").time():
+        for _, task_id, kind, value in samples:
+            metrics.store_typed_sample(agent_id, task_id, kind, value)
+            count += 1
+    METRICS_STORED.labels("batch").inc(count)
+    log(f"[bold yellow]Lote de {count} métricas recebido do Agente {agent_id}[/bold yellow]")
+
+def handle_ack_or_confirmation(data, addr, server_sock):
+    # Registration confirmations carry the agent id (6 bytes), task ACKs do not.
+    if len(data) >= pdu.IDENTIFIED.size:
+        handle_registration(data, addr, server_sock)
+    else:
+        handle_acknowledgment(data, addr)
+
+class NMSServerProtocol(asyncio.DatagramProtocol):
+    """Event-driven UDP plane of the server.
+
+    Message types: 1=register, 2=ack, 3=metric result (text), 4=exit,
+    5=metric batch (binary, answered by a single type 6 batch ACK),
+    7=heartbeat. Every datagram from a registered address counts as liveness.
+    Every datagram is dispatched by message type to a handler that never
+    blocks: no nested recvfrom, no console rendering on the event loop.
+    Datagrams arrive as memoryviews over rxpool slots that are reused, so
+    handlers must not keep them.
+    The measured loopback ceiling (type 3 PDUs/s received, stored and
+    acknowledged) is kept in the README's benchmark table. Past it the
+    kernel drops on the socket buffer; the loop itself never waits on any
+    one agent.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.handlers = {
+            pdu.REGISTER: handle_registration,
+            pdu.ACK: handle_ack_or_confirmation,
+            pdu.TASK: handle_task_result,
+            pdu.EXIT: handle_exit_signal,
+            pdu.BATCH: handle_metric_batch,
+            pdu.HEARTBEAT: handle_heartbeat,
+        }
+        # Per-type instruments resolved once, so the hot path does no label lookups.
+        self.instruments = {
+            message_type: (UDP_PACKETS.labels(name), UDP_BYTES.labels(name), UDP_HANDLER_SECONDS.labels(name))
+            for message_type, name in pdu.NAMES.items()
+        }
+        self.errors = UDP_ERRORS.labels()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if not data:
+            return
+        touch_agent(addr)
+        handler = self.handlers.get(data[0])
+        if handler is None:
+            self.errors.inc()
+            log(f"[bold red]Erro: Tipo de mensagem desconhecido {data[0]} de {addr}[/bold red]")
+            return
+        packets, received_bytes, handler_time = self.instruments[data[0]]
+        packets.value += 1
+        received_bytes.value += len(data)
+        timed = not packets.value & instrumentation.TIMING_SAMPLE_MASK
+        if timed:
+            started = time.perf_counter_ns()
+        try:
+            handler(data, addr, self.transport)
+        except Exception as e:
+            self.errors.inc()
+            log(f"[bold red]Erro ao processar mensagem de {addr}: {e}[/bold red]")
+        if timed:
+            handler_time.record(time.perf_counter_ns() - started)
+
+    def error_received(self, exc):
+        log(f"[bold red]Erro no socket UDP: {exc}[/bold red]")
+
+def datagram_truncated(addr, nbytes):
+    UDP_TRUNCATED.labels().inc()
+    log(f"[bold red]Datagrama de {addr} maior que {MAX_DATAGRAM_SIZE} bytes descartado.[/bold red]")
 
 def handle_udp_server():
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-        sock.bind((UDP_IP, UDP_PORT))
+    global server_loop, server_transport, task_transmissions
+    server_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(server_loop)
+    udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if REUSE_PORT:
+        udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    udp_sock.bind((UDP_IP, UDP_PORT))
+    # A window burst to every agent is answered by a burst of ACKs; the default
+    # receive buffer is too small to hold them while the loop is still sending.
+    udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+    udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+    # Datagrams are read into rxpool's preallocated slots, a burst per wakeup,
+    # instead of one freshly allocated bytes object per datagram.
+    protocol = NMSServerProtocol()
+    server_transport = rxpool.DatagramEndpoint(server_loop, udp_sock, protocol.datagram_received, MAX_DATAGRAM_SIZE,
+                                               on_truncated=datagram_truncated, on_error=protocol.error_received)
+    protocol.connection_made(server_transport)
+    task_transmissions = reliability.RetransmitQueue(transmit_task, timer_wheel)
+    ack_rtt = ACK_RTT_SECONDS.labels()
+    task_transmissions.rtt_observer = lambda rtt: ack_rtt.record(int(rtt * 1e9))
+    server_loop.call_soon(drive_timer_wheel)
+    # AlertFlow shares the loop: one long-lived framed connection per agent.
+    server_loop.run_until_complete(
+        asyncio.start_server(handle_alert_connection, "0.0.0.0", TCP_PORT, backlog=ALERT_BACKLOG, reuse_port=REUSE_PORT)
+    )
+    # Agents without raw-socket privileges probe the server through UDP echo.
+    server_loop.run_until_complete(
+        server_loop.create_datagram_endpoint(probe.EchoProtocol, local_addr=(UDP_IP, probe.ECHO_PORT), reuse_port=REUSE_PORT)
+    )
+    server_ready.set()
+    try:
+        server_loop.run_forever()
+    finally:
+        server_transport.close()
+        server_loop.close()
+
+async def handle_alert_connection(reader, writer):
+    """Serves one long-lived AlertFlow connection: a HELLO frame, then alert frames."""
+    addr = writer.get_extra_info("peername")
+    agent_id = None
+    connections = ALERT_CONNECTIONS.labels()
+    handler_time = ALERT_HANDLER_SECONDS.labels()
+    connections.inc()
+    try:
         while True:
-            data, addr = sock.recvfrom(BUFFER_SIZE)
-            if not data:
-                continue
-
-            message_type = data[0]
-            
-            if message_type == 1:
-                handle_registration(data, addr, sock)
-            elif message_type == 2:
-                handle_acknowledgment(data, addr)
-            elif message_type == 3:
-                try:
-                    if len(data) < 6:
-                        console.print(f"[bold red]Erro: Mensagem de tarefa incompleta de {addr}[/bold red]")
-                        continue
-                    task_id, agent_id = struct.unpack("!H 3s", data[1:6])
-                    result = data[6:].decode("utf-8", errors="ignore")
-                    agent_id = agent_id.decode().strip()
-                    ack = struct.pack("!B H", 2, task_id)
-                    sock.sendto(ack, addr)
-                    handle_metric_data(agent_id, task_id, result)
-                except struct.error as e:
-                    console.print(f"[bold red]Erro ao desempacotar a mensagem de tarefa: {e}[/bold red]")
-                except Exception as e:
-                    console.print(f"[bold red]Erro ao processar a tarefa: {e}[/bold red]")
-            elif message_type == 4:
-                handle_exit_signal(data, addr)
-
-def handle_tcp_alert_server():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_sock:
-        tcp_sock.bind(("0.0.0.0", TCP_PORT))
-        tcp_sock.listen(5)
+            kind, payload = await alertflow.read_frame(reader)
+            started = time.perf_counter_ns()
+            ALERT_FRAMES.labels("hello" if kind == alertflow.FRAME_HELLO else "alert").inc()
+            if kind == alertflow.FRAME_HELLO:
+                agent_id = payload.decode()
+            elif kind == alertflow.FRAME_ALERT:
+                entry = agents.get(agent_id)
+                if entry is not None:
+                    agents[agent_id] = (entry[0], time.monotonic())
+                timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+                log(f"[bold yellow][{timestamp} ALERTA {agent_id or addr}][/bold yellow] {payload.decode()}")
+            handler_time.record(time.perf_counter_ns() - started)
+    except asyncio.IncompleteReadError:
+        pass
+    except Exception as e:
+        log(f"[bold red]Erro ao processar alerta de {addr}: {e}[/bold red]")
+    finally:
+        connections.dec()
+        writer.close()
+
+def queue_plan_changes(plan, diff, push=False):
+    """Queues the tasks a plan load added or changed and cancels for the ones it removed.
+
+    Runs on the server loop, which owns the send windows. Queued but unsent
+    versions of a changed or removed task are dropped first; a removed task
+    is only cancelled on agents that acknowledged it or have it in flight,
+    the others never got it. With push, the affected registered agents are
+    sent their changes right away.
+    """
+    affected = set()
+    for agent_id, task_id in diff.changed + diff.removed:
+        backlog = pending_tasks.get(agent_id)
+        if backlog:
+            pending_tasks[agent_id] = deque(entry for entry in backlog if entry[0] != task_id)
+    for key in diff.added + diff.changed:
+        task, template = plan.tasks[key]
+        metrics.register_task(task["Task_ID"], task["Task_Type"])
+        pending_tasks.setdefault(key[0], deque()).append((key[1], template))
+        affected.add(key[0])
+    for agent_id, task_id in diff.removed:
+        if not task_reached(agent_id, task_id):
+            continue
+        pending_tasks.setdefault(agent_id, deque()).append((task_id, bytearray(pdu.encode_cancel(0, task_id))))
+        affected.add(agent_id)
+    if push:
+        for agent_id in affected:
+            fill_send_window(agent_id)
+
+def task_reached(agent_id, task_id):
+    """Whether an agent may have a task: it was acknowledged, requeued unacknowledged or is in flight."""
+    if task_id in reached_tasks.get(agent_id, ()):
+        return True
+    return any(template[0] == pdu.TASK and in_flight_task_id == task_id
+               for template, _, in_flight_task_id in task_transmissions.in_flight_pdus(agent_id))
+
+def call_in_server_loop(function, *args):
+    if server_loop is None:
+        function(*args)
+    else:
+        server_loop.call_soon_threadsafe(function, *args)
 
-        while True:
-            conn, addr = tcp_sock.accept()
-            try:
-                data = conn.recv(BUFFER_SIZE)
-                if data:
-                    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-                    console.print(f"[bold yellow][{timestamp} ALERTA][/bold yellow] {data.decode()}")
-            except Exception as e:
-                console.print(f"[bold red]Erro ao processar alerta de {addr}: {e}[/bold red]")
-            finally:
-                conn.close()
-
-def resend_pending_tasks(agent_id, sock, addr):
-    now = time.time()
-    if agent_id in pending_tasks:
-        for sequence_number, (task_pdu, timestamp) in list(pending_tasks[agent_id].items()):
-            if now - timestamp > 2:
-                console.print(f"[bold yellow]Reenviando tarefa {sequence_number} para o Agente {agent_id}.[/bold yellow]")
-                try:
-                    sock.sendto(task_pdu, addr)
-                    pending_tasks[agent_id][sequence_number] = (task_pdu, now)
-                except Exception as e:
-                    console.print(f"[bold red]Erro ao reenviar tarefa {sequence_number} para o Agente {agent_id}: {e}[/bold red]")
+def plan_changed(plan, diff):
+    log(f"[bold green]Plano {plan.path} alterado: {diff}.[/bold green]")
+    call_in_server_loop(queue_plan_changes, plan, diff, True)
+
+def plan_failed(plan, error):
+    log(f"[bold red]Erro ao recarregar o plano {plan.path}: {error}[/bold red]")
+
+def resolve_targets(task):
+    return agent_groups.resolve(task, list(agents))
+
+plan_watcher = taskplan.PlanWatcher(plan_changed, plan_failed, resolve_targets)
 
 def load_tasks_from_file(file_path):
+    """Loads a JSON or JSONL task plan and watches it; loading it again only queues what changed."""
+    global agent_groups
     try:
-        with open(file_path, "r") as file:
-            tasks = json.load(file)
-            for task in tasks:
-                agent_id = task["Agent_ID"]
-                task_pdu = encode_task(task)
-                pending_tasks.setdefault(agent_id, []).append(task_pdu)
-    except (FileNotFoundError, json.JSONDecodeError) as e:
+        agent_groups = taskplan.AgentGroups.load(GROUPS_FILE)
+        plan, diff = plan_watcher.load(file_path)
+    except (OSError, ValueError, KeyError) as e:
         console.print(f"[bold red]Erro ao carregar tarefas do arquivo: {e}[/bold red]")
+        return
+    console.print(f"[bold green]{len(plan.tasks)} tarefas em {plan.path}: {diff}.[/bold green]")
+    call_in_server_loop(queue_plan_changes, plan, diff)
 
 def display_agents():
     if not agents:
@@ -265,70 +637,192 @@ def display_agents():
     table = PrettyTable()
     table.field_names = ["Agent ID", "Address", "Last Seen"]
     for agent_id, (addr, timestamp) in agents.items():
-        last_seen = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+        last_seen = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(metrics.wall_time(timestamp)))
         table.add_row([agent_id, addr, last_seen])
     print("\n=== Registered Agents ===")
     print(table)
 
-def handle_exit_signal(data, addr):
-    message_type, _ = struct.unpack("!B H", data[:3])
+def handle_exit_signal(data, addr, server_sock=None):
+    message_type, _ = pdu.decode_header(data)
     
-    if message_type == 4:
-        console.print(f"[bold green]Sinal de saida recebido de {addr}.[/bold green]")
-        for agent_id, agent_addr in agents.items():
-            if agent_addr == addr:
-                del agents[agent_id]
-                console.print(f"[bold green]Agente {agent_id} removido.[/bold green]")
-                break
+    if message_type == pdu.EXIT:
+        log(f"[bold green]Sinal de saida recebido de {addr}.[/bold green]")
+        agent_id = agent_ids_by_addr.get(addr)
+        if agent_id is not None:
+            remove_agent(agent_id)
+            log(f"[bold green]Agente {agent_id} removido.[/bold green]")
     else:
-        console.print(f"[bold red]Erro: Mensagem de saída inválida de {addr}[/bold red]")
+        log(f"[bold red]Erro: Mensagem de saída inválida de {addr}[/bold red]")
+
+def start_server_threads():
+    log_thread = threading.Thread(target=log_writer)
+    log_thread.daemon = True
+    log_thread.start()
+
+    udp_server_thread = threading.Thread(target=handle_udp_server)
+    udp_server_thread.daemon = True
+    udp_server_thread.start()
+    # Callers hand work to the loop right away, so wait until it exists.
+    while not server_ready.wait(STARTUP_POLL):
+        if not udp_server_thread.is_alive():
+            raise OSError(f"o servidor UDP não arrancou em {UDP_IP}:{UDP_PORT}")
+    return server_loop
+
+def start_stats_endpoint(port):
+    if not port:
+        return
+    try:
+        instrumentation.serve(port)
+        log(f"[bold green]Estatísticas Prometheus em http://{instrumentation.STATS_HOST}:{port}/metrics[/bold green]")
+    except OSError as e:
+        log(f"[bold red]Erro ao abrir o endpoint de estatísticas na porta {port}: {e}[/bold red]")
+
+def start_throughput_responder(port):
+    if not port:
+        return None
+    responder = throughput.ThroughputResponder(
+        UDP_IP, port, throughput.BandwidthScheduler(BANDWIDTH_SLOTS, BANDWIDTH_CAPACITY), log)
+    try:
+        responder.start()
+    except OSError as e:
+        log(f"[bold red]Erro ao abrir o respondedor de largura de banda na porta {port}: {e}[/bold red]")
+        responder.close()
+        return None
+    log(f"[bold green]Testes de largura de banda em {UDP_IP}:{port} (TCP/UDP), {BANDWIDTH_SLOTS} de cada vez.[/bold green]")
+    return responder
+
+def serve_shard(shard, control):
+    """Entry point of a shard worker process, driven by ShardCoordinator commands."""
+    global REUSE_PORT
+    REUSE_PORT = True
+    metrics.enable_persistence(os.path.join(METRICS_DIR, f"shard-{shard}"))
+    loop = start_server_threads()
+    start_stats_endpoint(STATS_PORT and STATS_PORT + 1 + shard)
+    try:
+        while True:
+            command, *args = control.recv()
+            if command == "load":
+                load_tasks_from_file(args[0])
+                control.send(None)
+            elif command == "send":
+                # As in send_tasks: plans changed since the watcher's last poll are queued first.
+                plan_watcher.reload()
+                # Only the agents registered with this shard receive their tasks from it.
+                asyncio.run_coroutine_threadsafe(deliver_tasks(), loop).result()
+                control.send(len(agents))
+            elif command == "agents":
+                control.send(dict(agents))
+            elif command == "metrics":
+                control.send(metrics.snapshot())
+            elif command == "metric_changes":
+                control.send(metrics.snapshot_changes())
+            elif command == "stop":
+                break
+    except (KeyboardInterrupt, EOFError):
+        pass
+    finally:
+        metrics.close_persistence()
 
-def main():
+def wait_headless():
+    console.print(f"[bold green]NMS Server a correr sem menu em {UDP_IP}:{UDP_PORT}.[/bold green]")
+    threading.Event().wait()
 
-    iperf_process = start_iperf_server()
-    
-    if iperf_process is None:
-        print("[ERRO] Não foi possível iniciar o servidor iperf. Verifique a instalação.")
-        exit(1)  # Sai do programa se o iperf não foi iniciado
+def main(workers=1, headless=False):
+    coordinator = None
+    if workers > 1:
+        coordinator = ShardCoordinator(workers, serve_shard)
+        console.print(f"[bold green]{workers} processos a servir a porta UDP {UDP_PORT} (SO_REUSEPORT).[/bold green]")
+    else:
+        metrics.enable_persistence(METRICS_DIR)
 
+    responder = None
     try:
-        udp_server_thread = threading.Thread(target=handle_udp_server)
-        udp_server_thread.daemon = True
-        udp_server_thread.start()
-        
-        tcp_thread = threading.Thread(target=handle_tcp_alert_server)
-        tcp_thread.daemon = True
-        tcp_thread.start()
-        
+        if coordinator is None:
+            start_server_threads()
+            start_stats_endpoint(STATS_PORT)
+        else:
+            # The workers have their own writers; this one prints the responder's messages.
+            threading.Thread(target=log_writer, daemon=True).start()
+        # One responder for all shards, so its scheduler sees every bandwidth test.
+        responder = start_throughput_responder(THROUGHPUT_PORT)
+        if headless:
+            wait_headless()
+
         while True:
             console.print("\n=== NMS Server ===")
             console.print("1. Carregar tarefas do arquivo")
             console.print("2. Enviar tarefas")
             console.print("3. Exibir agentes registrados")
             console.print("4. Exibir métricas")
-            console.print("5. Sair")
+            console.print("5. Painel de métricas ao vivo")
+            console.print("6. Sair")
             choice = input("Escolha uma opção: ")
 
             if choice == "1":
                 file_path = input("Digite o caminho do arquivo: ")
-                load_tasks_from_file(file_path)
+                if coordinator is None:
+                    load_tasks_from_file(file_path)
+                else:
+                    coordinator.broadcast("load", file_path)
             elif choice == "2":
-                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-                    send_tasks(sock)
+                if coordinator is None:
+                    send_tasks()
+                else:
+                    coordinator.broadcast("send")
             elif choice == "3":
+                if coordinator is not None:
+                    agents.clear()
+                    agents.update(coordinator.merged_dict("agents"))
                 display_agents()
             elif choice == "4":
+                if coordinator is not None:
+                    metrics.load_snapshot(coordinator.merged_dict("metrics"))
                 metrics.display_metrics()
             elif choice == "5":
+                refresh = None
+                if coordinator is not None:
+                    # One full copy, then each refresh only carries the series that received samples.
+                    metrics.load_snapshot(coordinator.merged_dict("metrics"))
+                    refresh = lambda: metrics.merge_snapshot(coordinator.merged_dict("metric_changes"))
+                dashboard.Dashboard(refresh=refresh).run()
+            elif choice == "6":
                 console.print("[bold red]Encerrando o NMS Server...[/bold red]")
                 break
             else:
                 console.print("[bold red]Opção inválida. Tente novamente.[/bold red]")
     finally:
-        stop_iperf_server(iperf_process)
+        if coordinator is None:
+            metrics.close_persistence()
+        else:
+            coordinator.stop()
+        if responder is not None:
+            responder.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NMS Server")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processos a partilhar a porta UDP via SO_REUSEPORT (por omissão 1)")
+    parser.add_argument("--ip", default=UDP_IP, help=f"endereço onde escutar (por omissão {UDP_IP})")
+    parser.add_argument("--port", type=int, default=UDP_PORT, help=f"porta UDP (por omissão {UDP_PORT})")
+    parser.add_argument("--metrics-dir", default=METRICS_DIR, help="diretório dos segmentos de métricas")
+    parser.add_argument("--headless", action="store_true", help="corre sem menu interativo (benchmarks)")
+    parser.add_argument("--throughput-port", type=int, default=THROUGHPUT_PORT,
+                        help=f"porta TCP/UDP dos testes de largura de banda, 0 desliga (por omissão {THROUGHPUT_PORT})")
+    parser.add_argument("--bandwidth-slots", type=int, default=BANDWIDTH_SLOTS,
+                        help="testes de largura de banda em simultâneo (por omissão 1: um de cada vez)")
+    parser.add_argument("--bandwidth-capacity", type=throughput.parse_rate, default=BANDWIDTH_CAPACITY,
+                        metavar="TAXA", help="capacidade da ligação repartida pelos testes simultâneos, p.ex. 1G")
+    parser.add_argument("--stats-port", type=int, default=STATS_PORT,
+                        help=f"porta HTTP local das estatísticas Prometheus, 0 desliga (por omissão {STATS_PORT})")
+    parser.add_argument("--max-datagram", type=int, default=MAX_DATAGRAM_SIZE,
+                        help=f"tamanho máximo de um datagrama recebido em bytes (por omissão {MAX_DATAGRAM_SIZE})")
+    parser.add_argument("--groups", default=GROUPS_FILE,
+                        help=f"grupos e etiquetas de agentes para as tarefas (por omissão {GROUPS_FILE})")
+    args = parser.parse_args()
+    UDP_IP, UDP_PORT, METRICS_DIR, STATS_PORT = args.ip, args.port, args.metrics_dir, args.stats_port
+    GROUPS_FILE, MAX_DATAGRAM_SIZE = args.groups, args.max_datagram
+    THROUGHPUT_PORT, BANDWIDTH_SLOTS, BANDWIDTH_CAPACITY = args.throughput_port, args.bandwidth_slots, args.bandwidth_capacity
     try:
-        main()
+        main(args.workers, headless=args.headless)
     except KeyboardInterrupt:
-        print("Encerrando o servidor...")
\ No newline at end of file
+        print("Encerrando o servidor...")
@@ -0,0 +1,114 @@
+import queue
+import socket
+import struct
+import threading
+import time
+
+ALERT_PORT = 5006
+# Frame header: payload length, frame kind.
+FRAME_HEADER = struct.Struct("!I B")
+FRAME_HELLO = 1
+FRAME_ALERT = 2
+MAX_FRAME_SIZE = 64 * 1024
+# How long the client waits for more alerts to coalesce into one write.
+COALESCE_LINGER = 0.05
+MAX_COALESCE = 256
+RECONNECT_BACKOFF = (0.5, 1, 2, 5, 10)
+
+
+def encode_frame(kind, payload):
+    return FRAME_HEADER.pack(len(payload), kind) + payload
+
+async def read_frame(reader):
+    """Reads one (kind, payload) frame from an asyncio StreamReader."""
+    length, kind = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame demasiado grande: {length} bytes")
+    return kind, await reader.readexactly(length)
+
+
+class AlertChannel:
+    """Long-lived, framed AlertFlow connection from an agent to the server.
+
+    send() only enqueues. A sender thread keeps one TCP connection open
+    (introduced by a HELLO frame carrying the agent id), gathers alerts that
+    arrive within COALESCE_LINGER of each other, folds repeated messages into
+    one "(xN)" alert and writes the whole burst with a single sendall.
+    Alerts that fail to go out are retried after reconnecting with backoff.
+    """
+
+    def __init__(self, server_ip, agent_id, port=ALERT_PORT):
+        self.address = (server_ip, port)
+        self.agent_id = agent_id
+        self.queue = queue.SimpleQueue()
+        self.sock = None
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def send(self, message):
+        self.queue.put(message)
+
+    def collect_burst(self):
+        try:
+            burst = [self.queue.get(timeout=1)]
+        except queue.Empty:
+            return []
+        if burst[0] is None:
+            return []
+        deadline = time.monotonic() + COALESCE_LINGER
+        while len(burst) < MAX_COALESCE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                message = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if message is None:
+                break
+            burst.append(message)
+        return burst
+
+    def coalesce(self, burst):
+        counts = {}
+        for message in burst:
+            counts[message] = counts.get(message, 0) + 1
+        return [message if count == 1 else f"{message} (x{count})" for message, count in counts.items()]
+
+    def connect(self):
+        sock = socket.create_connection(self.address, timeout=5)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.sendall(encode_frame(FRAME_HELLO, self.agent_id.encode()))
+        self.sock = sock
+
+    def run(self):
+        pending = []
+        attempt = 0
+        while self.running or pending:
+            if not pending:
+                pending = self.coalesce(self.collect_burst())
+                if not pending:
+                    continue
+            try:
+                if self.sock is None:
+                    self.connect()
+                self.sock.sendall(b"".join(encode_frame(FRAME_ALERT, message.encode()) for message in pending))
+                pending = []
+                attempt = 0
+            except OSError:
+                if self.sock is not None:
+                    self.sock.close()
+                    self.sock = None
+                if not self.running:
+                    break
+                time.sleep(RECONNECT_BACKOFF[min(attempt, len(RECONNECT_BACKOFF) - 1)])
+                attempt += 1
+
+    def close(self):
+        self.running = False
+        # Wake the sender so it flushes what is queued and exits.
+        self.queue.put(None)
+        self.thread.join(timeout=2)
+        if self.sock is not None:
+            self.sock.close()
@@ -0,0 +1,128 @@
+import json
+import threading
+import time
+from collections import deque
+
+DEFAULT_WINDOW = 5
+DEFAULT_AGGREGATE = "mean"
+DEFAULT_COOLDOWN = 5.0
+# Without an explicit "clear" level a rule re-arms once the aggregate drops this far below its threshold.
+DEFAULT_HYSTERESIS = 0.1
+METRIC_NAMES = {
+    "cpu_usage": "uso do CPU",
+    "ram_usage": "uso de RAM",
+    "packet_loss": "perda de pacotes",
+    "jitter": "jitter",
+    "latency": "latência",
+}
+
+
+class RollingWindow:
+    """Mean, max and EWMA over the last size samples, each updated in O(1) amortized."""
+
+    __slots__ = ("size", "samples", "total", "maxima", "ewma", "alpha", "count")
+
+    def __init__(self, size):
+        self.size = size
+        self.samples = deque()
+        self.total = 0.0
+        # Monotonically decreasing (index, value) pairs; the front is the window max.
+        self.maxima = deque()
+        self.ewma = None
+        self.alpha = 2 / (size + 1)
+        self.count = 0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.total += value
+        if len(self.samples) > self.size:
+            self.total -= self.samples.popleft()
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((self.count, value))
+        if self.maxima[0][0] <= self.count - self.size:
+            self.maxima.popleft()
+        self.ewma = value if self.ewma is None else self.ewma + self.alpha * (value - self.ewma)
+        self.count += 1
+
+    def value(self, aggregate):
+        if aggregate == "max":
+            return self.maxima[0][1]
+        if aggregate == "ewma":
+            return self.ewma
+        return self.total / len(self.samples)
+
+
+class AlertRule:
+    """Threshold rule with hysteresis and a cooldown between alerts."""
+
+    def __init__(self, metric, threshold, aggregate=DEFAULT_AGGREGATE, window=DEFAULT_WINDOW, clear=None, cooldown=DEFAULT_COOLDOWN):
+        if aggregate not in ("mean", "max", "ewma"):
+            raise ValueError(f"Agregado desconhecido na regra {metric}: {aggregate}")
+        self.metric = metric
+        self.threshold = threshold
+        self.aggregate = aggregate
+        self.window = RollingWindow(window)
+        self.clear = threshold * (1 - DEFAULT_HYSTERESIS) if clear is None else clear
+        self.cooldown = cooldown
+        self.active = False
+        self.last_fired = -float("inf")
+
+    def observe(self, value, now):
+        """Adds a sample; returns the aggregate if the rule fires, None otherwise."""
+        self.window.add(value)
+        current = self.window.value(self.aggregate)
+        if self.active:
+            if current < self.clear:
+                self.active = False
+            return None
+        if current > self.threshold and now - self.last_fired >= self.cooldown:
+            self.active = True
+            self.last_fired = now
+            return current
+        return None
+
+
+class RuleEngine:
+    """Evaluates every AlertRule of a metric stream on each new sample.
+
+    Safe to call from several task threads at once.
+    """
+
+    def __init__(self, rules):
+        self.lock = threading.Lock()
+        self.rules = {}
+        for rule in rules:
+            self.rules.setdefault(rule.metric, []).append(rule)
+
+    def observe(self, metric, value):
+        """Feeds one sample; returns the alert messages it triggered."""
+        messages = []
+        now = time.monotonic()
+        with self.lock:
+            for rule in self.rules.get(metric, ()):
+                fired = rule.observe(value, now)
+                if fired is not None:
+                    name = METRIC_NAMES.get(metric, metric)
+                    messages.append(f"Alerta de {name}: {rule.aggregate} {fired:.2f} acima do limite {rule.threshold}")
+        return messages
+
+
+def load_rules(file_path):
+    """Builds a RuleEngine from alertflow_conditions.json.
+
+    Each entry is either a plain threshold ({"cpu_usage": 80}) or a rule
+    object with "threshold" and optional "aggregate" (mean/max/ewma),
+    "window" (samples), "clear" and "cooldown" (seconds); a list of rule
+    objects declares several rules on the same metric.
+    """
+    with open(file_path, "r") as file:
+        conditions = json.load(file)
+    rules = []
+    for metric, spec in conditions.items():
+        for entry in spec if isinstance(spec, list) else [spec]:
+            if isinstance(entry, dict):
+                rules.append(AlertRule(metric, **entry))
+            else:
+                rules.append(AlertRule(metric, entry))
+    return RuleEngine(rules)
@@ -0,0 +1,246 @@
+import argparse
+import glob
+import os
+import time
+import warnings
+
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+
+import metrics
+import query
+import taskplan
+
+PERCENTILES = (50, 95, 99)
+# Robust z-score (0.6745 * deviation / MAD) above which a value is flagged (Iglewicz and Hoaglin).
+MAD_THRESHOLD = 3.5
+Z_THRESHOLD = 3.0
+# Scales the median absolute deviation to a standard deviation for normal data.
+MAD_SCALE = 0.6745
+
+console = Console()
+
+
+def ring_views(series):
+    """Zero-copy NumPy views of a series ring: (timestamps, values) over every physical slot."""
+    return np.frombuffer(series.timestamps, dtype=np.float64), np.frombuffer(series.values, dtype=np.float64)
+
+def series_arrays(series, start=None):
+    """(timestamps, values) of a series in time order, from the first sample at or after start.
+
+    While the samples are contiguous in the ring these are views into its
+    storage; only a ring that has wrapped needs its two halves joined.
+    """
+    timestamps, values = ring_views(series)
+    first = 0 if start is None else series.bisect(start)
+    count = len(series) - first
+    begin = series.index(first) if count else 0
+    if begin + count <= len(timestamps):
+        return timestamps[begin:begin + count], values[begin:begin + count]
+    head = len(timestamps) - begin
+    return (np.concatenate((timestamps[begin:], timestamps[:count - head])),
+            np.concatenate((values[begin:], values[:count - head])))
+
+
+class Fleet:
+    """Many series as row-aligned matrices, so every statistic is one vectorized call.
+
+    Row i holds the samples of keys[i] in time order, left-aligned and
+    padded with NaN; non-numeric results are NaN too, so every reduction
+    is NaN-aware. Timestamps are on the server's monotonic clock.
+    """
+
+    def __init__(self, keys, timestamps, values):
+        self.keys = keys
+        self.timestamps = timestamps
+        self.values = values
+        self.counts = np.count_nonzero(~np.isnan(values), axis=1)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def agents(self):
+        return [agent_id for agent_id, _ in self.keys]
+
+    def mean(self):
+        return nan_reduce(np.nanmean, self.values)
+
+    def percentiles(self, quantiles=PERCENTILES):
+        """(series, len(quantiles)) percentiles of every series at once."""
+        return nan_reduce(np.nanpercentile, self.values, quantiles).T.reshape(len(self), len(quantiles))
+
+    def fleet_percentiles(self, quantiles=PERCENTILES):
+        """Percentiles over the samples of all series together, e.g. p99 latency across agents."""
+        values = self.values[~np.isnan(self.values)]
+        return np.percentile(values, quantiles) if values.size else np.full(len(quantiles), np.nan)
+
+    def moving_average(self, window):
+        """Trailing mean over the last window samples of each series (NaN until window samples were seen)."""
+        valid = ~np.isnan(self.values)
+        sums = np.cumsum(np.where(valid, self.values, 0.0), axis=1)
+        counts = np.cumsum(valid, axis=1)
+        sums[:, window:] = sums[:, window:] - sums[:, :-window]
+        counts[:, window:] = counts[:, window:] - counts[:, :-window]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            averages = sums / counts
+        averages[:, :window - 1] = np.nan
+        averages[~valid] = np.nan
+        return averages
+
+    def rates(self):
+        """Per-sample change per second of every series (one column fewer than values)."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.diff(self.values, axis=1) / np.diff(self.timestamps, axis=1)
+
+    def trends(self):
+        """Least-squares slope (units per second) of every series, e.g. the RAM trend per agent."""
+        valid = ~np.isnan(self.values) & ~np.isnan(self.timestamps)
+        count = valid.sum(axis=1)
+        times = np.where(valid, self.timestamps, 0.0)
+        values = np.where(valid, self.values, 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_time = times.sum(axis=1) / count
+            mean_value = values.sum(axis=1) / count
+            centered = np.where(valid, self.timestamps - mean_time[:, None], 0.0)
+            return (centered * np.where(valid, self.values - mean_value[:, None], 0.0)).sum(axis=1) / \
+                (centered ** 2).sum(axis=1)
+
+    def sample_anomalies(self, threshold=MAD_THRESHOLD):
+        """Samples whose robust z-score against their own series exceeds threshold."""
+        median = nan_reduce(np.nanmedian, self.values)
+        deviation = np.abs(self.values - median[:, None])
+        mad = nan_reduce(np.nanmedian, deviation)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scores = MAD_SCALE * deviation / mad[:, None]
+        return np.nan_to_num(scores) > threshold
+
+    def compare(self, statistic=None):
+        """Compares one value per series (default: its mean) with the rest of the fleet.
+
+        Returns a dict of arrays aligned with keys: value, the fleet median,
+        ratio to it, z-score, robust (MAD) score and whether either score
+        flags the series as deviating.
+        """
+        value = self.mean() if statistic is None else np.asarray(statistic, dtype=np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            z = (value - np.nanmean(value)) / np.nanstd(value)
+            median = np.nanmedian(value)
+            mad = np.nanmedian(np.abs(value - median))
+            robust = MAD_SCALE * (value - median) / mad
+            ratio = value / median
+        flagged = (np.abs(np.nan_to_num(z)) > Z_THRESHOLD) | (np.abs(np.nan_to_num(robust)) > MAD_THRESHOLD)
+        return {"value": value, "median": np.full(len(value), median), "ratio": ratio, "z": z, "mad": robust,
+                "flagged": flagged}
+
+
+def nan_reduce(function, values, *args):
+    """Row-wise NaN-aware reduction that returns NaN for all-NaN rows without warnings."""
+    if not values.size:
+        return np.full(values.shape[0], np.nan) if not args else np.full((len(args[0]), values.shape[0]), np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return function(values, *args, axis=1)
+
+def fleet(agent_id=None, task_id=None, task_type=None, last=None):
+    """Gathers the selected series (see query.select_series) into a Fleet, optionally the last N seconds."""
+    start = None if last is None else time.monotonic() - last
+    keys, columns = [], []
+    for aid, tid, series in query.select_series(agent_id, task_id, task_type):
+        timestamps, values = series_arrays(series, start)
+        if len(values):
+            keys.append((aid, tid))
+            columns.append((timestamps, values))
+    width = max((len(values) for _, values in columns), default=0)
+    timestamps = np.full((len(keys), width), np.nan)
+    values = np.full((len(keys), width), np.nan)
+    for row, (series_timestamps, series_values) in enumerate(columns):
+        timestamps[row, :len(series_timestamps)] = series_timestamps
+        values[row, :len(series_values)] = series_values
+    return Fleet(keys, timestamps, values)
+
+def load_task_types(path):
+    """Registers the type of every task in a plan: the segment log does not record it, --task-type needs it."""
+    for task in taskplan.iter_tasks(path):
+        metrics.register_task(task["Task_ID"], task["Task_Type"])
+
+def export(path, selected):
+    """Writes a Fleet for offline analysis.
+
+    .npz: the padded matrices (wall-clock timestamps) with agent and task
+    ids per row. .npy: one structured record (agent, task, timestamp,
+    value) per sample, the long format most tools load directly.
+    """
+    wall_timestamps = selected.timestamps + metrics.WALL_CLOCK_OFFSET
+    agents = np.array([agent_id for agent_id, _ in selected.keys], dtype="U16")
+    tasks = np.array([task_id for _, task_id in selected.keys], dtype=np.uint16)
+    if path.endswith(".npy"):
+        rows, columns = np.nonzero(~np.isnan(wall_timestamps))
+        records = np.empty(len(rows), dtype=[("agent", "U16"), ("task", np.uint16), ("timestamp", np.float64),
+                                             ("value", np.float64)])
+        records["agent"] = agents[rows]
+        records["task"] = tasks[rows]
+        records["timestamp"] = wall_timestamps[rows, columns]
+        records["value"] = selected.values[rows, columns]
+        np.save(path, records)
+    else:
+        np.savez_compressed(path, agents=agents, tasks=tasks, timestamps=wall_timestamps, values=selected.values)
+
+def display_comparison(selected):
+    table = Table(title=f"Comparação entre {len(selected)} séries")
+    table.add_column("Agente", justify="center")
+    table.add_column("Tarefa", justify="center")
+    table.add_column("Média", justify="right")
+    for quantile in PERCENTILES:
+        table.add_column(f"p{quantile}", justify="right")
+    table.add_column("Tendência/min", justify="right")
+    table.add_column("z", justify="right")
+    table.add_column("MAD", justify="right")
+    table.add_column("Amostras anómalas", justify="right")
+    comparison = selected.compare()
+    percentiles = selected.percentiles()
+    trends = selected.trends() * 60
+    anomalies = selected.sample_anomalies().sum(axis=1)
+    for row, (agent_id, task_id) in enumerate(selected.keys):
+        style = "bold red" if comparison["flagged"][row] else None
+        table.add_row(agent_id, str(task_id), f"{comparison['value'][row]:.2f}",
+                      *(f"{value:.2f}" for value in percentiles[row]), f"{trends[row]:+.3f}",
+                      f"{comparison['z'][row]:+.2f}", f"{comparison['mad'][row]:+.2f}", str(anomalies[row]),
+                      style=style)
+    console.print(table)
+    fleet_percentiles = ", ".join(f"p{quantile} {value:.2f}"
+                                  for quantile, value in zip(PERCENTILES, selected.fleet_percentiles()))
+    console.print(f"Frota: {fleet_percentiles}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Análise vetorizada das métricas guardadas")
+    parser.add_argument("--metrics-dir", default="metrics_data", help="diretório dos segmentos de métricas")
+    parser.add_argument("--agent", help="só este agente")
+    parser.add_argument("--task", type=int, help="só esta tarefa")
+    parser.add_argument("--task-type", type=int, help="só tarefas deste tipo")
+    parser.add_argument("--tasks", default="tasks.json", help="plano de tarefas com o tipo de cada tarefa")
+    parser.add_argument("--last", type=float, help="só os últimos N segundos")
+    parser.add_argument("--export", metavar="FICHEIRO", help="exporta as séries para .npz ou .npy")
+    args = parser.parse_args()
+
+    # Read-only, so a running server's logs are never truncated or extended; a
+    # sharded server keeps one log per shard under shard-N.
+    if args.task_type is not None:
+        try:
+            load_task_types(args.tasks)
+        except (OSError, ValueError, KeyError) as e:
+            console.print(f"[bold red]Erro ao ler o plano de tarefas: {e}[/bold red]")
+            return
+    metrics.load_history([args.metrics_dir, *sorted(glob.glob(os.path.join(args.metrics_dir, "shard-*")))])
+    selected = fleet(args.agent, args.task, args.task_type, args.last)
+    if not len(selected):
+        console.print("[bold red]Nenhuma série encontrada.[/bold red]")
+        return
+    display_comparison(selected)
+    if args.export:
+        export(args.export, selected)
+        console.print(f"[bold green]{len(selected)} séries exportadas para {args.export}.[/bold green]")
+
+if __name__ == "__main__":
+    main()
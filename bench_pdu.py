@@ -0,0 +1,114 @@
+import argparse
+import json
+import struct
+import time
+import timeit
+
+from rich.console import Console
+from rich.table import Table
+
+import pdu
+
+DEFAULT_NUMBER = 100000
+REPEAT = 5
+AGENT_ID = "pc1"
+TEXT_TASK = {"Agent_ID": AGENT_ID, "Task_ID": 7, "Task_Type": 1, "Interface_Check": "eth0",
+             "Data": "CPU", "Frequency": 5, "Duration": 30}
+ADDRESS_TASK = {"Agent_ID": AGENT_ID, "Task_ID": 8, "Task_Type": 3, "Interface_Check": "eth0",
+                "Data": "10.0.4.10", "Frequency": 5, "Duration": 30}
+RESULT_TEXT = "Percentagem de uso da CPU: 12.34%"
+BATCH = [(time.time(), 7, 1, 12.34)] * pdu.MAX_BATCH_SAMPLES
+
+console = Console()
+
+
+def legacy_encode_task(sequence_number, task):
+    """The format-string-per-call encoder this module replaced, kept as a baseline."""
+    interface_check = task.get("Interface_Check", "").encode()
+    task_data = task["Data"].encode()
+    return struct.pack(f"!B H H B B {len(interface_check)}s {len(task_data)}s B B", 3, sequence_number,
+                       task["Task_ID"], task["Task_Type"], len(interface_check), interface_check, task_data,
+                       task.get("Frequency", 5), task.get("Duration", 30))
+
+def legacy_decode_task(data):
+    """The slicing decoder this module replaced, kept as a baseline."""
+    sequence_number, task_id, task_type = struct.unpack("!H H B", data[1:6])
+    interface_length = data[6]
+    return {
+        "Sequence_Number": sequence_number,
+        "Task_ID": task_id,
+        "Task_Type": task_type,
+        "Interface_Check": data[7:7 + interface_length].decode(),
+        "Data": data[7 + interface_length:-2].decode(),
+        "Frequency": struct.unpack("!B B", data[-2:])[0],
+        "Duration": struct.unpack("!B B", data[-2:])[1],
+    }
+
+def drain(iterator):
+    for _ in iterator:
+        pass
+
+def cases():
+    """(name, callable) for encode and decode of every message type."""
+    register = pdu.encode_identified(pdu.REGISTER, 1, AGENT_ID)
+    ack = pdu.encode_header(pdu.ACK, 1)
+    text_task = pdu.encode_task(1, TEXT_TASK)
+    address_task = pdu.encode_task(1, ADDRESS_TASK)
+    result = pdu.encode_result(7, AGENT_ID, RESULT_TEXT)
+    exit_signal = pdu.encode_header(pdu.EXIT, 0)
+    batch = pdu.encode_batch(1, AGENT_ID, BATCH)
+    batch_ack = pdu.encode_header(pdu.BATCH_ACK, 1)
+    heartbeat = pdu.encode_identified(pdu.HEARTBEAT, 1, AGENT_ID)
+    cancel = pdu.encode_cancel(1, 7)
+    legacy_task = bytes(text_task)
+    template = bytearray(text_task)
+    return [
+        ("1 registo: encode", lambda: pdu.encode_identified(pdu.REGISTER, 1, AGENT_ID)),
+        ("1 registo: decode", lambda: pdu.decode_identified(register)),
+        ("2 ACK: encode", lambda: pdu.encode_header(pdu.ACK, 1)),
+        ("2 ACK: decode", lambda: pdu.decode_header(ack)),
+        ("3 tarefa (texto): encode", lambda: pdu.encode_task(1, TEXT_TASK)),
+        ("3 tarefa (texto): decode", lambda: pdu.decode_task(text_task)),
+        ("3 tarefa (IPv4): encode", lambda: pdu.encode_task(1, ADDRESS_TASK)),
+        ("3 tarefa (IPv4): decode", lambda: pdu.decode_task(address_task)),
+        ("3 tarefa: stamp do modelo", lambda: pdu.stamp(template, 1)),
+        ("3 tarefa: encode antigo", lambda: legacy_encode_task(1, TEXT_TASK)),
+        ("3 tarefa: decode antigo", lambda: legacy_decode_task(legacy_task)),
+        ("3 resultado: encode", lambda: pdu.encode_result(7, AGENT_ID, RESULT_TEXT)),
+        ("3 resultado: decode", lambda: pdu.decode_result(result)),
+        ("4 saída: encode", lambda: pdu.encode_header(pdu.EXIT, 0)),
+        ("4 saída: decode", lambda: pdu.decode_header(exit_signal)),
+        (f"5 lote ({len(BATCH)} amostras): encode", lambda: pdu.encode_batch(1, AGENT_ID, BATCH)),
+        (f"5 lote ({len(BATCH)} amostras): decode", lambda: drain(pdu.decode_batch(batch)[2])),
+        ("6 ACK de lote: encode", lambda: pdu.encode_header(pdu.BATCH_ACK, 1)),
+        ("6 ACK de lote: decode", lambda: pdu.decode_header(batch_ack)),
+        ("7 heartbeat: encode", lambda: pdu.encode_identified(pdu.HEARTBEAT, 1, AGENT_ID)),
+        ("7 heartbeat: decode", lambda: pdu.decode_identified(heartbeat)),
+        ("8 cancelamento: encode", lambda: pdu.encode_cancel(1, 7)),
+        ("8 cancelamento: decode", lambda: pdu.decode_cancel(cancel)),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks do codec de PDUs")
+    parser.add_argument("--number", type=int, default=DEFAULT_NUMBER, help="chamadas por medição")
+    parser.add_argument("--json", action="store_true", help="imprime os resultados em JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for name, function in cases():
+        # Best of REPEAT runs, the least disturbed by the rest of the system.
+        best = min(timeit.repeat(function, number=args.number, repeat=REPEAT))
+        results[name] = round(best / args.number * 1e9, 1)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    table = Table(title=f"Codec de PDUs (melhor de {REPEAT} x {args.number} chamadas)")
+    table.add_column("Mensagem", justify="left")
+    table.add_column("ns/chamada", justify="right")
+    for name, nanoseconds in results.items():
+        table.add_row(name, f"{nanoseconds:.1f}")
+    console.print(table)
+
+if __name__ == "__main__":
+    main()
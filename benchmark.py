@@ -0,0 +1,420 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import psutil
+from rich.console import Console
+from rich.table import Table
+
+import pdu
+import query
+from reliability import backoff_delay
+
+BENCH_IP = "127.0.0.1"
+BENCH_PORT = 15005
+DEFAULT_AGENTS = 1000
+DEFAULT_RESULTS = 20
+DEFAULT_TASKS = 1
+RESPONSE_TIMEOUT = 1.0
+MAX_ATTEMPTS = 5
+# Registration retries back off like the real agent's (NMS_Agent.Registration).
+REGISTRATION_BACKOFF_BASE = 0.5
+REGISTRATION_BACKOFF_CAP = 8.0
+SERVER_STARTUP_TIMEOUT = 10.0
+RSS_SAMPLE_INTERVAL = 0.25
+RESULTS_DIR = "bench_results"
+AGENT_ID_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
+# Never produced by agent_name(), so readiness probes cannot collide with simulated agents.
+READINESS_AGENT_ID = b"---"
+LATENCY_PERCENTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("p999", 0.999))
+# Fields shown by --compare, as (section, key, label).
+COMPARED_FIELDS = (
+    ("registration", "per_second", "Registos/s"),
+    ("ingest", "per_second", "Métricas/s"),
+    ("ack_latency_ms", "p50", "Latência ACK p50 (ms)"),
+    ("ack_latency_ms", "p99", "Latência ACK p99 (ms)"),
+    ("retransmissions", "total", "Retransmissões"),
+    ("registration", "reregistrations", "Novos registos pedidos"),
+    ("server", "cpu_seconds", "CPU do servidor (s)"),
+    ("server", "peak_rss_bytes", "RSS máximo (bytes)"),
+)
+
+console = Console()
+
+
+def agent_name(index):
+    """Three-character base-36 agent id, unique for up to 46656 simulated agents."""
+    name = ""
+    for _ in range(3):
+        index, digit = divmod(index, len(AGENT_ID_ALPHABET))
+        name = AGENT_ID_ALPHABET[digit] + name
+    return name.encode()
+
+
+class BenchStats:
+    def __init__(self):
+        self.registered = 0
+        self.registration_failures = 0
+        self.registration_retransmissions = 0
+        self.reregistrations = 0
+        self.results_sent = 0
+        self.results_acked = 0
+        self.results_lost = 0
+        self.ingest_retransmissions = 0
+        self.latencies = []
+
+
+class SimulatedAgent(asyncio.DatagramProtocol):
+    """One fake agent on its own UDP socket, speaking the real agent's PDUs.
+
+    Every request is stop-and-wait: it is retransmitted until the matching
+    ACK arrives or MAX_ATTEMPTS is reached, every RESPONSE_TIMEOUT for
+    results and with jittered exponential backoff for registrations. The
+    latency recorded is the one of the answered transmission. A REGISTER
+    from the server (it restarted and forgot the agent) triggers a new
+    handshake while results keep flowing.
+    """
+
+    def __init__(self, agent_id, stats):
+        self.agent_id = agent_id
+        self.stats = stats
+        # {(kind, sequence number): future resolved with the arrival time}
+        self.waiters = {}
+        self.registration_sequence = 0
+        self.registering = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < pdu.HEADER.size:
+            return
+        message_type, sequence_number = pdu.decode_header(data)
+        if message_type == pdu.REGISTER:
+            if self.registering is None or self.registering.done():
+                self.stats.reregistrations += 1
+                self.registering = asyncio.get_running_loop().create_task(self.register())
+            return
+        if message_type != pdu.ACK:
+            return
+        # Registration ACKs echo the agent id (6 bytes), result ACKs do not.
+        key = ("registration" if len(data) >= pdu.IDENTIFIED.size else "result", sequence_number)
+        future = self.waiters.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    async def request(self, key, message, backoff=False):
+        """Sends message until answered; returns (latency or None, retransmissions)."""
+        loop = asyncio.get_running_loop()
+        for attempt in range(MAX_ATTEMPTS):
+            future = self.waiters[key] = loop.create_future()
+            sent_at = time.perf_counter()
+            self.transport.sendto(message)
+            timeout = backoff_delay(attempt, REGISTRATION_BACKOFF_BASE, REGISTRATION_BACKOFF_CAP) if backoff else RESPONSE_TIMEOUT
+            try:
+                return await asyncio.wait_for(future, timeout) - sent_at, attempt
+            except asyncio.TimeoutError:
+                self.waiters.pop(key, None)
+        return None, MAX_ATTEMPTS - 1
+
+    async def register(self):
+        stats = self.stats
+        # A fresh sequence number per handshake keeps late ACKs of an older one apart.
+        for _ in range(MAX_ATTEMPTS):
+            self.registration_sequence = self.registration_sequence % 65535 + 1
+            key = ("registration", self.registration_sequence)
+            latency, retransmissions = await self.request(key, pdu.encode_identified(pdu.REGISTER, key[1], self.agent_id), backoff=True)
+            stats.registration_retransmissions += retransmissions
+            if latency is None:
+                break
+            latency, retransmissions = await self.request(key, pdu.encode_identified(pdu.ACK, key[1], self.agent_id), backoff=True)
+            stats.registration_retransmissions += retransmissions
+            if latency is not None:
+                stats.registered += 1
+                return True
+        stats.registration_failures += 1
+        return False
+
+    async def send_results(self, task_id, count):
+        stats = self.stats
+        for n in range(count):
+            result = pdu.encode_result(task_id, self.agent_id, f"Percentagem de uso da CPU: {(n * 7.3) % 100:.2f}%")
+            stats.results_sent += 1
+            latency, retransmissions = await self.request(("result", task_id), result)
+            stats.ingest_retransmissions += retransmissions
+            if latency is None:
+                stats.results_lost += 1
+            else:
+                stats.results_acked += 1
+                stats.latencies.append(latency * 1000)
+
+    def exit(self):
+        self.transport.sendto(pdu.encode_header(pdu.EXIT, 0))
+
+
+class ServerMonitor:
+    """CPU time and RSS of the server process and its shard workers."""
+
+    def __init__(self, pid):
+        self.process = psutil.Process(pid)
+        self.peak_rss = 0
+        # CPU time of server processes that have been replaced by a restart.
+        self.cpu_offset = 0.0
+
+    def replace(self, pid):
+        self.cpu_offset = self.cpu_seconds()
+        self.process = psutil.Process(pid)
+
+    def processes(self):
+        try:
+            return [self.process] + self.process.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+
+    def cpu_seconds(self):
+        total = self.cpu_offset
+        for process in self.processes():
+            try:
+                times = process.cpu_times()
+                total += times.user + times.system
+            except psutil.NoSuchProcess:
+                pass
+        return total
+
+    def rss(self):
+        total = 0
+        for process in self.processes():
+            try:
+                total += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        self.peak_rss = max(self.peak_rss, total)
+        return total
+
+    async def sample_rss(self):
+        while True:
+            self.rss()
+            await asyncio.sleep(RSS_SAMPLE_INTERVAL)
+
+
+def start_server(ip, port, workers, metrics_dir):
+    command = [sys.executable, "NMS_Server.py", "--headless", "--throughput-port", "0", "--ip", ip, "--port", str(port),
+               "--workers", str(workers), "--metrics-dir", metrics_dir]
+    return subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def stop_server(process):
+    # SIGINT lets the server stop its shard workers and close persistence.
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+async def wait_for_server(ip, port, timeout=SERVER_STARTUP_TIMEOUT):
+    loop = asyncio.get_running_loop()
+    transport, probe = await loop.create_datagram_endpoint(lambda: SimulatedAgent(READINESS_AGENT_ID, BenchStats()), remote_addr=(ip, port))
+    try:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            future = probe.waiters[("registration", 0)] = loop.create_future()
+            try:
+                transport.sendto(pdu.encode_identified(pdu.REGISTER, 0, READINESS_AGENT_ID))
+                await asyncio.wait_for(future, 0.2)
+                return True
+            except (asyncio.TimeoutError, ConnectionRefusedError):
+                await asyncio.sleep(0.1)
+        return False
+    finally:
+        transport.close()
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    summary = {name: query.percentile(latencies, fraction) for name, fraction in LATENCY_PERCENTILES}
+    summary["mean"] = sum(latencies) / len(latencies) if latencies else None
+    summary["max"] = latencies[-1] if latencies else None
+    return {name: None if value is None or value != value else round(value, 4) for name, value in summary.items()}
+
+def per_second(count, seconds):
+    return round(count / seconds, 1) if seconds > 0 else None
+
+async def restart_later(delay, restart):
+    await asyncio.sleep(delay)
+    await asyncio.get_running_loop().run_in_executor(None, restart)
+
+async def run_benchmark(args, monitor, restart=None):
+    loop = asyncio.get_running_loop()
+    stats = BenchStats()
+    simulated = []
+    for index in range(args.agents):
+        transport, agent = await loop.create_datagram_endpoint(lambda index=index: SimulatedAgent(agent_name(index), stats),
+                                                               remote_addr=(args.ip, args.port))
+        simulated.append(agent)
+    sampler = loop.create_task(monitor.sample_rss())
+    try:
+        cpu_start = monitor.cpu_seconds()
+        started = time.perf_counter()
+        registered = await asyncio.gather(*(agent.register() for agent in simulated))
+        registration_seconds = time.perf_counter() - started
+        registered_count = stats.registered
+        cpu_registered = monitor.cpu_seconds()
+
+        started = time.perf_counter()
+        if restart is not None and args.restart_after is not None:
+            loop.create_task(restart_later(args.restart_after, restart))
+        await asyncio.gather(*(agent.send_results(task_id, args.results)
+                               for agent, ok in zip(simulated, registered) if ok
+                               for task_id in range(1, args.tasks + 1)))
+        ingest_seconds = time.perf_counter() - started
+        cpu_ingested = monitor.cpu_seconds()
+
+        for agent in simulated:
+            agent.exit()
+        # Leave the server time to drain the exit signals before the last samples.
+        await asyncio.sleep(0.5)
+        rss = monitor.rss()
+    finally:
+        sampler.cancel()
+        for agent in simulated:
+            agent.transport.close()
+
+    return {
+        "registration": {
+            "agents": args.agents,
+            "registered": registered_count,
+            "failed": stats.registration_failures,
+            "reregistrations": stats.reregistrations,
+            "seconds": round(registration_seconds, 4),
+            "per_second": per_second(registered_count, registration_seconds),
+        },
+        "ingest": {
+            "sent": stats.results_sent,
+            "acked": stats.results_acked,
+            "lost": stats.results_lost,
+            "seconds": round(ingest_seconds, 4),
+            "per_second": per_second(stats.results_acked, ingest_seconds),
+        },
+        "ack_latency_ms": latency_summary(stats.latencies),
+        "retransmissions": {
+            "registration": stats.registration_retransmissions,
+            "ingest": stats.ingest_retransmissions,
+            "total": stats.registration_retransmissions + stats.ingest_retransmissions,
+        },
+        "server": {
+            "cpu_seconds": round(monitor.cpu_seconds() - cpu_start, 3),
+            "registration_cpu_percent": round(100 * (cpu_registered - cpu_start) / registration_seconds, 1),
+            "ingest_cpu_percent": round(100 * (cpu_ingested - cpu_registered) / ingest_seconds, 1) if ingest_seconds else None,
+            "rss_bytes": rss,
+            "peak_rss_bytes": monitor.peak_rss,
+        },
+    }
+
+def git_revision():
+    """Short HEAD hash, suffixed with "-dirty" when the tree has local changes."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=directory,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=directory,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{revision}-dirty" if dirty else revision
+
+def raise_file_limit(sockets):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = sockets + 64
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+
+def compare(previous, current):
+    table = Table(title=f"{previous.get('commit')} → {current.get('commit')}")
+    table.add_column("Métrica", justify="left")
+    table.add_column("Antes", justify="right")
+    table.add_column("Depois", justify="right")
+    table.add_column("Variação", justify="right")
+    for section, key, label in COMPARED_FIELDS:
+        before = previous.get(section, {}).get(key)
+        after = current.get(section, {}).get(key)
+        change = f"{100 * (after - before) / before:+.1f}%" if before and after is not None else "-"
+        table.add_row(label, str(before), str(after), change)
+    console.print(table)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do NMS Server com agentes simulados")
+    parser.add_argument("--agents", type=int, default=DEFAULT_AGENTS, help="agentes simulados")
+    parser.add_argument("--tasks", type=int, default=DEFAULT_TASKS, help="tarefas em paralelo por agente")
+    parser.add_argument("--results", type=int, default=DEFAULT_RESULTS, help="métricas enviadas por tarefa")
+    parser.add_argument("--workers", type=int, default=1, help="processos do servidor (SO_REUSEPORT)")
+    parser.add_argument("--ip", default=BENCH_IP, help="endereço do servidor")
+    parser.add_argument("--port", type=int, default=BENCH_PORT, help="porta UDP do servidor")
+    parser.add_argument("--attach", type=int, metavar="PID",
+                        help="usa um servidor já em execução com este PID em vez de arrancar um")
+    parser.add_argument("--restart-after", type=float, metavar="SEGUNDOS",
+                        help="reinicia o servidor este tempo depois do início do envio de métricas")
+    parser.add_argument("--output", help=f"ficheiro JSON de resultados (por omissão {RESULTS_DIR}/<commit>.json)")
+    parser.add_argument("--compare", metavar="JSON", help="resultados anteriores a comparar com esta execução")
+    args = parser.parse_args()
+    if len(AGENT_ID_ALPHABET) ** 3 < args.agents:
+        parser.error(f"no máximo {len(AGENT_ID_ALPHABET) ** 3} agentes")
+    raise_file_limit(args.agents)
+
+    if args.restart_after is not None and args.attach is not None:
+        parser.error("--restart-after só é possível com um servidor arrancado pelo benchmark")
+
+    servers = []
+    with tempfile.TemporaryDirectory(prefix="nms-bench-") as metrics_dir:
+        if args.attach is None:
+            servers.append(start_server(args.ip, args.port, args.workers, metrics_dir))
+        try:
+            if not asyncio.run(wait_for_server(args.ip, args.port)):
+                console.print(f"[bold red]O servidor não respondeu em {args.ip}:{args.port}.[/bold red]")
+                sys.exit(1)
+            monitor = ServerMonitor(servers[-1].pid if servers else args.attach)
+
+            def restart():
+                # A fresh process and metrics directory: the server forgets every agent.
+                stop_server(servers[-1])
+                servers.append(start_server(args.ip, args.port, args.workers, tempfile.mkdtemp(dir=metrics_dir)))
+                monitor.replace(servers[-1].pid)
+
+            results = asyncio.run(run_benchmark(args, monitor, restart))
+        finally:
+            for server in servers:
+                if server.poll() is None:
+                    stop_server(server)
+
+    report = {
+        "commit": git_revision(),
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "config": {
+            "agents": args.agents,
+            "tasks": args.tasks,
+            "results": args.results,
+            "workers": args.workers,
+            "attached": args.attach is not None,
+            "restart_after": args.restart_after,
+        },
+        **results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(json.dumps(report, indent=2))
+    console.print(f"[bold green]Resultados gravados em {output}[/bold green]")
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import fnmatch
+import heapq
+import math
+import time
+
+from rich.console import Group
+from rich.live import Live
+from rich.table import Table
+from rich.text import Text
+
+import metrics
+
+REFRESH_INTERVAL = 1.0
+# Seconds summarized by the min/avg/max columns, rounded to whole buckets of the finest rollup tier.
+WINDOW = 300
+PAGE_SIZE = 20
+TOP_N = 5
+# Most recent raw samples drawn in the sparkline.
+SPARK_WIDTH = 30
+SPARK_BLOCKS = "▁▂▃▄▅▆▇█"
+# Units where a lower value is the worse one (everything else: higher is worse).
+LOWER_IS_WORSE = (metrics.UNIT_CODES["Mbits/sec"],)
+COMMANDS = "s: página seguinte, a: anterior, f <filtro>: filtrar, Enter: continuar, q: sair"
+
+
+class SeriesSummary:
+    """Dashboard row of one series, valid while its newest sample and the current bucket stay the same."""
+
+    __slots__ = ("last_timestamp", "bucket", "latest", "unit", "spark", "low", "avg", "high", "count")
+
+
+def sparkline(values):
+    if not values:
+        return ""
+    low, high = min(values), max(values)
+    scale = (len(SPARK_BLOCKS) - 1) / (high - low) if high > low else 0
+    return "".join(SPARK_BLOCKS[int((value - low) * scale)] for value in values)
+
+
+class Dashboard:
+    """Live view over per-series summaries instead of every stored sample.
+
+    A row costs at most SPARK_WIDTH raw samples plus the rollup buckets
+    covering the window, and is recomputed only when its series received a
+    sample or the window moved to a new bucket, so a refresh is independent
+    of how much history is stored. Only the visible page and the series
+    competing for its top-N tables are summarized.
+    """
+
+    def __init__(self, window=WINDOW, page_size=PAGE_SIZE, top_n=TOP_N, refresh=None):
+        self.window = window
+        self.page_size = page_size
+        self.top_n = top_n
+        # Called before each redraw, e.g. to merge the series of server shards.
+        self.refresh = refresh
+        self.pattern = ""
+        self.page = 0
+        self.summaries = {}
+        self.keys = []
+        self.keys_version = None
+
+    def set_filter(self, pattern):
+        self.pattern = pattern.strip()
+        self.page = 0
+        self.keys_version = None
+
+    def matches(self, key, series):
+        text = f"{key[0]} {key[1]} {series.label}".lower()
+        pattern = self.pattern.lower()
+        if any(char in pattern for char in "*?["):
+            return fnmatch.fnmatch(text, pattern) or fnmatch.fnmatch(key[0].lower(), pattern)
+        return pattern in text
+
+    def filtered_keys(self):
+        """Sorted (agent, task) keys passing the filter, rebuilt only when series are added."""
+        version = len(metrics.metrics_data)
+        if version != self.keys_version:
+            self.keys = sorted(key for key, series in metrics.metrics_data.items()
+                               if not self.pattern or self.matches(key, series))
+            self.keys_version = version
+        return self.keys
+
+    def page_count(self):
+        return max(1, math.ceil(len(self.filtered_keys()) / self.page_size))
+
+    def move(self, pages):
+        self.page = min(max(self.page + pages, 0), self.page_count() - 1)
+
+    def summarize(self, key, now):
+        series = metrics.metrics_data.get(key)
+        if series is None or not len(series):
+            return None
+        tier = series.tiers[0]
+        last_timestamp = series.timestamps[series.index(len(series) - 1)]
+        bucket = int(now // tier.resolution)
+        summary = self.summaries.get(key)
+        if summary is not None and summary.last_timestamp == last_timestamp and summary.bucket == bucket:
+            return summary
+
+        summary = SeriesSummary()
+        summary.last_timestamp = last_timestamp
+        summary.bucket = bucket
+        last_slot = series.index(len(series) - 1)
+        summary.latest = series.format(series.values[last_slot], series.units[last_slot])
+        summary.unit = series.units[last_slot]
+        recent = []
+        for i in range(max(0, len(series) - SPARK_WIDTH), len(series)):
+            value = series.values[series.index(i)]
+            if not math.isnan(value):
+                recent.append(value)
+        summary.spark = sparkline(recent)
+        low = high = math.nan
+        total = count = 0
+        for _, bucket_min, bucket_max, bucket_avg, bucket_count, _ in tier.buckets(now - self.window, now, now):
+            low = bucket_min if not count else min(low, bucket_min)
+            high = bucket_max if not count else max(high, bucket_max)
+            total += bucket_avg * bucket_count
+            count += bucket_count
+        summary.low, summary.high = low, high
+        summary.avg = total / count if count else math.nan
+        summary.count = count
+        self.summaries[key] = summary
+        return summary
+
+    def worst(self, task_id, now):
+        """The top_n agents with the worst window average for a task."""
+        candidates = []
+        for agent_id, series in metrics.series_by_task.get(task_id, {}).items():
+            if self.pattern and not self.matches((agent_id, task_id), series):
+                continue
+            summary = self.summarize((agent_id, task_id), now)
+            if summary is not None and not math.isnan(summary.avg):
+                candidates.append((summary.avg, agent_id, summary.unit))
+        if not candidates:
+            return []
+        select = heapq.nsmallest if candidates[0][2] in LOWER_IS_WORSE else heapq.nlargest
+        return select(self.top_n, candidates, key=lambda candidate: candidate[0])
+
+    def render(self):
+        now = time.monotonic()
+        keys = self.filtered_keys()
+        self.move(0)
+        visible = keys[self.page * self.page_size:(self.page + 1) * self.page_size]
+
+        table = Table(title=f"Métricas (janela de {self.window:g}s)", expand=True)
+        table.add_column("Agente", justify="center")
+        table.add_column("Tarefa", justify="center")
+        table.add_column("Último valor", justify="left")
+        table.add_column("Tendência", justify="left", no_wrap=True)
+        table.add_column("Mín", justify="right")
+        table.add_column("Média", justify="right")
+        table.add_column("Máx", justify="right")
+        table.add_column("Amostras", justify="right")
+        for key in visible:
+            summary = self.summarize(key, now)
+            if summary is None:
+                continue
+            table.add_row(key[0], str(key[1]), summary.latest, summary.spark, f"{summary.low:.2f}",
+                          f"{summary.avg:.2f}", f"{summary.high:.2f}", str(summary.count))
+
+        worst = Table(title=f"Piores {self.top_n} agentes por tarefa", expand=True)
+        worst.add_column("Tarefa", justify="center")
+        worst.add_column("Agentes (média na janela)", justify="left")
+        for task_id in sorted({task_id for _, task_id in visible}):
+            ranking = self.worst(task_id, now)
+            if ranking:
+                worst.add_row(str(task_id), ", ".join(f"{agent_id} {avg:.2f}" for avg, agent_id, _ in ranking))
+
+        footer = Text(f"Página {self.page + 1}/{self.page_count()} · {len(keys)} séries"
+                      f"{f' · filtro: {self.pattern}' if self.pattern else ''} · Ctrl+C para comandos",
+                      style="dim")
+        return Group(table, worst, footer)
+
+    def command(self, line):
+        """Applies a command typed while paused; False to leave the dashboard."""
+        line = line.strip()
+        if line == "q":
+            return False
+        if line == "s":
+            self.move(1)
+        elif line == "a":
+            self.move(-1)
+        elif line.startswith("f"):
+            self.set_filter(line[1:])
+        return True
+
+    def run(self):
+        """Redraws every REFRESH_INTERVAL until Ctrl+C, then reads a paging/filter command."""
+        while True:
+            try:
+                if self.refresh is not None:
+                    self.refresh()
+                with Live(self.render(), console=metrics.console, auto_refresh=False) as live:
+                    while True:
+                        time.sleep(REFRESH_INTERVAL)
+                        if self.refresh is not None:
+                            self.refresh()
+                        live.update(self.render(), refresh=True)
+            except KeyboardInterrupt:
+                pass
+            try:
+                if not self.command(metrics.console.input(f"[bold]Comando[/bold] ({COMMANDS}): ")):
+                    return
+            except (KeyboardInterrupt, EOFError):
+                return
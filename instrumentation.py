@@ -0,0 +1,237 @@
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STATS_HOST = "127.0.0.1"
+STATS_PORT = 9105
+# Histogram resolution: 2**SUB_BUCKET_BITS linear sub-buckets per power of two,
+# i.e. a relative error below 1 / 2**(SUB_BUCKET_BITS - 1) (~1.6%).
+SUB_BUCKET_BITS = 7
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_SUB_BUCKETS = SUB_BUCKETS >> 1
+# Largest recordable value: 2**MAX_VALUE_BITS ns (~18 minutes); larger ones land in the last bucket.
+MAX_VALUE_BITS = 40
+BUCKET_COUNT = (MAX_VALUE_BITS - SUB_BUCKET_BITS) * HALF_SUB_BUCKETS + SUB_BUCKETS
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+# Hot paths time one event in TIMING_SAMPLE_RATE (a power of two) and count every event:
+# two clock reads and a histogram update cost as much as a small handler.
+TIMING_SAMPLE_RATE = 16
+TIMING_SAMPLE_MASK = TIMING_SAMPLE_RATE - 1
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class Histogram:
+    """HDR-style log-linear histogram of non-negative integers (nanoseconds).
+
+    Values below SUB_BUCKETS get one bucket each; above that every power of
+    two is split into HALF_SUB_BUCKETS linear buckets, so recording is a
+    bit_length, a shift and an array increment, and quantiles keep a
+    bounded relative error over the whole range without storing samples.
+    """
+
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * BUCKET_COUNT))
+        self.count = 0
+        self.sum = 0
+
+    def record(self, value):
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        if shift <= 0:
+            index = value if value > 0 else 0
+        else:
+            index = shift * HALF_SUB_BUCKETS + (value >> shift)
+            if index >= BUCKET_COUNT:
+                index = BUCKET_COUNT - 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def time(self):
+        return HistogramTimer(self)
+
+    @staticmethod
+    def bucket_range(index):
+        if index < SUB_BUCKETS:
+            return index, index + 1
+        shift = (index - SUB_BUCKETS) // HALF_SUB_BUCKETS + 1
+        mantissa = index - shift * HALF_SUB_BUCKETS
+        return mantissa << shift, (mantissa + 1) << shift
+
+    def quantiles(self, fractions=QUANTILES):
+        """Midpoints of the buckets holding each quantile, in recording units."""
+        results = []
+        if not self.count:
+            return [float("nan")] * len(fractions)
+        targets = [max(1, fraction * self.count) for fraction in fractions]
+        seen = 0
+        position = 0
+        for index, count in enumerate(self.counts):
+            if not count:
+                continue
+            seen += count
+            while position < len(targets) and seen >= targets[position]:
+                low, high = self.bucket_range(index)
+                results.append((low + high) / 2)
+                position += 1
+            if position == len(targets):
+                break
+        return results
+
+
+class HistogramTimer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.record(time.perf_counter_ns() - self.started)
+
+
+class Family:
+    """Named metric with optional labels; labels() returns (and caches) one child per label set."""
+
+    def __init__(self, name, help_text, kind, labelnames, factory):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = labelnames
+        self.factory = factory
+        self.children = {}
+        if not labelnames:
+            # Unlabeled metrics are exported (as zero) before their first update.
+            self.labels()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.factory()
+        return child
+
+    def label_text(self, values, extra=""):
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self, lines):
+        kind = "summary" if self.kind == "histogram" else self.kind
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} {kind}")
+        for values, child in list(self.children.items()):
+            if self.kind == "histogram":
+                # Nanoseconds are recorded, seconds are exposed.
+                for fraction, value in zip(QUANTILES, child.quantiles()):
+                    quantile = f'quantile="{fraction}"'
+                    lines.append(f"{self.name}{self.label_text(values, quantile)} {value / 1e9:.9g}")
+                lines.append(f"{self.name}_sum{self.label_text(values)} {child.sum / 1e9:.9g}")
+                lines.append(f"{self.name}_count{self.label_text(values)} {child.count}")
+            else:
+                lines.append(f"{self.name}{self.label_text(values)} {child.value}")
+
+
+class CallbackFamily:
+    """Metric whose value is computed at scrape time (queue depths, store sizes)."""
+
+    def __init__(self, name, help_text, kind, function):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.function = function
+
+    def render(self, lines):
+        try:
+            value = self.function()
+        except Exception:
+            return
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        lines.append(f"{self.name} {value}")
+
+
+class Registry:
+    def __init__(self):
+        self.families = []
+
+    def add(self, family):
+        self.families.append(family)
+        return family
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.add(Family(name, help_text, "counter", labelnames, Counter))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self.add(Family(name, help_text, "gauge", labelnames, Gauge))
+
+    def histogram(self, name, help_text, labelnames=()):
+        return self.add(Family(name, help_text, "histogram", labelnames, Histogram))
+
+    def callback(self, name, help_text, function, kind="gauge"):
+        return self.add(CallbackFamily(name, help_text, kind, function))
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format (0.0.4)."""
+        lines = []
+        for family in self.families:
+            family.render(lines)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class StatsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=STATS_PORT, host=STATS_HOST, metrics_registry=registry):
+    """Serves metrics_registry at http://host:port/metrics from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), StatsHandler)
+    server.daemon_threads = True
+    server.registry = metrics_registry
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,25 +1,296 @@
+import heapq
+import math
+import os
+import re
 import time
+from array import array
 from prettytable import PrettyTable
 from rich.console import Console
 from rich.table import Table
+from rollups import RollupTier
+from segments import SegmentStore
 
 console = Console()
-# Global dictionary to store metrics: {agent_id: {task_id: [(timestamp, metric)]}}
+
+# Maximum number of samples kept per (agent, task) series.
+SERIES_CAPACITY = 4096
+# Slots a series starts with; its columns double as needed up to SERIES_CAPACITY.
+INITIAL_SERIES_SIZE = 16
+# Raw samples older than this many seconds are evicted.
+RAW_RETENTION = 3600
+# Downsampled tiers kept per series: (bucket width, retention) in seconds.
+ROLLUP_TIERS = ((60, 6 * 3600), (3600, 7 * 24 * 3600))
+# Range queries use the finest tier returning at most this many points.
+MAX_QUERY_POINTS = 1000
+# Unit codes stored in the unit column; index into this tuple.
+UNITS = ("", "%", "ms", "Mbits/sec", "% packet loss", "MB")
+UNIT_CODES = {unit: code for code, unit in enumerate(UNITS)}
+# Metric kinds carried by batch PDUs, numbered like task types: {kind: (label, unit code)}
+METRIC_KINDS = {
+    1: ("Percentagem de uso da CPU: ", UNIT_CODES["%"]),
+    2: ("Percentagem de uso da RAM: ", UNIT_CODES["%"]),
+    3: ("", UNIT_CODES["ms"]),
+    4: ("", UNIT_CODES["ms"]),
+    5: ("", UNIT_CODES["% packet loss"]),
+    6: ("", UNIT_CODES["Mbits/sec"]),
+    # Agent self-telemetry (telemetry.py), on reserved task ids from telemetry.TELEMETRY_TASK_BASE.
+    10: ("CPU do agente: ", UNIT_CODES["%"]),
+    11: ("Memória do agente: ", UNIT_CODES["MB"]),
+    12: ("Atraso das amostras p99: ", UNIT_CODES["ms"]),
+    13: ("Retransmissões do agente: ", UNIT_CODES[""]),
+    14: ("Falhas de ACK do agente: ", UNIT_CODES[""]),
+    16: ("CPU das tarefas do agente: ", UNIT_CODES["ms"]),
+}
+# Offset that converts stored monotonic timestamps to wall-clock time.
+WALL_CLOCK_OFFSET = time.time() - time.monotonic()
+
+_NUMBER_RE = re.compile(r"(-?\d+(?:\.\d+)?)\s*(% packet loss|%|ms|Mbits/sec)?")
+
+# Global dictionary of series: {(agent_id, task_id): MetricSeries}
 metrics_data = {}
+# Indexes over metrics_data: {agent_id: {task_id: series}} and {task_id: {agent_id: series}}
+series_by_agent = {}
+series_by_task = {}
+# Task types known from the loaded task plans: {task_id: task_type}
+task_types = {}
+# On-disk segment log behind the in-memory series, see enable_persistence().
+persistence = None
+# Keys of the series appended to since the last snapshot, see snapshot_changes().
+changed_series = set()
+
+
+class MetricSeries:
+    """Ring buffer of (monotonic timestamp, value, unit code) columns holding up to capacity samples.
+
+    The columns start at INITIAL_SERIES_SIZE slots and double whenever the
+    ring fills, up to capacity, so one-shot and sparse series stay small;
+    the rollup tiers allocate their buckets on their first sample. Raw
+    samples are kept for RAW_RETENTION seconds only, also when history is
+    replayed offline (load_history): older data survives in the rollups.
+    """
+
+    __slots__ = ("capacity", "timestamps", "values", "units", "head", "count", "label", "last_text", "tiers")
+
+    def __init__(self, capacity=SERIES_CAPACITY):
+        self.capacity = capacity
+        size = min(capacity, INITIAL_SERIES_SIZE)
+        self.timestamps = array("d", bytes(8 * size))
+        self.values = array("d", bytes(8 * size))
+        self.units = array("B", bytes(size))
+        self.head = 0
+        self.count = 0
+        # Text printed before the value (e.g. "Percentagem de uso da CPU: ").
+        self.label = ""
+        # Last non-numeric result (errors such as "Ping failed: ...").
+        self.last_text = ""
+        self.tiers = [RollupTier(resolution, retention) for resolution, retention in ROLLUP_TIERS]
+
+    def append(self, timestamp, value, unit):
+        # Evict raw samples that fell out of the raw retention window.
+        while self.count and self.timestamps[self.index(0)] < timestamp - RAW_RETENTION:
+            self.count -= 1
+        if not math.isnan(value):
+            for tier in self.tiers:
+                tier.add(timestamp, value)
+        if self.count == len(self.units) < self.capacity:
+            self.grow()
+        self.timestamps[self.head] = timestamp
+        self.values[self.head] = value
+        self.units[self.head] = unit
+        self.head = (self.head + 1) % len(self.units)
+        if self.count < len(self.units):
+            self.count += 1
+
+    def grow(self):
+        """Doubles the columns of a full ring (up to capacity), oldest sample first."""
+        head, free = self.head, min(self.capacity, 2 * self.count) - self.count
+        self.timestamps = self.timestamps[head:] + self.timestamps[:head] + array("d", bytes(8 * free))
+        self.values = self.values[head:] + self.values[:head] + array("d", bytes(8 * free))
+        self.units = self.units[head:] + self.units[:head] + array("B", bytes(free))
+        self.head = self.count
+
+    def index(self, i):
+        """Physical slot of the i-th oldest sample."""
+        return (self.head - self.count + i) % len(self.units)
+
+    def __len__(self):
+        return self.count
+
+    def bisect(self, timestamp):
+        """Logical index of the first sample with a timestamp >= timestamp."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamps[self.index(middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def window(self, start, end):
+        """Yields numeric (timestamp, value) samples in [start, end]."""
+        for i in range(self.bisect(start), self.count):
+            slot = self.index(i)
+            timestamp = self.timestamps[slot]
+            if timestamp > end:
+                break
+            value = self.values[slot]
+            if not math.isnan(value):
+                yield timestamp, value
+
+    def __iter__(self):
+        for i in range(self.count):
+            slot = self.index(i)
+            yield self.timestamps[slot], self.values[slot], self.units[slot]
+
+    def format(self, value, unit):
+        if math.isnan(value):
+            return self.last_text
+        if UNITS[unit] in ("", "ms", "Mbits/sec", "MB"):
+            return f"{self.label}{value:.2f} {UNITS[unit]}".rstrip()
+        return f"{self.label}{value:.2f}{UNITS[unit]}"
+
+
+def wall_time(timestamp):
+    """Converts a stored monotonic timestamp to seconds since the epoch."""
+    return timestamp + WALL_CLOCK_OFFSET
+
+def parse_metric(metric):
+    """Splits a textual result into (label, value, unit code); value is NaN if non-numeric."""
+    match = _NUMBER_RE.search(metric)
+    if match is None:
+        return "", math.nan, 0
+    return metric[:match.start()], float(match.group(1)), UNIT_CODES[match.group(2) or ""]
+
+def get_series(agent_id, task_id):
+    series = metrics_data.get((agent_id, task_id))
+    if series is None:
+        series = metrics_data[(agent_id, task_id)] = MetricSeries()
+        series_by_agent.setdefault(agent_id, {})[task_id] = series
+        series_by_task.setdefault(task_id, {})[agent_id] = series
+    return series
+
+def register_task(task_id, task_type):
+    """Records the type of a task so queries can group or filter by it."""
+    task_types[task_id] = task_type
+
+def append_sample(agent_id, task_id, series, timestamp, value, unit):
+    series.append(timestamp, value, unit)
+    changed_series.add((agent_id, task_id))
+    if persistence is not None:
+        persistence.append(wall_time(timestamp), value, task_id, unit, agent_id)
+
+def store_sample(agent_id, task_id, value, unit, timestamp=None):
+    """Stores a numeric sample for the given agent and task."""
+    series = get_series(agent_id, task_id)
+    append_sample(agent_id, task_id, series, time.monotonic() if timestamp is None else timestamp, value, unit)
+    return series
+
+def store_typed_sample(agent_id, task_id, kind, value):
+    """Stores a sample received in a batch PDU, stamped with the server's clock as it is stored.
+
+    The agent's own timestamp is not used: with clock skew, late or
+    retransmitted batches and held metrics it would append out of order,
+    and both the series and the segment log are searched by timestamp.
+    """
+    label, unit = METRIC_KINDS.get(kind, ("", 0))
+    series = get_series(agent_id, task_id)
+    series.label = label
+    append_sample(agent_id, task_id, series, time.monotonic(), value, unit)
+
+def replay(stores):
+    """Loads the history still covered by the rollup tiers, merged in time order across stores."""
+    now = time.time()
+    ranges = [store.read_range(now - ROLLUP_TIERS[-1][1], now) for store in stores]
+    for timestamp, value, task_id, unit, agent_id in heapq.merge(*ranges):
+        get_series(agent_id, task_id).append(timestamp - WALL_CLOCK_OFFSET, value, unit)
+
+def enable_persistence(directory):
+    """Opens the segment log in directory and replays the history still covered by the rollup tiers."""
+    global persistence
+    store = SegmentStore(directory)
+    replay([store])
+    persistence = store
+
+def load_history(directories):
+    """Replays segment logs (e.g. those of a server and its shards) without opening them for writing."""
+    stores = [SegmentStore(directory, read_only=True) for directory in directories if os.path.isdir(directory)]
+    replay(stores)
+
+def close_persistence():
+    global persistence
+    if persistence is not None:
+        persistence.close()
+        persistence = None
+
+def read_history(agent_id, task_id, start, end):
+    """Yields persisted (wall timestamp, value, unit) samples, served from mmap'ed segments."""
+    if persistence is None:
+        return
+    for timestamp, value, _, unit, _ in persistence.read_range(start, end, agent_id, task_id):
+        yield timestamp, value, unit
+
+def query_range(agent_id, task_id, start, end):
+    """Returns (timestamp, min, max, avg, count, last) points for a time range.
+
+    Short recent ranges are answered from raw samples; longer ones from the
+    finest rollup tier that still covers the range within MAX_QUERY_POINTS.
+    """
+    series = metrics_data.get((agent_id, task_id))
+    if series is None:
+        return []
+    now = time.monotonic()
+    if start >= now - RAW_RETENTION and len(series) - series.bisect(start) <= MAX_QUERY_POINTS:
+        return [(ts, value, value, value, 1, value) for ts, value in series.window(start, end)]
+    for tier in series.tiers:
+        if tier.covers(start, now) and (end - start) / tier.resolution <= MAX_QUERY_POINTS:
+            return list(tier.buckets(start, end, now))
+    return list(series.tiers[-1].buckets(start, end, now))
+
+def snapshot():
+    """Picklable copy of every series, for merging the views of several server shards."""
+    changed_series.clear()
+    return dict(metrics_data)
+
+def snapshot_changes():
+    """Picklable copy of the series appended to since the last snapshot, for refreshing a merged view."""
+    changes = {}
+    # pop() rather than iterating: the ingest thread may add keys meanwhile.
+    while changed_series:
+        key = changed_series.pop()
+        changes[key] = metrics_data[key]
+    return changes
+
+def load_snapshot(series_map):
+    """Replaces the local view with series merged from shards; each series lives in one shard."""
+    metrics_data.clear()
+    series_by_agent.clear()
+    series_by_task.clear()
+    merge_snapshot(series_map)
+
+def merge_snapshot(series_map):
+    """Adds or replaces series received from shards in the local view."""
+    for (agent_id, task_id), series in series_map.items():
+        metrics_data[(agent_id, task_id)] = series
+        series_by_agent.setdefault(agent_id, {})[task_id] = series
+        series_by_task.setdefault(task_id, {})[agent_id] = series
 
 def get_metric_for_ack(agent_id, task_id):
-    """Retrieves the metric for the given agent and task."""
-    if agent_id in metrics_data and task_id in metrics_data[agent_id]:
-        return metrics_data[agent_id][task_id]
-    return None
+    """Retrieves the metrics for the given agent and task as (timestamp, metric) tuples."""
+    series = metrics_data.get((agent_id, task_id))
+    if series is None:
+        return None
+    return [(wall_time(ts), series.format(value, unit)) for ts, value, unit in series]
 
 def store_metric(agent_id, task_id, metric):
     """Stores a metric for the given agent and task."""
-    if agent_id not in metrics_data:
-        metrics_data[agent_id] = {}
-    if task_id not in metrics_data[agent_id]:
-        metrics_data[agent_id][task_id] = []
-    metrics_data[agent_id][task_id].append((metric))
+    label, value, unit = parse_metric(metric)
+    series = get_series(agent_id, task_id)
+    if math.isnan(value):
+        series.last_text = metric
+    else:
+        series.label = label
+    append_sample(agent_id, task_id, series, time.monotonic(), value, unit)
 
 def display_metrics():
     """Display all stored metrics using a rich table."""
@@ -27,16 +298,14 @@ def display_metrics():
     table.add_column("Agent ID", justify="center")
     table.add_column("Task ID", justify="center")
     table.add_column("Metrics", justify="left")
-    for agent_id, tasks in metrics_data.items():
-        for task_id, metrics in tasks.items():
-            metrics_str = "\n".join([f"{metric}" for metric in metrics])
-            table.add_row(agent_id, str(task_id), metrics_str)
+    for (agent_id, task_id), series in metrics_data.items():
+        metrics_str = "\n".join(series.format(value, unit) for _, value, unit in series)
+        table.add_row(agent_id, str(task_id), metrics_str)
     console.print(table)
 
 def get_metrics_by_task(task_id):
     """Retrieves metrics for a specific task across all agents."""
     task_metrics = []
-    for agent_id, tasks in metrics_data.items():
-        if task_id in tasks:
-            task_metrics.extend([(agent_id, entry) for entry in tasks[task_id]])
-    return task_metrics
\ No newline at end of file
+    for agent_id, series in series_by_task.get(task_id, {}).items():
+        task_metrics.extend((agent_id, (wall_time(ts), series.format(value, unit))) for ts, value, unit in series)
+    return task_metrics
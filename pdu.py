@@ -0,0 +1,145 @@
+import functools
+import itertools
+import socket
+import struct
+
+REGISTER = 1
+ACK = 2
+# Server to agent: task. Agent to server: text metric result.
+TASK = 3
+EXIT = 4
+BATCH = 5
+BATCH_ACK = 6
+# Agent liveness signal, carries the agent id; not acknowledged.
+HEARTBEAT = 7
+# Server to agent: stop a task removed from the plan. Sequenced and ACKed like tasks.
+CANCEL = 8
+NAMES = {REGISTER: "register", ACK: "ack", TASK: "task", EXIT: "exit", BATCH: "batch", BATCH_ACK: "batch_ack",
+         HEARTBEAT: "heartbeat", CANCEL: "cancel"}
+
+# Type and sequence number (or task id), the prefix of every PDU.
+HEADER = struct.Struct("!B H")
+# Header plus agent id: registration, registration ACKs, heartbeats and results.
+IDENTIFIED = struct.Struct("!B H 3s")
+# Task: type, sequence number, task id, task type, interface check length.
+TASK_HEADER = struct.Struct("!B H H B B")
+# Task trailer: frequency, duration.
+TASK_TRAILER = struct.Struct("!B B")
+# Cancel: type, sequence number, task id.
+CANCEL_PDU = struct.Struct("!B H H")
+BATCH_HEADER = struct.Struct("!B H 3s B")
+# Batch sample: wall-clock timestamp, task id, metric kind, value.
+BATCH_SAMPLE = struct.Struct("!d H B d")
+MAX_BATCH_SAMPLES = 50
+# Task types whose data is an IPv4 destination rather than text.
+ADDRESS_TASK_TYPES = (3, 4, 5)
+# Fixed part of a task PDU: header plus trailer.
+TASK_OVERHEAD = TASK_HEADER.size + TASK_TRAILER.size
+
+
+# Variable-length PDUs get one compiled Struct per shape, packed or unpacked
+# in a single call. This keeps the layout in one place rather than making a
+# message cheaper: struct caches format strings too, and bench_pdu.py shows
+# encode and decode on par with the per-field code it replaced. Senders save
+# by encoding a task once and only stamping it per transmission.
+@functools.lru_cache(maxsize=1024)
+def task_layout(interface_length, data_length):
+    return struct.Struct(f"!B H H B B {interface_length}s {data_length}s B B")
+
+@functools.lru_cache(maxsize=MAX_BATCH_SAMPLES + 1)
+def batch_layout(count):
+    return struct.Struct(BATCH_HEADER.format + " d H B d" * count)
+
+
+def agent_id_bytes(agent_id):
+    return agent_id if isinstance(agent_id, bytes) else agent_id.encode()
+
+def decode_agent_id(raw):
+    return raw.rstrip(b"\0").decode(errors="ignore").strip()
+
+def encode_header(message_type, sequence_number):
+    return HEADER.pack(message_type, sequence_number)
+
+def decode_header(data):
+    """(message type, sequence number) of any PDU; raises struct.error when shorter than 3 bytes."""
+    return HEADER.unpack_from(data)
+
+def encode_identified(message_type, sequence_number, agent_id):
+    return IDENTIFIED.pack(message_type, sequence_number, agent_id_bytes(agent_id))
+
+def decode_identified(data):
+    message_type, sequence_number, agent_id = IDENTIFIED.unpack_from(data)
+    return message_type, sequence_number, decode_agent_id(agent_id)
+
+def encode_task(sequence_number, task):
+    """Task dict (tasks.json format) to a task PDU."""
+    interface_check = task.get("Interface_Check", "").encode()
+    if task["Task_Type"] in ADDRESS_TASK_TYPES:
+        task_data = socket.inet_aton(task["Data"])
+    else:
+        task_data = task["Data"].encode()
+    return task_layout(len(interface_check), len(task_data)).pack(
+        TASK, sequence_number, task["Task_ID"], task["Task_Type"], len(interface_check), interface_check,
+        task_data, task.get("Frequency", 5), task.get("Duration", 30))
+
+def decode_task(data):
+    """Task PDU to the agent's task dict, unpacked in one call."""
+    if len(data) < TASK_OVERHEAD:
+        raise struct.error("PDU de tarefa truncado")
+    interface_length = data[TASK_HEADER.size - 1]
+    data_length = len(data) - TASK_OVERHEAD - interface_length
+    if data_length < 0:
+        raise struct.error("PDU de tarefa truncado")
+    _, sequence_number, task_id, task_type, _, interface_check, task_data, frequency, duration = \
+        task_layout(interface_length, data_length).unpack_from(data)
+    return {
+        "Sequence_Number": sequence_number,
+        "Task_ID": task_id,
+        "Task_Type": task_type,
+        "Interface_Check": interface_check.decode(),
+        "Data": socket.inet_ntoa(task_data) if task_type in ADDRESS_TASK_TYPES else task_data.decode(),
+        "Frequency": frequency,
+        "Duration": duration,
+    }
+
+def stamp(buffer, sequence_number):
+    """Patches the sequence number of a precompiled PDU (a bytearray) in place and returns it.
+
+    One buffer serves every agent a task fans out to: the sender stamps it
+    right before each transmission instead of copying the PDU per agent.
+    """
+    HEADER.pack_into(buffer, 0, buffer[0], sequence_number)
+    return buffer
+
+def encode_cancel(sequence_number, task_id):
+    return CANCEL_PDU.pack(CANCEL, sequence_number, task_id)
+
+def decode_cancel(data):
+    """(sequence number, task id) of a cancel PDU."""
+    _, sequence_number, task_id = CANCEL_PDU.unpack_from(data)
+    return sequence_number, task_id
+
+def encode_result(task_id, agent_id, result):
+    return IDENTIFIED.pack(TASK, task_id, agent_id_bytes(agent_id)) + result.encode()
+
+def decode_result(data):
+    """(task id, agent id, result text) of a metric result PDU."""
+    _, task_id, agent_id = IDENTIFIED.unpack_from(data)
+    return task_id, decode_agent_id(agent_id), str(data[IDENTIFIED.size:], "utf-8", "ignore")
+
+def encode_batch(batch_sequence, agent_id, samples):
+    """Batch PDU of up to MAX_BATCH_SAMPLES (timestamp, task id, kind, value) samples."""
+    return batch_layout(len(samples)).pack(BATCH, batch_sequence, agent_id_bytes(agent_id), len(samples),
+                                           *itertools.chain.from_iterable(samples))
+
+def decode_batch(data):
+    """(batch sequence, agent id, sample iterator).
+
+    The samples are unpacked lazily through a memoryview, so the payload is
+    never copied.
+    """
+    _, batch_sequence, agent_id, count = BATCH_HEADER.unpack_from(data)
+    end = BATCH_HEADER.size + count * BATCH_SAMPLE.size
+    if len(data) < end:
+        raise struct.error(f"lote truncado: {count} amostras anunciadas, {len(data)} bytes")
+    return batch_sequence, decode_agent_id(agent_id), BATCH_SAMPLE.iter_unpack(memoryview(data)[BATCH_HEADER.size:end])
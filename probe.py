@@ -0,0 +1,229 @@
+import asyncio
+import os
+import socket
+import struct
+import threading
+import time
+
+ECHO_PORT = 5007
+PROBE_INTERVAL = 0.2
+PROBE_TIMEOUT = 1.0
+# Results younger than this are shared by latency, jitter and loss tasks on the same host.
+RESULT_TTL = 5.0
+# Most recently used (destination, count) streams remembered for sharing.
+SHARED_LIMIT = 256
+PROBE_MAGIC = b"NMSP"
+# UDP probe payload: magic, stream id, sequence number, send time (perf_counter).
+PROBE = struct.Struct("!4s H H d")
+# ICMP echo header: type, code, checksum, identifier, sequence number.
+ICMP_HEADER = struct.Struct("!B B H H H")
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+
+class ProbeResult:
+    """RTT samples of one probe stream plus the statistics derived from them."""
+
+    def __init__(self, destination, sent):
+        self.destination = destination
+        self.sent = sent
+        # (sequence number, rtt in ms) in arrival order.
+        self.replies = []
+        # CPU seconds the engine's thread spent sending and matching this stream's probes.
+        self.cpu_time = 0.0
+
+    @property
+    def received(self):
+        return len(self.replies)
+
+    @property
+    def avg_rtt(self):
+        return sum(rtt for _, rtt in self.replies) / len(self.replies) if self.replies else None
+
+    @property
+    def jitter(self):
+        """RFC 3550 interarrival jitter, J += (|D| - J) / 16, over consecutive replies."""
+        jitter = 0.0
+        ordered = sorted(self.replies)
+        for (_, previous), (_, current) in zip(ordered, ordered[1:]):
+            jitter += (abs(current - previous) - jitter) / 16
+        return jitter if len(ordered) > 1 else None
+
+    @property
+    def loss(self):
+        return 100.0 * (self.sent - self.received) / self.sent if self.sent else 0.0
+
+    def claim_cpu(self):
+        """Hands out cpu_time once, so a result shared by several tasks is charged to one of them."""
+        cpu_time, self.cpu_time = self.cpu_time, 0.0
+        return cpu_time
+
+
+class ProbeStream:
+    def __init__(self, destination, count):
+        self.result = ProbeResult(destination, count)
+        self.sent_at = {}
+        self.done = asyncio.get_running_loop().create_future()
+
+    def reply(self, sequence_number, received_at):
+        sent_at = self.sent_at.pop(sequence_number, None)
+        if sent_at is not None:
+            self.result.replies.append((sequence_number, (received_at - sent_at) * 1000))
+            if len(self.result.replies) == self.result.sent and not self.done.done():
+                self.done.set_result(self.result)
+
+
+class EchoProtocol(asyncio.DatagramProtocol):
+    """UDP echo responder: reflects every probe datagram to its sender."""
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if data[:4] == PROBE_MAGIC:
+            self.transport.sendto(data, addr)
+
+
+class ProbeProtocol(asyncio.DatagramProtocol):
+    def __init__(self, engine):
+        self.engine = engine
+
+    def datagram_received(self, data, addr):
+        received_at = time.perf_counter()
+        if len(data) >= PROBE.size and data[:4] == PROBE_MAGIC:
+            _, stream_id, sequence_number, _ = PROBE.unpack_from(data)
+            self.engine.reply(stream_id, sequence_number, received_at)
+
+
+def icmp_checksum(data):
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+class ProbeEngine:
+    """In-process, asynchronous multi-target probe engine.
+
+    Runs its own event loop thread. Probes go out as ICMP echo requests when
+    a raw socket can be opened (root/CAP_NET_RAW) and as UDP datagrams to the
+    ECHO_PORT responder otherwise. One stream per destination yields RTT,
+    jitter and loss at once; concurrent or recent requests for the same
+    destination and packet count share that stream instead of probing
+    again; only the SHARED_LIMIT most recently used streams are remembered.
+    With serve_echo the engine also answers UDP probes from peers on port.
+    """
+
+    def __init__(self, port=ECHO_PORT, interval=PROBE_INTERVAL, timeout=PROBE_TIMEOUT, use_icmp=None, serve_echo=True):
+        self.port = port
+        self.serve_echo = serve_echo
+        self.interval = interval
+        self.timeout = timeout
+        self.use_icmp = os.geteuid() == 0 if use_icmp is None else use_icmp
+        self.streams = {}
+        self.next_stream_id = 0
+        # (destination, count) -> (future, started), least recently used first.
+        self.shared = {}
+        self.lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.transport, _ = self.loop.run_until_complete(
+            self.loop.create_datagram_endpoint(lambda: ProbeProtocol(self), local_addr=("0.0.0.0", 0))
+        )
+        if self.serve_echo:
+            try:
+                self.loop.run_until_complete(self.loop.create_datagram_endpoint(EchoProtocol, local_addr=("0.0.0.0", self.port)))
+            except OSError:
+                pass
+        self.icmp_sock = None
+        if self.use_icmp:
+            try:
+                self.icmp_sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+                self.icmp_sock.setblocking(False)
+                self.loop.add_reader(self.icmp_sock, self.icmp_received)
+            except PermissionError:
+                self.icmp_sock = None
+        self.ready.set()
+        self.loop.run_forever()
+
+    def icmp_received(self):
+        while True:
+            try:
+                data = self.icmp_sock.recv(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            received_at = time.perf_counter()
+            header_length = (data[0] & 0x0F) * 4
+            if len(data) < header_length + ICMP_HEADER.size:
+                continue
+            icmp_type, _, _, stream_id, sequence_number = ICMP_HEADER.unpack_from(data, header_length)
+            if icmp_type == ICMP_ECHO_REPLY:
+                self.reply(stream_id, sequence_number, received_at)
+
+    def reply(self, stream_id, sequence_number, received_at):
+        stream = self.streams.get(stream_id)
+        if stream is not None:
+            started = time.thread_time()
+            stream.reply(sequence_number, received_at)
+            stream.result.cpu_time += time.thread_time() - started
+
+    def send_probe(self, stream_id, sequence_number, destination):
+        if self.icmp_sock is not None:
+            payload = PROBE_MAGIC + struct.pack("!d", time.perf_counter())
+            header = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, stream_id, sequence_number)
+            checksum = icmp_checksum(header + payload)
+            packet = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, checksum, stream_id, sequence_number) + payload
+            self.icmp_sock.sendto(packet, (destination, 0))
+        else:
+            self.transport.sendto(PROBE.pack(PROBE_MAGIC, stream_id, sequence_number, time.perf_counter()), (destination, self.port))
+
+    async def probe_stream(self, destination, count):
+        self.next_stream_id = (self.next_stream_id + 1) % 65536
+        stream_id = self.next_stream_id
+        stream = self.streams[stream_id] = ProbeStream(destination, count)
+        try:
+            for sequence_number in range(count):
+                started = time.thread_time()
+                stream.sent_at[sequence_number] = time.perf_counter()
+                try:
+                    self.send_probe(stream_id, sequence_number, destination)
+                except OSError:
+                    pass
+                stream.result.cpu_time += time.thread_time() - started
+                if sequence_number + 1 < count:
+                    await asyncio.sleep(self.interval)
+            try:
+                await asyncio.wait_for(asyncio.shield(stream.done), self.timeout)
+            except asyncio.TimeoutError:
+                pass
+            return stream.result
+        finally:
+            del self.streams[stream_id]
+
+    async def probe_many(self, destinations, count):
+        """Probes every destination concurrently; returns {destination: ProbeResult}."""
+        results = await asyncio.gather(*(self.probe_stream(destination, count) for destination in destinations))
+        return dict(zip(destinations, results))
+
+    def probe(self, destination, count):
+        """Blocking, thread-safe probe of one destination, shared with concurrent callers."""
+        key = (destination, count)
+        with self.lock:
+            future, started = self.shared.pop(key, (None, 0))
+            if future is None or (future.done() and time.monotonic() - started > RESULT_TTL):
+                future = asyncio.run_coroutine_threadsafe(self.probe_stream(destination, count), self.loop)
+                started = time.monotonic()
+            # Reinserted at the end: dicts keep insertion order, so the first key is the least recently used.
+            self.shared[key] = (future, started)
+            if len(self.shared) > SHARED_LIMIT:
+                del self.shared[next(iter(self.shared))]
+        return future.result()
+
@@ -0,0 +1,132 @@
+import math
+import time
+import metrics
+
+GROUP_KEYS = ("agent", "task", "task_type")
+
+
+def percentile(sorted_values, fraction):
+    """Linear-interpolated percentile of an already sorted list."""
+    if not sorted_values:
+        return math.nan
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+def rate(points):
+    """Per-second change between the first and last point of a window."""
+    if len(points) < 2 or points[-1][0] == points[0][0]:
+        return math.nan
+    return (points[-1][1] - points[0][1]) / (points[-1][0] - points[0][0])
+
+AGGREGATES = {
+    "avg": lambda points, values: sum(values) / len(values),
+    "min": lambda points, values: min(values),
+    "max": lambda points, values: max(values),
+    "count": lambda points, values: len(values),
+    "p50": lambda points, values: percentile(sorted(values), 0.50),
+    "p95": lambda points, values: percentile(sorted(values), 0.95),
+    "p99": lambda points, values: percentile(sorted(values), 0.99),
+    "rate": lambda points, values: rate(points),
+}
+
+
+def select_series(agent_id=None, task_id=None, task_type=None):
+    """Yields (agent_id, task_id, series) through the per-agent and per-task indexes."""
+    if agent_id is not None:
+        candidates = ((agent_id, tid, series) for tid, series in metrics.series_by_agent.get(agent_id, {}).items())
+    elif task_id is not None:
+        candidates = ((aid, task_id, series) for aid, series in metrics.series_by_task.get(task_id, {}).items())
+    elif task_type is not None:
+        task_ids = [tid for tid, ttype in metrics.task_types.items() if ttype == task_type]
+        candidates = ((aid, tid, series) for tid in task_ids for aid, series in metrics.series_by_task.get(tid, {}).items())
+    else:
+        candidates = ((aid, tid, series) for (aid, tid), series in metrics.metrics_data.items())
+    for aid, tid, series in candidates:
+        if task_id is not None and tid != task_id:
+            continue
+        if task_type is not None and metrics.task_types.get(tid) != task_type:
+            continue
+        yield aid, tid, series
+
+def series_points(series, start, end):
+    """(timestamp, value) points of a series in a monotonic time range.
+
+    Ranges inside the raw retention are located by binary search over the
+    raw ring; older ranges fall back to the bucket averages of the rollups.
+    A ring that reaches less far back than RAW_RETENTION (its capacity ran
+    out first) is completed with the rollup buckets that end before its
+    oldest sample.
+    """
+    now = time.monotonic()
+    if start < now - metrics.RAW_RETENTION:
+        return rollup_points(series, start, end, now)
+    raw_start = series.timestamps[series.index(0)] if len(series) else end
+    if raw_start <= start:
+        return list(series.window(start, end))
+    resolution = rollup_tier(series, start, now).resolution
+    points = [point for point in rollup_points(series, start, min(end, raw_start), now)
+              if point[0] + resolution <= raw_start]
+    points.extend(series.window(start, end))
+    return points
+
+def rollup_tier(series, start, now):
+    """The finest rollup tier still covering start (the coarsest one otherwise)."""
+    for tier in series.tiers:
+        if tier.covers(start, now):
+            return tier
+    return series.tiers[-1]
+
+def rollup_points(series, start, end, now):
+    return [(bucket[0], bucket[3]) for bucket in rollup_tier(series, start, now).buckets(start, end, now)]
+
+def resolve_range(start=None, end=None, last=None):
+    """Converts wall-clock bounds (or the last N seconds) to monotonic bounds."""
+    now = time.monotonic()
+    if last is not None:
+        return now - last, now
+    start = now - metrics.ROLLUP_TIERS[-1][1] if start is None else start - metrics.WALL_CLOCK_OFFSET
+    end = now if end is None else end - metrics.WALL_CLOCK_OFFSET
+    return start, end
+
+def group_key(group_by, agent_id, task_id):
+    if group_by == "agent":
+        return agent_id
+    if group_by == "task":
+        return task_id
+    if group_by == "task_type":
+        return metrics.task_types.get(task_id)
+    return None
+
+def query(function, agent_id=None, task_id=None, task_type=None, start=None, end=None, last=None, group_by=None):
+    """Aggregates metric values over a time range.
+
+    start/end are wall-clock timestamps (time.time()), or last gives a window
+    of the last N seconds. function is one of AGGREGATES. Returns
+    {group: value}, where group follows group_by ("agent", "task",
+    "task_type") or is None when no grouping is requested.
+    """
+    if function not in AGGREGATES:
+        raise ValueError(f"Função de agregação desconhecida: {function}")
+    if group_by is not None and group_by not in GROUP_KEYS:
+        raise ValueError(f"Agrupamento desconhecido: {group_by}")
+    start, end = resolve_range(start, end, last)
+    groups = {}
+    for aid, tid, series in select_series(agent_id, task_id, task_type):
+        points = series_points(series, start, end)
+        if points:
+            groups.setdefault(group_key(group_by, aid, tid), []).extend(points)
+    results = {}
+    for key, points in groups.items():
+        # Runs from different series merge cheaply: timsort is linear on sorted runs.
+        points.sort()
+        results[key] = AGGREGATES[function](points, [value for _, value in points])
+    return results
+
+def top(function, n=10, task_id=None, task_type=None, last=300, group_by="agent", lowest=False):
+    """Top-n groups by an aggregate, e.g. top("avg", 10, task_type=5) for packet loss."""
+    results = query(function, task_id=task_id, task_type=task_type, last=last, group_by=group_by)
+    ranked = [(key, value) for key, value in results.items() if not math.isnan(value)]
+    ranked.sort(key=lambda item: item[1], reverse=not lowest)
+    return ranked[:n]
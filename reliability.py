@@ -0,0 +1,242 @@
+import random
+import threading
+import time
+
+TIMER_TICK = 0.01
+TIMER_SLOTS = 512
+INITIAL_RTO = 1.0
+MIN_RTO = 0.2
+MAX_RTO = 30.0
+MAX_ATTEMPTS = 5
+# Clock granularity term of the RTO formula (RFC 6298).
+CLOCK_GRANULARITY = 0.01
+
+
+def backoff_delay(attempt, base, cap):
+    """Jittered exponential backoff: uniform in [d/2, d] with d = min(cap, base * 2**attempt).
+
+    The jitter spreads peers that failed together (e.g. every agent after a
+    server restart) so their retries do not arrive in synchronized waves.
+    """
+    delay = min(cap, base * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+
+class Timer:
+    __slots__ = ("tick", "callback", "args", "cancelled")
+
+    def __init__(self, tick, callback, args):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """Hashed timing wheel: O(1) schedule and cancel, expiry driven by advance().
+
+    Each timer lands in slot (deadline tick % slots); advance() walks the
+    slots from the last processed tick to the current one and fires the
+    timers whose tick has come, leaving later rounds in place. Cancellation
+    only flags the timer, which is dropped when its slot is next visited.
+    """
+
+    def __init__(self, tick=TIMER_TICK, slots=TIMER_SLOTS):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.current = int(time.monotonic() / tick)
+        self.lock = threading.Lock()
+
+    def schedule(self, delay, callback, *args):
+        with self.lock:
+            timer = Timer(max(int((time.monotonic() + delay) / self.tick), self.current + 1), callback, args)
+            self.slots[timer.tick % len(self.slots)].append(timer)
+        return timer
+
+    def advance(self):
+        target = int(time.monotonic() / self.tick)
+        expired = []
+        with self.lock:
+            # Beyond one full turn every slot is visited once anyway.
+            start = max(self.current + 1, target - len(self.slots) + 1)
+            for tick in range(start, target + 1):
+                slot = self.slots[tick % len(self.slots)]
+                if not slot:
+                    continue
+                keep = []
+                for timer in slot:
+                    if timer.cancelled:
+                        continue
+                    if timer.tick <= target:
+                        expired.append(timer)
+                    else:
+                        keep.append(timer)
+                slot[:] = keep
+            self.current = max(self.current, target)
+        for timer in expired:
+            if not timer.cancelled:
+                timer.callback(*timer.args)
+
+    def run(self, stop_event):
+        """Drives the wheel from a dedicated thread until stop_event is set."""
+        while not stop_event.wait(self.tick):
+            self.advance()
+
+
+class RttEstimator:
+    """Per-peer SRTT/RTTVAR estimator (Jacobson) with exponential RTO backoff."""
+
+    __slots__ = ("srtt", "rttvar", "rto")
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = INITIAL_RTO
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + max(CLOCK_GRANULARITY, 4 * self.rttvar), MIN_RTO), MAX_RTO)
+
+    def backoff(self):
+        self.rto = min(self.rto * 2, MAX_RTO)
+
+
+class InFlight:
+    __slots__ = ("pdu", "addr", "sent_at", "rto", "attempts", "timer", "callback")
+
+    def __init__(self, pdu, addr, callback):
+        self.pdu = pdu
+        self.addr = addr
+        self.sent_at = 0.0
+        # RTO the last transmission was timed with.
+        self.rto = 0.0
+        self.attempts = 0
+        self.timer = None
+        self.callback = callback
+
+
+def chain(first, second):
+    """One completion callback running both, so replacing an in-flight PDU never loses its waiter."""
+    if first is None or second is None:
+        return first or second
+    def callback(peer, sequence, acked):
+        first(peer, sequence, acked)
+        second(peer, sequence, acked)
+    return callback
+
+
+class RetransmitQueue:
+    """In-flight PDUs indexed by (peer, sequence), retransmitted from a TimerWheel.
+
+    acknowledge() is a dict lookup. The retransmission timeout of each
+    destination address follows its RttEstimator; by Karn's rule only PDUs
+    acknowledged on their first transmission contribute RTT samples, and
+    a timeout doubles the RTO, once per timeout event: PDUs that expire
+    together (a whole window) back it off once, not once each. After
+    max_attempts the PDU is dropped. callback(peer, sequence, acked) runs
+    once per PDU, on ACK or give-up; sending again under a key still in
+    flight replaces the PDU and chains both callbacks.
+    rtt_observer, when set, receives every RTT sample (seconds).
+    """
+
+    def __init__(self, transmit, wheel, max_attempts=MAX_ATTEMPTS):
+        self.transmit = transmit
+        self.wheel = wheel
+        self.max_attempts = max_attempts
+        # {peer: {sequence: InFlight}}
+        self.peers = {}
+        self.total = 0
+        self.estimators = {}
+        self.retransmissions = 0
+        self.rtt_observer = None
+        self.lock = threading.RLock()
+
+    def estimator(self, addr):
+        estimator = self.estimators.get(addr)
+        if estimator is None:
+            estimator = self.estimators[addr] = RttEstimator()
+        return estimator
+
+    def in_flight(self, peer=None):
+        return self.total if peer is None else len(self.peers.get(peer, ()))
+
+    def in_flight_pdus(self, peer):
+        with self.lock:
+            return [entry.pdu for entry in self.peers.get(peer, {}).values()]
+
+    def send(self, peer, sequence, pdu, addr, callback=None):
+        with self.lock:
+            entries = self.peers.setdefault(peer, {})
+            previous = entries.get(sequence)
+            if previous is not None:
+                previous.timer.cancel()
+                callback = chain(previous.callback, callback)
+            else:
+                self.total += 1
+            entry = entries[sequence] = InFlight(pdu, addr, callback)
+            self.transmit_entry(peer, sequence, entry)
+
+    def transmit_entry(self, peer, sequence, entry):
+        entry.attempts += 1
+        entry.sent_at = time.monotonic()
+        entry.rto = self.estimator(entry.addr).rto
+        entry.timer = self.wheel.schedule(entry.rto, self.expire, peer, sequence)
+        self.transmit(entry.pdu, entry.addr)
+
+    def acknowledge(self, peer, sequence):
+        with self.lock:
+            entry = self.pop(peer, sequence)
+            if entry is None:
+                return False
+            if entry.attempts == 1:
+                rtt = time.monotonic() - entry.sent_at
+                self.estimator(entry.addr).sample(rtt)
+                if self.rtt_observer is not None:
+                    self.rtt_observer(rtt)
+        if entry.callback is not None:
+            entry.callback(peer, sequence, True)
+        return True
+
+    def pop(self, peer, sequence):
+        entries = self.peers.get(peer)
+        entry = entries.pop(sequence, None) if entries else None
+        if entry is not None:
+            entry.timer.cancel()
+            self.total -= 1
+            if not entries:
+                del self.peers[peer]
+        return entry
+
+    def expire(self, peer, sequence):
+        with self.lock:
+            entry = self.peers.get(peer, {}).get(sequence)
+            if entry is None:
+                return
+            estimator = self.estimator(entry.addr)
+            # Only the first PDU to expire since the last backoff doubles the RTO.
+            if estimator.rto <= entry.rto:
+                estimator.backoff()
+            if entry.attempts < self.max_attempts:
+                self.retransmissions += 1
+                self.transmit_entry(peer, sequence, entry)
+                return
+            self.pop(peer, sequence)
+        if entry.callback is not None:
+            entry.callback(peer, sequence, False)
+
+    def cancel_peer(self, peer):
+        """Drops every in-flight PDU of a peer without calling back; returns them as sorted (sequence, pdu)."""
+        with self.lock:
+            entries = self.peers.pop(peer, {})
+            for entry in entries.values():
+                entry.timer.cancel()
+                self.total -= 1
+        return sorted((sequence, entry.pdu) for sequence, entry in entries.items())
@@ -0,0 +1,65 @@
+import math
+from array import array
+
+
+class RollupTier:
+    """Downsampled tier of a metric series.
+
+    Samples are folded into fixed-width buckets holding min/max/sum/count/last.
+    Buckets live in a ring sized to the retention, so a bucket older than the
+    retention is overwritten (evicted) when its slot is reused and ignored by
+    queries until then. The ring is allocated by the first add(), so series
+    that never carry a numeric value cost no buckets.
+    """
+
+    __slots__ = ("resolution", "retention", "capacity", "starts", "mins", "maxs", "sums", "counts", "lasts")
+
+    def __init__(self, resolution, retention):
+        self.resolution = resolution
+        self.retention = retention
+        self.capacity = int(retention // resolution) + 1
+        self.starts = None
+
+    def allocate(self):
+        self.starts = array("d", [-math.inf]) * self.capacity
+        self.mins = array("d", bytes(8 * self.capacity))
+        self.maxs = array("d", bytes(8 * self.capacity))
+        self.sums = array("d", bytes(8 * self.capacity))
+        self.counts = array("L", bytes(array("L").itemsize * self.capacity))
+        self.lasts = array("d", bytes(8 * self.capacity))
+
+    def add(self, timestamp, value):
+        if self.starts is None:
+            self.allocate()
+        bucket = int(timestamp // self.resolution)
+        slot = bucket % self.capacity
+        start = bucket * self.resolution
+        if self.starts[slot] != start:
+            self.starts[slot] = start
+            self.mins[slot] = self.maxs[slot] = self.sums[slot] = self.lasts[slot] = value
+            self.counts[slot] = 1
+            return
+        if value < self.mins[slot]:
+            self.mins[slot] = value
+        if value > self.maxs[slot]:
+            self.maxs[slot] = value
+        self.sums[slot] += value
+        self.counts[slot] += 1
+        self.lasts[slot] = value
+
+    def covers(self, start, now):
+        return start >= now - self.retention
+
+    def buckets(self, start, end, now):
+        """Yields (bucket_start, min, max, avg, count, last) for live buckets in [start, end]."""
+        if self.starts is None:
+            return
+        start = max(start, now - self.retention)
+        end = min(end, now)
+        for bucket in range(int(start // self.resolution), int(end // self.resolution) + 1):
+            slot = bucket % self.capacity
+            bucket_start = bucket * self.resolution
+            if self.starts[slot] != bucket_start:
+                continue
+            count = self.counts[slot]
+            yield (bucket_start, self.mins[slot], self.maxs[slot], self.sums[slot] / count, count, self.lasts[slot])
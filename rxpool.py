@@ -0,0 +1,125 @@
+import select
+import socket
+from collections import deque
+
+# Largest datagram accepted; longer ones are dropped and counted as truncated, never cut short.
+MAX_DATAGRAM_SIZE = 8192
+# Preallocated receive slots, reused in turn.
+POOL_SLOTS = 32
+# Datagrams handled per wakeup before yielding back to the caller's loop.
+DRAIN_LIMIT = 32
+
+
+class DatagramReceiver:
+    """Receive path that reads datagrams into a ring of preallocated bytearray slots.
+
+    Every datagram is read with recvmsg_into straight into the next slot
+    and handed to handle(view, addr) as a memoryview over it, so no bytes
+    object is created for the payload. A view stays valid until the ring
+    wraps POOL_SLOTS datagrams later: handlers parse it in place and copy
+    only what they keep. drain() reads every queued datagram, up to
+    DRAIN_LIMIT, per wakeup.
+    """
+
+    def __init__(self, sock, handle, max_size=MAX_DATAGRAM_SIZE, slots=POOL_SLOTS, drain_limit=DRAIN_LIMIT,
+                 on_truncated=None, on_error=None):
+        self.sock = sock
+        self.handle = handle
+        self.max_size = max_size
+        self.slots = [memoryview(bytearray(max_size)) for _ in range(slots)]
+        self.position = 0
+        self.drain_limit = drain_limit
+        self.on_truncated = on_truncated
+        self.on_error = on_error
+        self.received = 0
+        self.truncated = 0
+        self.poller = None
+
+    def wait(self, timeout):
+        """Blocks until a datagram is queued or timeout seconds pass; False on timeout.
+
+        Used instead of a socket timeout, which would make the non-blocking
+        reads of drain() wait as well.
+        """
+        if self.poller is None:
+            self.poller = select.poll()
+            self.poller.register(self.sock, select.POLLIN)
+        return bool(self.poller.poll(timeout * 1000))
+
+    def drain(self):
+        """Handles the queued datagrams, at most drain_limit; returns how many were read."""
+        slots = self.slots
+        count = 0
+        while count < self.drain_limit:
+            view = slots[self.position]
+            try:
+                nbytes, _, flags, addr = self.sock.recvmsg_into((view,), 0, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                # E.g. an ICMP port unreachable reported on the socket.
+                if self.on_error is not None:
+                    self.on_error(e)
+                break
+            count += 1
+            self.position = (self.position + 1) % len(slots)
+            if flags & socket.MSG_TRUNC:
+                self.truncated += 1
+                if self.on_truncated is not None:
+                    self.on_truncated(addr, nbytes)
+                continue
+            self.handle(view[:nbytes], addr)
+        self.received += count
+        return count
+
+
+class DatagramEndpoint:
+    """Non-blocking UDP socket served by an asyncio loop through a DatagramReceiver.
+
+    Replaces the loop's datagram transport, whose reader allocates a bytes
+    object per datagram and reads one per wakeup. sendto() has the same
+    semantics as the transport's: it sends right away and only copies the
+    datagrams the kernel cannot take yet, which are flushed when the socket
+    becomes writable. Like the transport, it must be used from the loop.
+    """
+
+    def __init__(self, loop, sock, handle, max_size=MAX_DATAGRAM_SIZE, on_truncated=None, on_error=None):
+        self.loop = loop
+        self.sock = sock
+        self.on_error = on_error
+        self.backlog = deque()
+        self.receiver = DatagramReceiver(sock, handle, max_size, on_truncated=on_truncated, on_error=on_error)
+        sock.setblocking(False)
+        loop.add_reader(sock.fileno(), self.receiver.drain)
+
+    def sendto(self, data, addr):
+        if not self.backlog:
+            try:
+                self.sock.sendto(data, addr)
+                return
+            except (BlockingIOError, InterruptedError):
+                self.loop.add_writer(self.sock.fileno(), self.flush)
+            except OSError as e:
+                if self.on_error is not None:
+                    self.on_error(e)
+                return
+        self.backlog.append((bytes(data), addr))
+
+    def flush(self):
+        while self.backlog:
+            data, addr = self.backlog[0]
+            try:
+                self.sock.sendto(data, addr)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if self.on_error is not None:
+                    self.on_error(e)
+            self.backlog.popleft()
+        self.loop.remove_writer(self.sock.fileno())
+
+    def close(self):
+        self.loop.remove_reader(self.sock.fileno())
+        if self.backlog:
+            self.loop.remove_writer(self.sock.fileno())
+        self.sock.close()
@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = 16
+# Maximum tasks of each type running at once; bandwidth tests would contaminate each other.
+TYPE_LIMITS = {1: 4, 2: 4, 3: 8, 4: 8, 5: 8, 6: 1}
+DEFAULT_TYPE_LIMIT = 4
+
+
+class TaskScheduler:
+    """Runs agent tasks on a worker pool so the receive loop never waits on them.
+
+    submit() returns immediately. A task whose type is at its concurrency
+    limit waits in a per-type queue, not on a pool thread, and is started as
+    soon as a task of the same type finishes.
+    """
+
+    def __init__(self, workers=MAX_WORKERS, limits=TYPE_LIMITS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="task")
+        self.limits = dict(limits)
+        self.running = {}
+        self.waiting = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def submit(self, task_type, function, *args):
+        with self.lock:
+            if self.running.get(task_type, 0) >= self.limits.get(task_type, DEFAULT_TYPE_LIMIT):
+                self.waiting.setdefault(task_type, deque()).append((function, args))
+                return
+            self.running[task_type] = self.running.get(task_type, 0) + 1
+        self.executor.submit(self.run, task_type, function, args)
+
+    def run(self, task_type, function, args):
+        try:
+            function(*args)
+        finally:
+            with self.lock:
+                queued = self.waiting.get(task_type)
+                if queued and not self.stop_event.is_set():
+                    function, args = queued.popleft()
+                else:
+                    self.running[task_type] -= 1
+                    return
+            self.executor.submit(self.run, task_type, function, args)
+
+    def shutdown(self):
+        self.stop_event.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def periodic(period, duration, stop_event):
+    """Yields once per period for duration seconds, on monotonic deadlines.
+
+    Deadlines are computed from the start time rather than by sleeping after
+    each iteration, so the time spent sampling never accumulates as drift.
+    Each iteration receives how late (in seconds) it fired. Stops early when
+    stop_event is set.
+    """
+    start = time.monotonic()
+    tick = 0
+    while tick * period <= duration:
+        deadline = start + tick * period
+        delay = deadline - time.monotonic()
+        if delay > 0 and stop_event.wait(delay):
+            return
+        yield time.monotonic() - deadline
+        tick += 1
@@ -0,0 +1,165 @@
+import mmap
+import os
+import struct
+import threading
+
+# One fixed-width record per sample: marker, wall timestamp, value, task id, unit code, agent id.
+RECORD = struct.Struct("<B d d H B 3s")
+RECORD_MARKER = 0xA5
+SEGMENT_SIZE = 64 * 1024 * 1024
+COMMIT_INTERVAL = 0.05
+COMMIT_BATCH = 4096
+
+
+class SegmentStore:
+    """Append-only metric log split into rotating fixed-size segment files.
+
+    Appends go to an in-memory batch that a committer thread writes and
+    fsyncs every COMMIT_INTERVAL (group commit), or sooner once COMMIT_BATCH
+    records are waiting. On open, the tail of the last segment is scanned and
+    any torn or zero-filled records are truncated before appending resumes.
+    Reads map segments with mmap and binary search the timestamp column.
+    A read_only store (offline analysis next to a running server) never
+    truncates, creates or appends: a torn tail is only left out of reads.
+    """
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE, commit_interval=COMMIT_INTERVAL, commit_batch=COMMIT_BATCH,
+                 read_only=False):
+        self.directory = directory
+        self.segment_size = segment_size - segment_size % RECORD.size
+        self.commit_interval = commit_interval
+        self.commit_batch = commit_batch
+        # [path, first_timestamp, last_timestamp, committed_bytes] per segment, oldest first.
+        self.segments = []
+        self.batch = bytearray()
+        self.batch_records = 0
+        self.lock = threading.Lock()
+        self.commit_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.file = None
+        self.read_only = read_only
+        if read_only:
+            self.recover()
+            return
+        os.makedirs(directory, exist_ok=True)
+        self.recover()
+        self.committer = threading.Thread(target=self.commit_loop, daemon=True)
+        self.committer.start()
+
+    def segment_path(self, number):
+        return os.path.join(self.directory, f"segment-{number:08d}.seg")
+
+    def recover(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.startswith("segment-") and name.endswith(".seg"))
+        for name in names:
+            path = os.path.join(self.directory, name)
+            size = os.path.getsize(path)
+            valid = size - size % RECORD.size
+            if valid and name == names[-1]:
+                valid = self.scan_tail(path, valid)
+                if valid != size and not self.read_only:
+                    os.truncate(path, valid)
+            if valid:
+                self.segments.append([path, self.timestamp_at(path, 0), self.timestamp_at(path, valid - RECORD.size), valid])
+            elif name == names[-1]:
+                self.segments.append([path, None, None, 0])
+        if self.read_only:
+            return
+        number = int(names[-1][8:16]) if names else 0
+        if not self.segments or self.segments[-1][3] >= self.segment_size:
+            number += 1
+            self.segments.append([self.segment_path(number), None, None, 0])
+        self.file = open(self.segments[-1][0], "ab")
+
+    def scan_tail(self, path, size):
+        """Returns the size of the valid prefix, dropping records without a marker at the tail."""
+        with open(path, "rb") as file, mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) as mapped:
+            while size and mapped[size - RECORD.size] != RECORD_MARKER:
+                size -= RECORD.size
+        return size
+
+    def timestamp_at(self, path, offset):
+        with open(path, "rb") as file:
+            file.seek(offset)
+            return RECORD.unpack(file.read(RECORD.size))[1]
+
+    def append(self, timestamp, value, task_id, unit, agent_id):
+        with self.lock:
+            self.batch += RECORD.pack(RECORD_MARKER, timestamp, value, task_id, unit, agent_id.encode()[:3])
+            self.batch_records += 1
+            pending = self.batch_records
+        if pending >= self.commit_batch:
+            self.wakeup.set()
+            if pending >= 16 * self.commit_batch:
+                # The committer is falling behind: apply backpressure to the writer.
+                self.commit()
+
+    def commit(self):
+        with self.commit_lock:
+            with self.lock:
+                batch, self.batch = self.batch, bytearray()
+                self.batch_records = 0
+            view = memoryview(batch)
+            while view:
+                segment = self.segments[-1]
+                chunk = view[:self.segment_size - segment[3]]
+                self.file.write(chunk)
+                if segment[1] is None:
+                    segment[1] = RECORD.unpack_from(chunk)[1]
+                segment[2] = RECORD.unpack_from(chunk, len(chunk) - RECORD.size)[1]
+                segment[3] += len(chunk)
+                view = view[len(chunk):]
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                if segment[3] >= self.segment_size:
+                    self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        number = int(os.path.basename(self.segments[-1][0])[8:16]) + 1
+        self.segments.append([self.segment_path(number), None, None, 0])
+        self.file = open(self.segments[-1][0], "ab")
+
+    def commit_loop(self):
+        while not self.closed:
+            self.wakeup.wait(self.commit_interval)
+            self.wakeup.clear()
+            if self.batch_records:
+                self.commit()
+
+    def read_range(self, start, end, agent_id=None, task_id=None):
+        """Yields (timestamp, value, task_id, unit, agent_id) for committed records in [start, end]."""
+        agent_key = agent_id.encode()[:3].ljust(3, b"\0") if agent_id is not None else None
+        for path, first, last, size in list(self.segments):
+            if not size or last < start or first > end:
+                continue
+            with open(path, "rb") as file, mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) as mapped:
+                low, high = 0, size // RECORD.size
+                while low < high:
+                    middle = (low + high) // 2
+                    if RECORD.unpack_from(mapped, middle * RECORD.size)[1] < start:
+                        low = middle + 1
+                    else:
+                        high = middle
+                view = memoryview(mapped)[low * RECORD.size:]
+                records = RECORD.iter_unpack(view)
+                try:
+                    for _, timestamp, value, record_task, unit, record_agent in records:
+                        if timestamp > end:
+                            break
+                        if (agent_key is None or record_agent == agent_key) and (task_id is None or record_task == task_id):
+                            yield timestamp, value, record_task, unit, record_agent.rstrip(b"\0").decode()
+                finally:
+                    # The mapping cannot be closed while views of it are alive.
+                    del records
+                    view.release()
+
+    def close(self):
+        if self.read_only:
+            return
+        self.closed = True
+        self.wakeup.set()
+        self.committer.join()
+        self.commit()
+        self.file.close()
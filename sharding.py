@@ -0,0 +1,42 @@
+import multiprocessing
+
+
+class ShardCoordinator:
+    """Starts N server worker processes and talks to them over control pipes.
+
+    Each worker binds the same UDP port with SO_REUSEPORT, so the kernel
+    hashes every agent's address to one worker, which then owns that agent
+    for registration, task delivery and metric ingestion. The coordinator
+    only broadcasts commands and merges the replies.
+    """
+
+    def __init__(self, worker_count, target):
+        self.workers = []
+        for shard in range(worker_count):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=target, args=(shard, child), name=f"nms-shard-{shard}", daemon=True)
+            process.start()
+            self.workers.append((process, parent))
+
+    def broadcast(self, command, *args):
+        """Sends a command to every worker and returns their replies in shard order."""
+        for _, conn in self.workers:
+            conn.send((command, *args))
+        return [conn.recv() for _, conn in self.workers]
+
+    def merged_dict(self, command):
+        merged = {}
+        for reply in self.broadcast(command):
+            merged.update(reply)
+        return merged
+
+    def stop(self):
+        for process, conn in self.workers:
+            try:
+                conn.send(("stop",))
+            except (BrokenPipeError, OSError):
+                pass
+        for process, _ in self.workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
@@ -0,0 +1,245 @@
+import fnmatch
+import json
+import os
+import threading
+
+import pdu
+
+# Characters read per step when streaming a JSON array plan.
+CHUNK_SIZE = 64 * 1024
+# Seconds between mtime checks of watched plan files.
+POLL_INTERVAL = 1.0
+JSONL_SUFFIXES = (".jsonl", ".ndjson")
+GROUPS_FILE = "agent_groups.json"
+WILDCARDS = "*?["
+WHITESPACE = " \t\r\n"
+SEPARATORS = WHITESPACE + ","
+
+
+def iter_tasks(path):
+    """Yields the task dicts of a plan one at a time.
+
+    JSON Lines files (.jsonl/.ndjson, or any file not starting with "[")
+    are parsed line by line; JSON arrays are decoded element by element
+    from CHUNK_SIZE reads, so a large plan is never held as one document.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        head = file.read(CHUNK_SIZE)
+        if path.endswith(JSONL_SUFFIXES) or not head.lstrip(WHITESPACE).startswith("["):
+            yield from iter_lines(head, file)
+        else:
+            yield from iter_array(head, file)
+
+def iter_lines(head, file):
+    pending = head
+    while True:
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+        chunk = file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        pending += chunk
+    if pending.strip():
+        yield json.loads(pending)
+
+def iter_array(buffer, file):
+    decoder = json.JSONDecoder()
+    position = buffer.index("[") + 1
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in SEPARATORS:
+            position += 1
+        if position < len(buffer):
+            if buffer[position] == "]":
+                return
+            try:
+                task, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                position = end
+                yield task
+                continue
+        elif eof:
+            raise json.JSONDecodeError("lista de tarefas sem ']'", buffer, position)
+        # The next element continues in the next chunk.
+        chunk = file.read(CHUNK_SIZE)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def parse_selector(selector):
+    """{"site": "lab"} or "site=lab,os=linux" to a dict of required labels."""
+    if isinstance(selector, dict):
+        return selector
+    labels = {}
+    for term in selector.split(","):
+        name, separator, value = term.partition("=")
+        if not separator:
+            raise ValueError(f"seletor inválido: {selector!r}")
+        labels[name.strip()] = value.strip()
+    return labels
+
+
+class AgentGroups:
+    """Named agent groups and per-agent labels, read from GROUPS_FILE.
+
+    {"groups": {"lab": ["pc1", "pc2"]}, "labels": {"pc1": {"site": "lab"}}}
+
+    A task targets one agent ("Agent_ID"), a wildcard ("Agent_ID": "pc*",
+    matched against registered and known agents), a group ("Group") or a
+    label selector ("Selector").
+    """
+
+    def __init__(self, groups=None, labels=None):
+        self.groups = groups or {}
+        self.labels = labels or {}
+
+    @classmethod
+    def load(cls, path=GROUPS_FILE):
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "r", encoding="utf-8") as file:
+            config = json.load(file)
+        return cls(config.get("groups"), config.get("labels"))
+
+    def known(self):
+        agent_ids = set(self.labels)
+        for members in self.groups.values():
+            agent_ids.update(members)
+        return agent_ids
+
+    def resolve(self, task, registered=()):
+        """Agent ids a task entry targets."""
+        if "Group" in task:
+            try:
+                return list(self.groups[task["Group"]])
+            except KeyError:
+                raise ValueError(f"grupo desconhecido: {task['Group']!r}") from None
+        if "Selector" in task:
+            required = parse_selector(task["Selector"]).items()
+            return sorted(agent_id for agent_id, labels in self.labels.items()
+                          if all(labels.get(name) == value for name, value in required))
+        agent_id = task["Agent_ID"]
+        if any(char in agent_id for char in WILDCARDS):
+            return sorted(fnmatch.filter(self.known().union(registered), agent_id))
+        return [agent_id]
+
+
+def same_pdu(template, other):
+    """Compares two task PDU templates past the header, where the sender stamps sequence numbers in place."""
+    return template[pdu.HEADER.size:] == other[pdu.HEADER.size:]
+
+
+class PlanDiff:
+    """Keys ((agent id, task id)) added, changed and removed by a plan load."""
+
+    __slots__ = ("added", "changed", "removed")
+
+    def __init__(self, added, changed, removed):
+        self.added = added
+        self.changed = changed
+        self.removed = removed
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed)
+
+    def __str__(self):
+        return f"{len(self.added)} novas, {len(self.changed)} alteradas, {len(self.removed)} removidas"
+
+
+class TaskPlan:
+    """The tasks of one plan file, each with its PDU precompiled once.
+
+    An entry is expanded by resolve(task) to the agents it targets; they
+    all share one template buffer, into which the sender stamps each
+    agent's sequence number when the task actually leaves (pdu.stamp).
+    Loading the file again diffs it against the previous load, so
+    unchanged tasks are neither re-encoded nor re-sent, duplicates never
+    pile up, and agents newly matched by a wildcard or selector are added.
+    """
+
+    def __init__(self, path, resolve=None):
+        self.path = path
+        self.resolve = resolve or (lambda task: [task["Agent_ID"]])
+        # (agent id, task id) -> (task entry, task PDU template)
+        self.tasks = {}
+        self.mtime = None
+
+    def modified(self):
+        try:
+            return os.stat(self.path).st_mtime_ns != self.mtime
+        except OSError:
+            return False
+
+    def load(self):
+        # Recorded before parsing: a half-written file is retried only once it changes again.
+        self.mtime = os.stat(self.path).st_mtime_ns
+        loaded = {}
+        for task in iter_tasks(self.path):
+            keys = [(agent_id, task["Task_ID"]) for agent_id in self.resolve(task)]
+            compiled = None
+            for key in keys:
+                previous = self.tasks.get(key)
+                if previous is not None and previous[0] == task:
+                    compiled = previous
+                    break
+            if compiled is None:
+                compiled = (task, bytearray(pdu.encode_task(0, task)))
+            for key in keys:
+                loaded[key] = compiled
+        added = [key for key in loaded if key not in self.tasks]
+        changed = [key for key in loaded if key in self.tasks and not same_pdu(loaded[key][1], self.tasks[key][1])]
+        removed = [key for key in self.tasks if key not in loaded]
+        self.tasks = loaded
+        return PlanDiff(added, changed, removed)
+
+
+class PlanWatcher:
+    """Polls the mtime of loaded plans and hands each reload's diff to on_change(plan, diff)."""
+
+    def __init__(self, on_change, on_error, resolve=None, interval=POLL_INTERVAL):
+        self.on_change = on_change
+        self.on_error = on_error
+        self.resolve = resolve
+        self.interval = interval
+        self.plans = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def load(self, path):
+        """Loads (or reloads) path and watches it from then on; returns the plan and its diff."""
+        path = os.path.abspath(path)
+        with self.lock:
+            plan = self.plans.get(path) or TaskPlan(path, self.resolve)
+            diff = plan.load()
+            self.plans[path] = plan
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        return plan, diff
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.reload(modified_only=True)
+
+    def reload(self, modified_only=False):
+        """Reloads the plans (those modified since their last load) and reports non-empty diffs."""
+        with self.lock:
+            for plan in list(self.plans.values()):
+                if modified_only and not plan.modified():
+                    continue
+                try:
+                    diff = plan.load()
+                except (OSError, ValueError, KeyError) as e:
+                    # The previous plan stays in force.
+                    self.on_error(plan, e)
+                    continue
+                if diff:
+                    self.on_change(plan, diff)
@@ -0,0 +1,130 @@
+import threading
+import time
+
+import psutil
+
+from instrumentation import Counter, Histogram
+
+# Seconds between self-telemetry samples shipped to the server by a bare --telemetry.
+# Shipping is off unless asked for: it adds a handful of series per agent on the server.
+REPORT_INTERVAL = 10.0
+# Budget the agent should stay within on a production host.
+CPU_BUDGET = 5.0          # % of one core, averaged over a report interval
+LAG_BUDGET = 0.1          # seconds, p99 lateness of periodic samples
+# Self-telemetry travels as ordinary batch samples on reserved task ids
+# (TELEMETRY_TASK_BASE + kind), one series per metric on the server.
+TELEMETRY_TASK_BASE = 65000
+# Batch metric kinds; labels and units live in metrics.METRIC_KINDS.
+AGENT_CPU = 10
+AGENT_RSS = 11
+SCHEDULE_LAG_P99 = 12
+RETRANSMISSIONS = 13
+ACK_FAILURES = 14
+TASK_CPU = 16
+
+
+def task_id(kind):
+    return TELEMETRY_TASK_BASE + kind
+
+
+class AgentTelemetry:
+    """What monitoring costs the agent itself.
+
+    Tracks per-task-type CPU time (thread CPU of the worker running the
+    task, plus what other threads spent on its behalf, such as the probe
+    engine's), how late each periodic sample fired against its deadline, and
+    send retries and ACK failures, alongside the agent process's own CPU
+    and resident memory.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.process = psutil.Process()
+        self.task_cpu = {}                 # task type -> [cpu seconds, runs]
+        # CPU charged by helper threads to the task running on each worker thread.
+        self.charged = threading.local()
+        self.schedule_lag = Histogram()    # nanoseconds
+        self.max_lag = 0.0
+        self.ack_failures = Counter()
+        self.started = time.monotonic()
+        self.started_cpu = self.cpu_seconds()
+        self.last_sample = (self.started, self.started_cpu)
+
+    def cpu_seconds(self):
+        times = self.process.cpu_times()
+        return times.user + times.system
+
+    def task_started(self):
+        self.charged.seconds = 0.0
+        return time.thread_time()
+
+    def charge(self, seconds):
+        """Adds CPU another thread spent for the task running on the calling thread."""
+        self.charged.seconds = getattr(self.charged, "seconds", 0.0) + seconds
+
+    def task_finished(self, task_type, started):
+        elapsed = time.thread_time() - started + getattr(self.charged, "seconds", 0.0)
+        with self.lock:
+            totals = self.task_cpu.setdefault(task_type, [0.0, 0])
+            totals[0] += elapsed
+            totals[1] += 1
+
+    def sample_lateness(self, lateness):
+        lateness = max(lateness, 0.0)
+        with self.lock:
+            self.schedule_lag.record(int(lateness * 1e9))
+            self.max_lag = max(self.max_lag, lateness)
+
+    def ack_failed(self):
+        with self.lock:
+            self.ack_failures.inc()
+
+    def interval_cpu_percent(self):
+        """Agent CPU (% of one core) since the previous call."""
+        now, cpu = time.monotonic(), self.cpu_seconds()
+        last_time, last_cpu = self.last_sample
+        self.last_sample = (now, cpu)
+        return (cpu - last_cpu) / max(now - last_time, 1e-9) * 100
+
+    def snapshot(self, retransmissions=0):
+        """Totals since start, as plain numbers."""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        with self.lock:
+            p50, p99 = self.schedule_lag.quantiles((0.5, 0.99))
+            task_cpu = {task_type: tuple(totals) for task_type, totals in self.task_cpu.items()}
+            return {
+                "cpu_percent": (self.cpu_seconds() - self.started_cpu) / elapsed * 100,
+                "rss_mb": self.process.memory_info().rss / 2**20,
+                "lag_p50_ms": p50 / 1e6,
+                "lag_p99_ms": p99 / 1e6,
+                "lag_max_ms": self.max_lag * 1e3,
+                "lag_samples": self.schedule_lag.count,
+                "retransmissions": retransmissions,
+                "ack_failures": self.ack_failures.value,
+                "task_cpu": task_cpu,
+            }
+
+    def within_budget(self, snapshot):
+        """(cpu ok, lag ok); no lag samples yet counts as within budget."""
+        lag_ok = snapshot["lag_samples"] == 0 or snapshot["lag_p99_ms"] <= LAG_BUDGET * 1e3
+        return snapshot["cpu_percent"] <= CPU_BUDGET, lag_ok
+
+    def samples(self, retransmissions=0):
+        """(task id, kind, value) triples for the agent's telemetry task stream."""
+        snapshot = self.snapshot(retransmissions)
+        lag_p99 = snapshot["lag_p99_ms"] if snapshot["lag_samples"] else 0.0
+        values = {
+            AGENT_CPU: self.interval_cpu_percent(),
+            AGENT_RSS: snapshot["rss_mb"],
+            SCHEDULE_LAG_P99: lag_p99,
+            RETRANSMISSIONS: snapshot["retransmissions"],
+            ACK_FAILURES: snapshot["ack_failures"],
+            TASK_CPU: sum(cpu for cpu, _ in snapshot["task_cpu"].values()) * 1e3,
+        }
+        return [(task_id(kind), kind, float(value)) for kind, value in values.items()]
+
+    def report(self, add_sample, retransmissions, stop_event, interval=REPORT_INTERVAL):
+        """Ships samples() through add_sample(task_id, kind, value) every interval until stop_event is set."""
+        while not stop_event.wait(interval):
+            for sample in self.samples(retransmissions()):
+                add_sample(*sample)
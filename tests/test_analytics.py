@@ -0,0 +1,38 @@
+import json
+import time
+
+import pytest
+
+import analytics
+import metrics
+from segments import SegmentStore
+
+
+@pytest.fixture
+def empty_metrics():
+    for state in (metrics.metrics_data, metrics.series_by_agent, metrics.series_by_task, metrics.task_types):
+        state.clear()
+    yield
+    for state in (metrics.metrics_data, metrics.series_by_agent, metrics.series_by_task, metrics.task_types):
+        state.clear()
+
+
+def test_replayed_store_filters_by_task_type(tmp_path, empty_metrics):
+    store = SegmentStore(str(tmp_path / "metrics"))
+    now = time.time()
+    for offset in range(5):
+        store.append(now - 10 + offset, 20.0 + offset, 5, metrics.UNIT_CODES["ms"], "pc1")
+        store.append(now - 10 + offset, 1.0, 6, metrics.UNIT_CODES["ms"], "pc1")
+    store.close()
+    plan = tmp_path / "tasks.json"
+    plan.write_text(json.dumps([
+        {"Agent_ID": "pc1", "Task_ID": 5, "Task_Type": 3, "Data": "10.0.4.10"},
+        {"Agent_ID": "pc1", "Task_ID": 6, "Task_Type": 4, "Data": "10.0.4.10"},
+    ]))
+
+    metrics.load_history([str(tmp_path / "metrics")])
+    analytics.load_task_types(str(plan))
+    selected = analytics.fleet(task_type=3)
+
+    assert selected.keys == [("pc1", 5)]
+    assert selected.values[0].tolist() == [20.0, 21.0, 22.0, 23.0, 24.0]
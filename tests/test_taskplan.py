@@ -0,0 +1,37 @@
+import json
+
+import pdu
+import taskplan
+
+
+def write_plan(path, tasks):
+    path.write_text(json.dumps(tasks))
+
+
+def test_stamped_template_is_unchanged_without_wire_changes(tmp_path):
+    path = tmp_path / "tasks.json"
+    task = {"Agent_ID": "pc1", "Task_ID": 5, "Task_Type": 3, "Data": "10.0.4.10", "Frequency": 3}
+    write_plan(path, [task])
+    plan = taskplan.TaskPlan(str(path))
+    assert plan.load().added == [("pc1", 5)]
+    pdu.stamp(plan.tasks[("pc1", 5)][1], 7)
+
+    # Packet_Count is not part of the task PDU.
+    write_plan(path, [dict(task, Packet_Count=4)])
+    diff = plan.load()
+
+    assert not diff
+    assert str(diff) == "0 novas, 0 alteradas, 0 removidas"
+
+
+def test_wire_change_after_stamp_is_reported(tmp_path):
+    path = tmp_path / "tasks.json"
+    task = {"Agent_ID": "pc1", "Task_ID": 5, "Task_Type": 3, "Data": "10.0.4.10", "Frequency": 3}
+    write_plan(path, [task])
+    plan = taskplan.TaskPlan(str(path))
+    plan.load()
+    pdu.stamp(plan.tasks[("pc1", 5)][1], 7)
+
+    write_plan(path, [dict(task, Frequency=10)])
+
+    assert plan.load().changed == [("pc1", 5)]
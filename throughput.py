@@ -0,0 +1,365 @@
+import errno
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+import rxpool
+
+THROUGHPUT_PORT = 5201
+UDP = 0
+TCP = 1
+PROTOCOLS = {"udp": UDP, "tcp": TCP}
+PROTOCOL_NAMES = {code: name for name, code in PROTOCOLS.items()}
+DEFAULT_DURATION = 10
+# Bits per second; UDP tests are always paced, TCP tests only when a rate is given.
+DEFAULT_UDP_RATE = 100e6
+RATE_SUFFIXES = {"k": 1e3, "m": 1e6, "g": 1e9}
+UDP_DATAGRAM_SIZE = 1470
+TCP_CHUNK_SIZE = 128 * 1024
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+CONNECT_TIMEOUT = 5.0
+# How long a test may wait for its turn in the server's queue.
+QUEUE_TIMEOUT = 300.0
+REPORT_TIMEOUT = 10.0
+# A granted slot is reclaimed this long after the requested duration, even if the agent vanished.
+LEASE_GRACE = 5.0
+# Time left for in-flight UDP datagrams to arrive before the report is computed.
+UDP_DRAIN = 0.25
+DROPPED_SEND_ERRORS = (errno.ENOBUFS, errno.EAGAIN, errno.EINTR, errno.ECONNREFUSED)
+# Senders only sleep once they are this far ahead of their rate.
+PACING_SLACK = 0.002
+REQUEST_MAGIC = b"NMSB"
+# Control connection, agent to server: magic, task id, agent id, protocol, duration (s), rate (bit/s, 0 = unlimited).
+REQUEST = struct.Struct("!4s H 3s B H d")
+# Server to agent once the test may start: test id, granted rate (bit/s), seconds spent queued.
+GRANT = struct.Struct("!I d d")
+# Server to agent after the test: bytes and datagrams received, datagrams lost, receive time (s).
+REPORT = struct.Struct("!Q Q Q d")
+# Head of every UDP test datagram: test id, sequence number.
+DATAGRAM = struct.Struct("!I I")
+
+
+def parse_rate(text):
+    """"100M", "1.5g", "500k" or plain bits per second to bits per second."""
+    text = text.strip().lower()
+    multiplier = RATE_SUFFIXES.get(text[-1:], 1)
+    try:
+        return float(text[:-1] if multiplier != 1 else text) * multiplier
+    except ValueError:
+        raise ValueError(f"taxa inválida: {text!r}") from None
+
+def parse_target(data, default_host=None):
+    """Task data "host[:port] [udp|tcp] [rate]" to (host, port, protocol, rate)."""
+    terms = data.split()
+    host, port, protocol, rate = default_host, THROUGHPUT_PORT, UDP, None
+    if terms and terms[0].lower() not in PROTOCOLS:
+        host, _, port_text = terms.pop(0).partition(":")
+        port = int(port_text) if port_text else THROUGHPUT_PORT
+    for term in terms:
+        if term.lower() in PROTOCOLS:
+            protocol = PROTOCOLS[term.lower()]
+        else:
+            rate = parse_rate(term)
+    if not host:
+        raise ValueError("teste de largura de banda sem destino")
+    if rate is None:
+        rate = DEFAULT_UDP_RATE if protocol == UDP else 0.0
+    return host, port, protocol, rate
+
+def recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("ligação fechada a meio de uma mensagem")
+        received += count
+    return buffer
+
+
+class ThroughputResult:
+    """What the responder measured for one test, plus how long it waited for its slot."""
+
+    def __init__(self, destination, protocol, rate, waited, report):
+        self.destination = destination
+        self.protocol = protocol
+        self.rate = rate
+        self.waited = waited
+        self.bytes, self.datagrams, self.lost, self.elapsed = report
+
+    @property
+    def bits_per_second(self):
+        return self.bytes * 8 / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def mbits_per_second(self):
+        return self.bits_per_second / 1e6
+
+    @property
+    def loss(self):
+        expected = self.datagrams + self.lost
+        return 100.0 * self.lost / expected if expected else 0.0
+
+
+def pace(start, sent, rate, stop_event):
+    """Sleeps until sent bytes are due at rate bits per second; True if stop_event was set."""
+    delay = start + sent * 8 / rate - time.monotonic()
+    if delay > PACING_SLACK:
+        return stop_event.wait(delay) if stop_event is not None else time.sleep(delay)
+    return False
+
+def send_udp(destination, port, test_id, duration, rate, stop_event):
+    """Sends sequence-stamped datagrams from one reused buffer; returns the bytes sent."""
+    buffer = bytearray(UDP_DATAGRAM_SIZE)
+    view = memoryview(buffer)
+    sent = 0
+    sequence_number = 0
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        sock.connect((destination, port))
+        start = time.monotonic()
+        end = start + duration
+        while time.monotonic() < end:
+            DATAGRAM.pack_into(buffer, 0, test_id, sequence_number)
+            try:
+                sent += sock.send(view)
+            except OSError as e:
+                # A full queue, or an ICMP port unreachable reported for an earlier
+                # datagram: this one counts as lost, the report tells what arrived.
+                if e.errno not in DROPPED_SEND_ERRORS:
+                    raise
+            sequence_number += 1
+            if rate and pace(start, sequence_number * UDP_DATAGRAM_SIZE, rate, stop_event):
+                break
+    return sent
+
+def send_tcp(sock, duration, rate, stop_event):
+    """Streams one reused buffer over the control connection; returns the bytes sent."""
+    view = memoryview(bytearray(TCP_CHUNK_SIZE))
+    sent = 0
+    sock.settimeout(duration + LEASE_GRACE)
+    start = time.monotonic()
+    end = start + duration
+    while time.monotonic() < end:
+        sent += sock.send(view)
+        if rate and pace(start, sent, rate, stop_event):
+            break
+        if stop_event is not None and stop_event.is_set():
+            break
+    return sent
+
+def run_test(destination, protocol=UDP, duration=DEFAULT_DURATION, rate=DEFAULT_UDP_RATE, port=THROUGHPUT_PORT,
+             agent_id="", task_id=0, stop_event=None, queue_timeout=QUEUE_TIMEOUT):
+    """Runs one test against a ThroughputResponder, after waiting for the slot its scheduler grants."""
+    with socket.create_connection((destination, port), timeout=CONNECT_TIMEOUT) as control:
+        control.sendall(REQUEST.pack(REQUEST_MAGIC, task_id, agent_id.encode(), protocol, duration, rate))
+        control.settimeout(queue_timeout)
+        test_id, granted_rate, waited = GRANT.unpack(recv_exact(control, GRANT.size))
+        if protocol == UDP:
+            send_udp(destination, port, test_id, duration, granted_rate, stop_event)
+        else:
+            send_tcp(control, duration, granted_rate, stop_event)
+        control.shutdown(socket.SHUT_WR)
+        control.settimeout(REPORT_TIMEOUT)
+        report = REPORT.unpack(recv_exact(control, REPORT.size))
+    return ThroughputResult(destination, protocol, granted_rate, waited, report)
+
+
+class BandwidthScheduler:
+    """Admits bandwidth tests towards the server in arrival order.
+
+    With one slot tests run strictly one after another, so agents never
+    share the link under test. With more slots they run side by side and,
+    given the link capacity, each is held to an equal share of it, so
+    concurrent results stay comparable instead of contaminating each other.
+    """
+
+    def __init__(self, slots=1, capacity=0.0):
+        self.slots = slots
+        self.capacity = capacity
+        self.condition = threading.Condition()
+        # test id -> (agent id, task id, granted rate)
+        self.active = {}
+        self.queue = deque()
+        self.next_test_id = 1
+
+    def share(self, rate):
+        if not self.capacity:
+            return rate
+        share = self.capacity / self.slots
+        return min(rate, share) if rate else share
+
+    def acquire(self, agent_id, task_id, rate, timeout=QUEUE_TIMEOUT):
+        """Blocks until a slot is free and this test is first in line; (test id, rate) or None on timeout."""
+        # A fresh list per call: tickets are told apart by identity, so two
+        # requests for the same (agent, task) never dequeue each other.
+        ticket = [agent_id, task_id]
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.queue.append(ticket)
+            try:
+                while self.queue[0] is not ticket or len(self.active) >= self.slots:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self.condition.wait(remaining):
+                        if self.queue[0] is not ticket or len(self.active) >= self.slots:
+                            return None
+                test_id = self.next_test_id
+                self.next_test_id = self.next_test_id % 0xFFFFFFFF + 1
+                granted = self.share(rate)
+                self.active[test_id] = (agent_id, task_id, granted)
+                return test_id, granted
+            finally:
+                del self.queue[next(index for index, queued in enumerate(self.queue) if queued is ticket)]
+                # The next ticket may be admissible too when several slots are free.
+                self.condition.notify_all()
+
+    def release(self, test_id):
+        with self.condition:
+            self.active.pop(test_id, None)
+            self.condition.notify_all()
+
+    def waiting(self):
+        return len(self.queue)
+
+
+class TestStats:
+    __slots__ = ("bytes", "datagrams", "highest", "first", "last")
+
+    def __init__(self):
+        self.bytes = self.datagrams = 0
+        self.highest = -1
+        self.first = self.last = None
+
+    def add(self, size, sequence_number=-1):
+        now = time.monotonic()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.bytes += size
+        self.datagrams += 1
+        self.highest = max(self.highest, sequence_number)
+
+    def report(self, protocol, duration):
+        elapsed = self.last - self.first if self.first is not None and self.last > self.first else float(duration)
+        if protocol == TCP:
+            return REPORT.pack(self.bytes, 0, 0, elapsed)
+        lost = max(self.highest + 1 - self.datagrams, 0)
+        return REPORT.pack(self.bytes, self.datagrams, lost, elapsed)
+
+
+class ThroughputResponder:
+    """Server end of bandwidth tests, replacing an external iperf server.
+
+    Each test opens a TCP control connection, waits there for the
+    scheduler's grant, then either streams over that connection (TCP) or
+    sends test-id-stamped datagrams to the UDP port, and gets back what the
+    responder received. UDP datagrams are read into rxpool's preallocated
+    slots and TCP streams into one buffer per connection, so receiving never
+    allocates per packet.
+    """
+
+    def __init__(self, ip, port=THROUGHPUT_PORT, scheduler=None, log=None):
+        self.ip = ip
+        self.port = port
+        self.scheduler = scheduler or BandwidthScheduler()
+        self.log = log or (lambda message: None)
+        # test id -> TestStats of the UDP tests in progress.
+        self.udp_tests = {}
+        self.stop_event = threading.Event()
+        self.listener = None
+        self.udp = None
+
+    def start(self):
+        self.listener = socket.create_server((self.ip, self.port))
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        self.udp.bind((self.ip, self.port))
+        for target in (self.accept_loop, self.udp_loop):
+            threading.Thread(target=target, daemon=True).start()
+
+    def accept_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                conn, addr = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve, args=(conn, addr), daemon=True).start()
+
+    def udp_loop(self):
+        receiver = rxpool.DatagramReceiver(self.udp, self.datagram_received, UDP_DATAGRAM_SIZE)
+        while not self.stop_event.is_set():
+            try:
+                if receiver.wait(1.0):
+                    receiver.drain()
+            except (OSError, ValueError):
+                return
+
+    def datagram_received(self, data, addr):
+        if len(data) < DATAGRAM.size:
+            return
+        test_id, sequence_number = DATAGRAM.unpack_from(data)
+        stats = self.udp_tests.get(test_id)
+        if stats is not None:
+            stats.add(len(data), sequence_number)
+
+    def serve(self, conn, addr):
+        with conn:
+            try:
+                conn.settimeout(CONNECT_TIMEOUT)
+                magic, task_id, agent_id, protocol, duration, rate = REQUEST.unpack(recv_exact(conn, REQUEST.size))
+            except (OSError, struct.error):
+                return
+            if magic != REQUEST_MAGIC or protocol not in PROTOCOL_NAMES:
+                return
+            agent_id = agent_id.rstrip(b"\0").decode(errors="ignore")
+            queued_at = time.monotonic()
+            if self.scheduler.waiting() or len(self.scheduler.active) >= self.scheduler.slots:
+                self.log(f"[BANDA] Teste {PROTOCOL_NAMES[protocol]} de {agent_id} (tarefa {task_id}) em espera.")
+            granted = self.scheduler.acquire(agent_id, task_id, rate)
+            if granted is None:
+                return
+            test_id, rate = granted
+            stats = TestStats()
+            try:
+                if protocol == UDP:
+                    self.udp_tests[test_id] = stats
+                conn.sendall(GRANT.pack(test_id, rate, time.monotonic() - queued_at))
+                # The lease: a test that outlives its duration loses the slot,
+                # however steadily it keeps sending.
+                lease = time.monotonic() + duration + LEASE_GRACE
+                if protocol == TCP:
+                    view = memoryview(bytearray(TCP_CHUNK_SIZE))
+                    while True:
+                        remaining = lease - time.monotonic()
+                        if remaining <= 0:
+                            self.log(f"[BANDA] {agent_id} (tarefa {task_id}) excedeu a duração do teste.")
+                            return
+                        conn.settimeout(remaining)
+                        count = conn.recv_into(view)
+                        if not count:
+                            break
+                        stats.add(count)
+                else:
+                    conn.settimeout(lease - time.monotonic())
+                    conn.recv(1)
+                    time.sleep(UDP_DRAIN)
+                    self.udp_tests.pop(test_id, None)
+                report = stats.report(protocol, duration)
+                conn.sendall(report)
+                result = ThroughputResult(addr[0], protocol, rate, 0.0, REPORT.unpack(report))
+                self.log(f"[BANDA] {agent_id} (tarefa {task_id}): {result.mbits_per_second:.2f} Mbits/sec"
+                         f"{f', {result.loss:.1f}% perdidos' if protocol == UDP else ''}.")
+            except OSError:
+                pass
+            finally:
+                self.udp_tests.pop(test_id, None)
+                self.scheduler.release(test_id)
+
+    def close(self):
+        self.stop_event.set()
+        for sock in (self.listener, self.udp):
+            if sock is not None:
+                sock.close()